@@ -1,9 +1,12 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from contextlib import asynccontextmanager
 import logging
 from database.connection import init_db, close_db
+from services.marzban import marzban_client
+from services.monitoring import render_metrics
+from services.http import http_clients
 from api.routers import users, subscriptions, payments, stats, settings, admin
 from api.dependencies import get_current_admin_user
 from bot.config import settings as app_settings
@@ -27,6 +30,8 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("Shutting down FastAPI application...")
     await close_db()
+    await marzban_client.close()
+    await http_clients.close()
 
 
 # Create FastAPI app
@@ -59,6 +64,13 @@ async def health_check():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics endpoint"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -107,6 +119,9 @@ async def toggle_testing_mode(
             
             await session.commit()
             
+            from services.cache import catalog_cache
+            await catalog_cache.invalidate("settings")
+            
             # Update runtime setting
             app_settings.testing_mode = new_mode
             
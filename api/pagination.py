@@ -0,0 +1,98 @@
+import base64
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, func, text, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Opaque cursor pointing just after a row in (created_at, id) order"""
+    payload = json.dumps([created_at.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def keyset_paginate(query, model, cursor: Optional[str], limit: int):
+    """Newest-first page of `query` after `cursor`.
+
+    One extra row is fetched to tell whether another page follows, see
+    `page_rows`. Seeking on (created_at, id) lets every page start with an
+    index lookup instead of skipping OFFSET rows.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.where(tuple_(model.created_at, model.id) < tuple_(created_at, row_id))
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+
+
+def page_rows(rows: List[Any], limit: int, key=lambda row: row) -> Tuple[List[Any], Optional[str]]:
+    """Trim the look-ahead row and build the next cursor; `key` maps a row to its model instance"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = key(rows[-1])
+    return rows, encode_cursor(last.created_at, last.id)
+
+
+async def count_rows(session: AsyncSession, query, model, exact: bool = False) -> Tuple[int, bool]:
+    """Total rows of a filtered query, returns (total, is_estimate).
+
+    Exact counts scan every matching row, so by default the planner's
+    estimate is used: pg_class.reltuples for the whole table, the EXPLAIN
+    row estimate for a filtered query.
+    """
+    if exact:
+        result = await session.execute(select(func.count()).select_from(query.order_by(None).subquery()))
+        return result.scalar(), False
+
+    try:
+        if query.whereclause is None:
+            result = await session.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+                {"table": model.__tablename__}
+            )
+            estimate = result.scalar()
+            # -1 until the table is first vacuumed or analyzed
+            if estimate is not None and estimate >= 0:
+                return estimate, True
+        else:
+            compiled = query.order_by(None).compile(
+                dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+            )
+            result = await session.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}"))
+            plan = result.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]["Plan"]["Plan Rows"]), True
+    except Exception as e:
+        logger.warning(f"Row estimate for {model.__tablename__} failed, counting exactly: {e}")
+
+    return await count_rows(session, query, model, exact=True)
+
+
+def pagination_info(limit: int, next_cursor: Optional[str], total: int, is_estimate: bool) -> Dict[str, Any]:
+    return {
+        "limit": limit,
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
+        "total": total,
+        "total_is_estimate": is_estimate
+    }
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from database.connection import async_session_maker
 from database.models import User, SystemSetting
 from api.dependencies import get_current_admin_user
+from services.cache import catalog_cache
 from sqlalchemy import select
 import json
 import logging
@@ -63,6 +64,7 @@ async def set_testing_mode(
                 session.add(setting)
             
             await session.commit()
+            await catalog_cache.invalidate("settings")
             
             # Update runtime configuration
             from bot.config import settings
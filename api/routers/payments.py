@@ -4,12 +4,14 @@ from sqlalchemy import select, func, and_, or_
 from sqlalchemy.orm import selectinload
 from typing import Dict, Any, List, Optional
 from pydantic import BaseModel
-from datetime import datetime, date
+from datetime import date
+import json
 
 from api.dependencies import get_current_admin_user
+from api.pagination import keyset_paginate, page_rows, count_rows, pagination_info
 from database.connection import get_session as get_db
-from database.models import User, Payment, Subscription
-from services.payment import PaymentManager, YooKassaProvider, WataProvider
+from database.models import User, Payment, PaymentStatus, Subscription, COMPLETED_PAYMENT_STATUSES
+from services.payment import payment_manager, WebhookRejected, webhook_ingestor
 
 router = APIRouter()
 
@@ -33,43 +35,34 @@ class RefundRequest(BaseModel):
 async def get_payments(
     current_admin: User = Depends(get_current_admin_user),
     session: AsyncSession = Depends(get_db),
-    page: int = Query(1, ge=1),
+    cursor: Optional[str] = Query(None),
     limit: int = Query(50, ge=1, le=100),
     status: Optional[str] = Query(None),
     payment_system: Optional[str] = Query(None),
-    user_id: Optional[int] = Query(None)
+    user_id: Optional[int] = Query(None),
+    exact_total: bool = Query(False)
 ) -> Dict[str, Any]:
-    """Get payments list with pagination and filtering"""
+    """Get payments list, newest first, with cursor pagination and filtering"""
     try:
-        offset = (page - 1) * limit
-        
-        query = select(Payment).options(
-            selectinload(Payment.user),
-            selectinload(Payment.subscription)
-        )
+        query = select(Payment)
         
         filters = []
         if status:
             filters.append(Payment.status == status)
         if payment_system:
-            filters.append(Payment.payment_system == payment_system)
+            filters.append(Payment.system == payment_system)
         if user_id:
             filters.append(Payment.user_id == user_id)
         
         if filters:
             query = query.where(and_(*filters))
         
-        query = query.offset(offset).limit(limit).order_by(Payment.created_at.desc())
+        total, total_is_estimate = await count_rows(session, query, Payment, exact=exact_total)
         
-        result = await session.execute(query)
-        payments = result.scalars().all()
-        
-        count_query = select(func.count(Payment.id))
-        if filters:
-            count_query = count_query.where(and_(*filters))
-        
-        total_result = await session.execute(count_query)
-        total = total_result.scalar()
+        result = await session.execute(
+            keyset_paginate(query.options(selectinload(Payment.user)), Payment, cursor, limit)
+        )
+        payments, next_cursor = page_rows(result.scalars().all(), limit)
         
         payment_list = []
         for payment in payments:
@@ -82,14 +75,12 @@ async def get_payments(
                     "first_name": payment.user.first_name,
                     "last_name": payment.user.last_name
                 } if payment.user else None,
-                "subscription_id": payment.subscription_id,
+                "plan_id": payment.plan_id,
                 "amount": float(payment.amount),
                 "currency": payment.currency,
-                "payment_method": payment.payment_method,
-                "payment_system": payment.payment_system,
+                "payment_system": payment.system,
                 "status": payment.status,
-                "external_payment_id": payment.external_payment_id,
-                "description": payment.description,
+                "external_payment_id": payment.external_id,
                 "created_at": payment.created_at,
                 "updated_at": payment.updated_at
             }
@@ -97,13 +88,10 @@ async def get_payments(
         
         return {
             "payments": payment_list,
-            "pagination": {
-                "page": page,
-                "limit": limit,
-                "total": total,
-                "pages": (total + limit - 1) // limit
-            }
+            "pagination": pagination_info(limit, next_cursor, total, total_is_estimate)
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -121,14 +109,14 @@ async def get_payment_stats(
         today = date.today()
         
         total_revenue_query = select(func.sum(Payment.amount)).where(
-            Payment.status == "completed"
+            Payment.status.in_(COMPLETED_PAYMENT_STATUSES)
         )
         total_revenue_result = await session.execute(total_revenue_query)
         total_revenue = float(total_revenue_result.scalar() or 0)
         
         revenue_today_query = select(func.sum(Payment.amount)).where(
             and_(
-                Payment.status == "completed",
+                Payment.status.in_(COMPLETED_PAYMENT_STATUSES),
                 func.date(Payment.created_at) == today
             )
         )
@@ -137,7 +125,7 @@ async def get_payment_stats(
         
         revenue_month_query = select(func.sum(Payment.amount)).where(
             and_(
-                Payment.status == "completed",
+                Payment.status.in_(COMPLETED_PAYMENT_STATUSES),
                 func.extract('year', Payment.created_at) == today.year,
                 func.extract('month', Payment.created_at) == today.month
             )
@@ -149,7 +137,7 @@ async def get_payment_stats(
         total_transactions_result = await session.execute(total_transactions_query)
         total_transactions = total_transactions_result.scalar()
         
-        successful_query = select(func.count(Payment.id)).where(Payment.status == "completed")
+        successful_query = select(func.count(Payment.id)).where(Payment.status.in_(COMPLETED_PAYMENT_STATUSES))
         successful_result = await session.execute(successful_query)
         successful_payments = successful_result.scalar()
         
@@ -256,7 +244,7 @@ async def refund_payment(
                 detail="Payment not found"
             )
         
-        if payment.status != "completed":
+        if payment.status not in COMPLETED_PAYMENT_STATUSES:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Can only refund completed payments"
@@ -270,28 +258,25 @@ async def refund_payment(
                 detail="Refund amount cannot exceed payment amount"
             )
         
+        provider = payment_manager.providers.get(payment.system)
+        if not hasattr(provider, "refund_payment"):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Refund not supported for payment system: {payment.system}"
+            )
+        
         try:
-            payment_service = PaymentManager()
-            
-            if payment.payment_system == "yookassa":
-                provider = YooKassaProvider()
-            elif payment.payment_system == "wata":
-                provider = WataProvider()
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Refund not supported for payment system: {payment.payment_system}"
-                )
-            
             refund_result = await provider.refund_payment(
-                payment.external_payment_id,
+                payment.external_id,
                 float(refund_amount),
                 refund_request.reason
             )
             
             if refund_result.get("success"):
-                payment.status = "refunded"
-                payment.description = f"{payment.description or ''} | Refunded: {refund_request.reason}"
+                payment.status = PaymentStatus.REFUNDED.value
+                metadata = json.loads(payment.meta or "{}")
+                metadata["refund_reason"] = refund_request.reason
+                payment.meta = json.dumps(metadata)
                 await session.commit()
                 
                 return {
@@ -322,107 +307,34 @@ async def refund_payment(
         )
 
 
-@router.post("/webhooks/yookassa")
-async def yookassa_webhook(
-    request: Request,
-    session: AsyncSession = Depends(get_db)
-) -> Dict[str, str]:
-    """Handle YooKassa webhook notifications"""
+async def _ingest_webhook(provider: str, request: Request) -> Dict[str, str]:
+    """Verify, deduplicate and queue a webhook; processing happens in Celery"""
+    body = await request.body()
     try:
-        webhook_data = await request.json()
-        
-        event_type = webhook_data.get("event")
-        payment_data = webhook_data.get("object", {})
-        external_payment_id = payment_data.get("id")
-        
-        if not external_payment_id:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Missing payment ID in webhook"
-            )
-        
-        result = await session.execute(
-            select(Payment).where(Payment.external_payment_id == external_payment_id)
+        # Starlette headers look up names case-insensitively, a plain dict would not
+        queued, event_id = await webhook_ingestor.ingest(provider, request.headers, body)
+    except WebhookRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
         )
-        payment = result.scalar_one_or_none()
-        
-        if not payment:
-            return {"status": "ignored", "reason": "Payment not found"}
-        
-        if event_type == "payment.succeeded":
-            payment.status = "completed"
-            payment.updated_at = datetime.now()
-            await session.commit()
-            
-            return {"status": "processed", "event": "payment_completed"}
-            
-        elif event_type == "payment.canceled":
-            payment.status = "cancelled"
-            payment.updated_at = datetime.now()
-            await session.commit()
-            
-            return {"status": "processed", "event": "payment_cancelled"}
-            
-        elif event_type == "refund.succeeded":
-            payment.status = "refunded"
-            payment.updated_at = datetime.now()
-            await session.commit()
-            
-            return {"status": "processed", "event": "payment_refunded"}
-        
-        return {"status": "ignored", "reason": f"Unhandled event type: {event_type}"}
-        
     except Exception as e:
-        await session.rollback()
+        # Not queued: let the provider retry
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Webhook processing failed: {str(e)}"
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Webhook queueing failed: {str(e)}"
         )
+    
+    return {"status": "queued" if queued else "duplicate", "event_id": event_id}
+
+
+@router.post("/webhooks/yookassa")
+async def yookassa_webhook(request: Request) -> Dict[str, str]:
+    """Handle YooKassa webhook notifications"""
+    return await _ingest_webhook("yookassa", request)
 
 
 @router.post("/webhooks/wata")
-async def wata_webhook(
-    request: Request,
-    session: AsyncSession = Depends(get_db)
-) -> Dict[str, str]:
+async def wata_webhook(request: Request) -> Dict[str, str]:
     """Handle Wata webhook notifications"""
-    try:
-        webhook_data = await request.json()
-        
-        payment_status = webhook_data.get("status")
-        external_payment_id = webhook_data.get("payment_id")
-        
-        if not external_payment_id:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Missing payment ID in webhook"
-            )
-        
-        result = await session.execute(
-            select(Payment).where(Payment.external_payment_id == external_payment_id)
-        )
-        payment = result.scalar_one_or_none()
-        
-        if not payment:
-            return {"status": "ignored", "reason": "Payment not found"}
-        
-        if payment_status == "completed":
-            payment.status = "completed"
-        elif payment_status == "failed":
-            payment.status = "failed"
-        elif payment_status == "cancelled":
-            payment.status = "cancelled"
-        else:
-            return {"status": "ignored", "reason": f"Unknown status: {payment_status}"}
-        
-        payment.updated_at = datetime.now()
-        await session.commit()
-        
-        return {"status": "processed", "payment_status": payment_status}
-        
-    except Exception as e:
-        await session.rollback()
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Webhook processing failed: {str(e)}"
-        )
\ No newline at end of file
+    return await _ingest_webhook("wata", request)
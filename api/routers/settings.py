@@ -8,6 +8,7 @@ from api.dependencies import get_current_admin_user
 from database.connection import get_session as get_db
 from database.models import User, SystemSettings
 from bot.config import settings
+from services.cache import catalog_cache
 
 router = APIRouter()
 
@@ -75,6 +76,7 @@ async def create_or_update_setting(
             session.add(new_setting)
         
         await session.commit()
+        await catalog_cache.invalidate("settings")
         
         return {
             "message": f"Setting '{setting.key}' updated successfully",
@@ -144,6 +146,7 @@ async def delete_setting(
         
         await session.delete(setting)
         await session.commit()
+        await catalog_cache.invalidate("settings")
         
         return {"message": f"Setting '{key}' deleted successfully"}
     except HTTPException:
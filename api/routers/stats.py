@@ -1,9 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from database.connection import async_session_maker
-from database.models import User, Subscription, Payment, SubscriptionStatus
-from database.models.payment import PaymentStatus
+from database.models import User, Subscription, Payment, SubscriptionStatus, COMPLETED_PAYMENT_STATUSES
 from api.dependencies import get_current_admin_user
-from sqlalchemy import select, func, and_, text
+from services.stats import daily_metrics_rollup
+from sqlalchemy import select, func, and_
 from datetime import datetime, timedelta
 from typing import Optional
 import logging
@@ -37,7 +37,7 @@ async def get_overview_stats(current_admin: User = Depends(get_current_admin_use
             # Total revenue
             total_revenue = await session.scalar(
                 select(func.sum(Payment.amount))
-                .where(Payment.status == PaymentStatus.SUCCESS)
+                .where(Payment.status.in_(COMPLETED_PAYMENT_STATUSES))
             ) or 0
             
             # Monthly revenue (current month)
@@ -46,7 +46,7 @@ async def get_overview_stats(current_admin: User = Depends(get_current_admin_use
                 select(func.sum(Payment.amount))
                 .where(
                     and_(
-                        Payment.status == PaymentStatus.SUCCESS,
+                        Payment.status.in_(COMPLETED_PAYMENT_STATUSES),
                         Payment.created_at >= start_of_month
                     )
                 )
@@ -66,7 +66,7 @@ async def get_overview_stats(current_admin: User = Depends(get_current_admin_use
                 select(func.count(Payment.id))
                 .where(
                     and_(
-                        Payment.status == PaymentStatus.SUCCESS,
+                        Payment.status.in_(COMPLETED_PAYMENT_STATUSES),
                         Payment.created_at >= thirty_days_ago
                     )
                 )
@@ -105,41 +105,16 @@ async def get_revenue_stats(
             end_date = datetime.now()
             start_date = end_date - timedelta(days=days)
             
-            # Daily revenue
-            daily_revenue_query = text("""
-                SELECT 
-                    DATE(created_at) as date,
-                    SUM(amount) as revenue,
-                    COUNT(*) as transactions
-                FROM payments 
-                WHERE status = 'success' 
-                AND created_at >= :start_date 
-                AND created_at <= :end_date
-                GROUP BY DATE(created_at)
-                ORDER BY date
-            """)
-            
-            result = await session.execute(
-                daily_revenue_query, 
-                {"start_date": start_date, "end_date": end_date}
-            )
-            daily_data = result.fetchall()
-            
-            # Revenue by payment method
-            method_revenue_query = select(
-                Payment.payment_method,
-                func.sum(Payment.amount).label("revenue"),
-                func.count(Payment.id).label("transactions")
-            ).where(
-                and_(
-                    Payment.status == PaymentStatus.SUCCESS,
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
+            # Daily revenue and revenue by payment system from rollups
+            daily_data = [
+                metric for metric in await daily_metrics_rollup.get_daily_metrics(
+                    session, start_date.date(), end_date.date()
                 )
-            ).group_by(Payment.payment_method)
-            
-            method_result = await session.execute(method_revenue_query)
-            method_data = method_result.all()
+                if metric.transactions
+            ]
+            method_data = await daily_metrics_rollup.get_revenue_by_payment_system(
+                session, start_date.date(), end_date.date()
+            )
             
             # Total for period
             total_revenue = sum(row.revenue for row in daily_data) if daily_data else 0
@@ -164,7 +139,7 @@ async def get_revenue_stats(
                 ],
                 "revenue_by_method": [
                     {
-                        "method": row.payment_method,
+                        "method": row.payment_system,
                         "revenue": float(row.revenue),
                         "transactions": row.transactions
                     }
@@ -187,23 +162,14 @@ async def get_user_stats(current_admin: User = Depends(get_current_admin_user)):
         async with async_session_maker() as session:
             now = datetime.now()
             
-            # User registration stats (last 30 days)
-            registration_query = text("""
-                SELECT 
-                    DATE(created_at) as date,
-                    COUNT(*) as registrations
-                FROM users 
-                WHERE created_at >= :start_date
-                GROUP BY DATE(created_at)
-                ORDER BY date
-            """)
-            
+            # User registration stats (last 30 days) from rollups
             thirty_days_ago = now - timedelta(days=30)
-            reg_result = await session.execute(
-                registration_query,
-                {"start_date": thirty_days_ago}
-            )
-            registration_data = reg_result.fetchall()
+            registration_data = [
+                metric for metric in await daily_metrics_rollup.get_daily_metrics(
+                    session, thirty_days_ago.date()
+                )
+                if metric.new_users
+            ]
             
             # Subscription status distribution
             status_query = select(
@@ -241,7 +207,7 @@ async def get_user_stats(current_admin: User = Depends(get_current_admin_user)):
                 "registrations_30d": [
                     {
                         "date": row.date.isoformat(),
-                        "registrations": row.registrations
+                        "registrations": row.new_users
                     }
                     for row in registration_data
                 ],
@@ -7,8 +7,9 @@ from pydantic import BaseModel
 from datetime import datetime, date
 
 from api.dependencies import get_current_admin_user
+from api.pagination import keyset_paginate, page_rows, count_rows, pagination_info
 from database.connection import get_session as get_db
-from database.models import User, Subscription, VPNConfig, Payment
+from database.models import User, Subscription, SubscriptionStatus, VPNConfig, Payment, COMPLETED_PAYMENT_STATUSES
 from services.marzban.client import MarzbanClient
 
 router = APIRouter()
@@ -33,47 +34,49 @@ class SubscriptionStats(BaseModel):
 async def get_subscriptions(
     current_admin: User = Depends(get_current_admin_user),
     session: AsyncSession = Depends(get_db),
-    page: int = Query(1, ge=1),
+    cursor: Optional[str] = Query(None),
     limit: int = Query(50, ge=1, le=100),
     status: Optional[str] = Query(None),
     is_trial: Optional[bool] = Query(None),
-    user_id: Optional[int] = Query(None)
+    user_id: Optional[int] = Query(None),
+    exact_total: bool = Query(False)
 ) -> Dict[str, Any]:
-    """Get subscriptions list with pagination and filtering"""
+    """Get subscriptions list, newest first, with cursor pagination and filtering"""
     try:
-        offset = (page - 1) * limit
-        
-        query = select(Subscription).options(
-            selectinload(Subscription.user),
-            selectinload(Subscription.vpn_config),
-            selectinload(Subscription.payments)
-        )
+        query = select(Subscription)
         
         filters = []
         if status:
             filters.append(Subscription.status == status)
         if is_trial is not None:
-            filters.append(Subscription.is_trial == is_trial)
+            filters.append(
+                Subscription.status == SubscriptionStatus.TRIAL if is_trial
+                else Subscription.status != SubscriptionStatus.TRIAL
+            )
         if user_id:
             filters.append(Subscription.user_id == user_id)
         
         if filters:
             query = query.where(and_(*filters))
         
-        query = query.offset(offset).limit(limit).order_by(Subscription.created_at.desc())
-        
-        result = await session.execute(query)
-        subscriptions = result.scalars().all()
+        total, total_is_estimate = await count_rows(session, query, Subscription, exact=exact_total)
         
-        count_query = select(func.count(Subscription.id))
-        if filters:
-            count_query = count_query.where(and_(*filters))
-        
-        total_result = await session.execute(count_query)
-        total = total_result.scalar()
+        result = await session.execute(
+            keyset_paginate(
+                query.options(
+                    selectinload(Subscription.plan),
+                    selectinload(Subscription.user).selectinload(User.vpn_configs)
+                ),
+                Subscription, cursor, limit
+            )
+        )
+        subscriptions, next_cursor = page_rows(result.scalars().all(), limit)
         
         subscription_list = []
         for sub in subscriptions:
+            vpn_config = next(
+                (config for config in sub.user.vpn_configs if config.is_active), None
+            ) if sub.user else None
             subscription_data = {
                 "id": sub.id,
                 "user_id": sub.user_id,
@@ -83,32 +86,29 @@ async def get_subscriptions(
                     "first_name": sub.user.first_name,
                     "last_name": sub.user.last_name
                 } if sub.user else None,
-                "plan_type": sub.plan_type,
+                "plan_id": sub.plan_id,
+                "plan_name": sub.plan.name if sub.plan else None,
                 "status": sub.status,
                 "start_date": sub.start_date,
                 "end_date": sub.end_date,
-                "auto_renewal": sub.auto_renewal,
-                "is_trial": sub.is_trial,
+                "auto_renewal": sub.auto_renew,
+                "is_trial": sub.status == SubscriptionStatus.TRIAL,
                 "created_at": sub.created_at,
                 "vpn_config": {
-                    "id": sub.vpn_config.id,
-                    "marzban_user_id": sub.vpn_config.marzban_user_id,
-                    "is_active": sub.vpn_config.is_active,
-                    "last_used_at": sub.vpn_config.last_used_at
-                } if sub.vpn_config else None,
-                "payments_count": len(sub.payments) if sub.payments else 0
+                    "id": vpn_config.id,
+                    "marzban_user_id": vpn_config.marzban_user_id,
+                    "is_active": vpn_config.is_active,
+                    "last_connected_at": vpn_config.last_connected_at
+                } if vpn_config else None
             }
             subscription_list.append(subscription_data)
         
         return {
             "subscriptions": subscription_list,
-            "pagination": {
-                "page": page,
-                "limit": limit,
-                "total": total,
-                "pages": (total + limit - 1) // limit
-            }
+            "pagination": pagination_info(limit, next_cursor, total, total_is_estimate)
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -156,7 +156,7 @@ async def get_subscription_stats(
         
         revenue_today_query = select(func.sum(Payment.amount)).where(
             and_(
-                Payment.status == "completed",
+                Payment.status.in_(COMPLETED_PAYMENT_STATUSES),
                 func.date(Payment.created_at) == today
             )
         )
@@ -165,7 +165,7 @@ async def get_subscription_stats(
         
         revenue_month_query = select(func.sum(Payment.amount)).where(
             and_(
-                Payment.status == "completed",
+                Payment.status.in_(COMPLETED_PAYMENT_STATUSES),
                 func.extract('year', Payment.created_at) == today.year,
                 func.extract('month', Payment.created_at) == today.month
             )
@@ -1,9 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import StreamingResponse
 from database.connection import async_session_maker
 from database.models import User, Subscription, Payment
 from api.dependencies import get_current_admin_user
-from sqlalchemy import select, func, and_, or_
+from api.pagination import keyset_paginate, page_rows, count_rows, pagination_info
+from services.export import STREAMABLE_FORMATS, user_data_exporter
+from sqlalchemy import select, and_, or_, true
 from typing import Optional, List
+from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,74 +15,84 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
+def _search_condition(search: str):
+    """Exact telegram_id lookup for numbers, trigram-indexed substring match otherwise"""
+    term = search.strip()
+    if term.isdigit():
+        return User.telegram_id == int(term)
+    
+    term = term.lstrip("@")
+    pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return or_(
+        User.username.ilike(pattern, escape="\\"),
+        User.first_name.ilike(pattern, escape="\\")
+    )
+
+
 @router.get("/")
 async def get_users(
-    skip: int = Query(0, ge=0),
-    limit: int = Query(50, le=100),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=100),
     search: Optional[str] = None,
     blocked: Optional[bool] = None,
+    exact_total: bool = False,
     current_admin: User = Depends(get_current_admin_user)
 ):
-    """Get list of users with pagination and filtering"""
+    """Get list of users, newest first, with cursor pagination and filtering"""
     try:
         async with async_session_maker() as session:
             query = select(User)
             
             # Apply filters
-            if search:
-                query = query.where(
-                    or_(
-                        User.username.ilike(f"%{search}%"),
-                        User.first_name.ilike(f"%{search}%"),
-                        User.telegram_id.like(f"%{search}%")
-                    )
-                )
+            if search and search.strip():
+                query = query.where(_search_condition(search))
             
             if blocked is not None:
-                query = query.where(User.is_blocked == blocked)
+                query = query.where(
+                    User.status == 'blocked' if blocked else User.status.is_distinct_from('blocked')
+                )
             
-            # Get total count
-            count_result = await session.execute(select(func.count()).select_from(query.subquery()))
-            total = count_result.scalar()
+            total, total_is_estimate = await count_rows(session, query, User, exact=exact_total)
             
-            # Get users with pagination
+            # Latest subscription of each user on the page, in the same query
+            latest_sub = (
+                select(Subscription.status, Subscription.end_date)
+                .where(Subscription.user_id == User.id)
+                .order_by(Subscription.created_at.desc(), Subscription.id.desc())
+                .limit(1)
+                .lateral("latest_sub")
+            )
             users_result = await session.execute(
-                query.offset(skip).limit(limit).order_by(User.created_at.desc())
+                keyset_paginate(
+                    query.add_columns(latest_sub.c.status, latest_sub.c.end_date).outerjoin(latest_sub, true()),
+                    User, cursor, limit
+                )
             )
-            users = users_result.scalars().all()
+            rows, next_cursor = page_rows(users_result.all(), limit, key=lambda row: row[0])
             
             # Format response
             users_data = []
-            for user in users:
-                # Get user's active subscription
-                sub_result = await session.execute(
-                    select(Subscription)
-                    .where(Subscription.user_id == user.id)
-                    .order_by(Subscription.created_at.desc())
-                    .limit(1)
-                )
-                latest_sub = sub_result.scalar_one_or_none()
-                
+            for user, subscription_status, subscription_end in rows:
                 users_data.append({
                     "id": user.id,
                     "telegram_id": user.telegram_id,
                     "username": user.username,
                     "first_name": user.first_name,
                     "last_name": user.last_name,
-                    "is_blocked": user.is_blocked,
-                    "is_admin": user.is_admin,
-                    "created_at": user.created_at.isoformat(),
-                    "subscription_status": latest_sub.status if latest_sub else None,
-                    "subscription_end": latest_sub.end_date.isoformat() if latest_sub and latest_sub.end_date else None
+                    "status": user.status,
+                    "is_blocked": user.status == 'blocked',
+                    "created_at": user.created_at.isoformat() if user.created_at else None,
+                    "subscription_status": subscription_status,
+                    "subscription_end": subscription_end.isoformat() if subscription_end else None
                 })
             
             return {
                 "users": users_data,
-                "total": total,
-                "skip": skip,
-                "limit": limit
+                "pagination": pagination_info(limit, next_cursor, total, total_is_estimate)
             }
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting users: {e}")
         raise HTTPException(
@@ -87,6 +101,27 @@ async def get_users(
         )
 
 
+@router.get("/export")
+async def export_users(
+    format: str = Query("csv", description="csv or csv.gz"),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Stream all users as a CSV download, read from the database in chunks"""
+    if format not in STREAMABLE_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Format must be one of: {', '.join(STREAMABLE_FORMATS)}"
+        )
+    
+    filename = f"users_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
+    logger.info(f"User export streamed to admin {current_admin.telegram_id}")
+    return StreamingResponse(
+        user_data_exporter.stream(format),
+        media_type="application/gzip" if format == "csv.gz" else "text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
 @router.get("/{user_id}")
 async def get_user(
     user_id: int,
@@ -17,12 +17,26 @@ class Settings(BaseSettings):
     marzban_api_token: Optional[str] = None
     marzban_admin_username: str
     marzban_admin_password: str
-    
+    marzban_max_concurrency: int = 10  # Max in-flight requests to Marzban
+    marzban_rate_limit: float = 20.0  # Requests per second (token bucket)
+    marzban_rate_burst: int = 20  # Token bucket capacity
+
     # Payment Systems
     wata_api_key: Optional[str] = None
     wata_secret_key: Optional[str] = None
     yookassa_shop_id: Optional[str] = None
     yookassa_secret_key: Optional[str] = None
+    payment_reconcile_concurrency: int = 5  # Status polls in flight per provider
+    
+    # Outbound HTTP pools (Marzban, payment providers)
+    http_max_connections: int = 50
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30.0
+    http_connect_timeout: float = 5.0
+    http_read_timeout: float = 30.0
+    http_write_timeout: float = 30.0
+    http_pool_timeout: float = 10.0  # Waiting for a free pooled connection
+    http2_enabled: bool = True
     
     # Security
     secret_key: str
@@ -32,6 +46,8 @@ class Settings(BaseSettings):
     # Monitoring
     sentry_dsn: Optional[str] = ""
     prometheus_port: int = 9090
+    bot_metrics_port: int = 8002
+    celery_metrics_port: int = 8001
     
     # Other
     support_username: str = "@support"
@@ -49,8 +65,27 @@ class Settings(BaseSettings):
     referral_bonus_days: int = 30
     referral_friend_bonus_days: int = 7
     
+    # User context cache (bot handlers)
+    user_context_ttl: int = 60  # Redis TTL, seconds
+    user_context_local_ttl: float = 5.0  # In-process LRU TTL, seconds
+    user_context_local_size: int = 10000
+    catalog_cache_max_age: int = 3600  # Safety net if an invalidation is missed, seconds
+    
     # Notification settings
     notification_days_before_expiry: list[int] = [1, 2, 3]
+    broadcast_concurrency: int = 8
+    broadcast_rate_limit: float = 25.0  # Messages per second, Telegram allows ~30
+    
+    # Database backups
+    backup_dir: str = "/app/backups"
+    backup_jobs: int = 4  # Parallel pg_dump workers (each opens a connection)
+    backup_compress_level: int = 6
+    backup_keep_count: int = 30
+    backup_timeout: int = 1200  # Seconds for dump, checksum and verify together; the Celery soft limit is 25 min
+    
+    # Usage statistics storage
+    usage_downsample_after_days: int = 90  # Older months are kept as monthly aggregates only
+    usage_monthly_keep_days: int = 730
     
     
     class Config:
@@ -3,7 +3,7 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardButton
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from database.models import User, Subscription, Payment, PricingPlan, PromoCode, PromoUsage, SubscriptionStatus
+from database.models import User, Subscription, Payment, PromoCode, PromoUsage, SubscriptionStatus
 from database.models.payment import PaymentStatus as DBPaymentStatus, PaymentMethod as DBPaymentMethod, PaymentSystem
 from database.connection import async_session_maker
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -14,8 +14,10 @@ from bot.keyboards.user import (
 )
 from bot.states.payment import PaymentStates
 from services.payment import payment_manager, PaymentMethod
+from services.cache import user_context_cache, catalog_cache, qr_code_cache, UserContext
 from decimal import Decimal
 from datetime import datetime, timedelta
+from typing import Optional
 import uuid
 import logging
 
@@ -32,78 +34,75 @@ DEFAULT_PRICES = {
 }
 
 
+async def render_payment_menu():
+    """Render payment plans text and keyboard"""
+    db_plans = await catalog_cache.get_plans()
+    
+    # Use database plans or defaults
+    if db_plans:
+        plans = {plan.name: {
+            "price": plan.price,
+            "days": plan.duration_days,
+            "discount": 0  # No discount field in PricingPlan model
+        } for plan in db_plans}
+    else:
+        plans = DEFAULT_PRICES
+    
+    text = "💰 **Выберите тарифный план:**\n\n"
+    
+    for plan_name, plan_data in plans.items():
+        price = plan_data["price"]
+        days = plan_data["days"]
+        discount = plan_data["discount"]
+        
+        if plan_name == "Пробный период":
+            plan_title = "🆓 Пробный период (7 дней)"
+        elif plan_name == "monthly":
+            plan_title = "📅 1 месяц"
+        elif plan_name == "quarterly":
+            plan_title = "📅 3 месяца"
+            if discount > 0:
+                plan_title += f" (-{discount}%)"
+        elif plan_name == "yearly":
+            plan_title = "📅 12 месяцев"
+            if discount > 0:
+                plan_title += f" (-{discount}%)"
+        else:
+            plan_title = f"📅 {plan_name}"
+        
+        if plan_name == "Пробный период":
+            text += f"{plan_title}: **БЕСПЛАТНО**\n"
+        else:
+            text += f"{plan_title}: **{price} ₽**\n"
+    
+    text += "\n🎁 Есть промокод? Нажмите соответствующую кнопку!"
+    
+    # Create dynamic keyboard based on actual plans
+    keyboard = create_dynamic_payment_keyboard(plans)
+    
+    return text, keyboard
+
+
 @router.message(Command("pay"))
 @router.callback_query(F.data == "payment")
 async def show_payment_plans(event: Message | CallbackQuery):
     """Show payment plans"""
+    # Rendered once per plans change
+    text, keyboard = await catalog_cache.cached("plans", "payment_menu", render_payment_menu)
     
-    # Create database session
-    session = async_session_maker()
-    try:
-        # Get pricing plans from database
-        result = await session.execute(
-            select(PricingPlan).where(PricingPlan.is_active == True)
+    if isinstance(event, Message):
+        await event.answer(
+            text,
+            reply_markup=keyboard,
+            parse_mode="Markdown"
         )
-        db_plans = result.scalars().all()
-        
-        # Use database plans or defaults
-        if db_plans:
-            plans = {plan.name: {
-                "price": plan.price,
-                "days": plan.duration_days,
-                "discount": 0  # No discount field in PricingPlan model
-            } for plan in db_plans}
-        else:
-            plans = DEFAULT_PRICES
-        
-        text = "💰 **Выберите тарифный план:**\n\n"
-        
-        for plan_name, plan_data in plans.items():
-            price = plan_data["price"]
-            days = plan_data["days"]
-            discount = plan_data["discount"]
-            
-            if plan_name == "Пробный период":
-                plan_title = "🆓 Пробный период (7 дней)"
-            elif plan_name == "monthly":
-                plan_title = "📅 1 месяц"
-            elif plan_name == "quarterly":
-                plan_title = "📅 3 месяца"
-                if discount > 0:
-                    plan_title += f" (-{discount}%)"
-            elif plan_name == "yearly":
-                plan_title = "📅 12 месяцев"
-                if discount > 0:
-                    plan_title += f" (-{discount}%)"
-            else:
-                plan_title = f"📅 {plan_name}"
-            
-            if plan_name == "Пробный период":
-                text += f"{plan_title}: **БЕСПЛАТНО**\n"
-            else:
-                text += f"{plan_title}: **{price} ₽**\n"
-        
-        text += "\n🎁 Есть промокод? Нажмите соответствующую кнопку!"
-        
-        # Create dynamic keyboard based on actual plans
-        keyboard = create_dynamic_payment_keyboard(plans)
-        
-        if isinstance(event, Message):
-            await event.answer(
-                text,
-                reply_markup=keyboard,
-                parse_mode="Markdown"
-            )
-        else:
-            await event.message.edit_text(
-                text,
-                reply_markup=keyboard,
-                parse_mode="Markdown"
-            )
-            await event.answer()
-    
-    finally:
-        await session.close()
+    else:
+        await event.message.edit_text(
+            text,
+            reply_markup=keyboard,
+            parse_mode="Markdown"
+        )
+        await event.answer()
 
 
 @router.callback_query(F.data.startswith("plan_"))
@@ -130,15 +129,7 @@ async def select_payment_plan(callback: CallbackQuery, state: FSMContext):
             db_plan_name = plan_type
         
         # Get plan details
-        result = await async_session.execute(
-            select(PricingPlan).where(
-                and_(
-                    PricingPlan.name == db_plan_name,
-                    PricingPlan.is_active == True
-                )
-            )
-        )
-        db_plan = result.scalar_one_or_none()
+        db_plan = await catalog_cache.get_plan(db_plan_name)
         
         if db_plan:
             price = db_plan.price
@@ -269,25 +260,22 @@ async def enter_promo_code(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(PaymentStates.entering_promo)
-async def process_promo_code(message: Message, state: FSMContext):
+async def process_promo_code(message: Message, state: FSMContext, user_ctx: Optional[UserContext] = None):
     """Process promo code"""
-    async_session = async_session_maker()
     telegram_user_id = message.from_user.id
     
-    try:
-        # Get user first
-        user_result = await async_session.execute(
-            select(User).where(User.telegram_id == telegram_user_id)
+    if user_ctx is None:
+        user_ctx = await user_context_cache.get(telegram_user_id)
+    
+    if not user_ctx:
+        await message.answer(
+            "❌ Пользователь не найден",
+            reply_markup=get_back_button("payment")
         )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            await message.answer(
-                "❌ Пользователь не найден",
-                reply_markup=get_back_button("payment")
-            )
-            return
-        
+        return
+    
+    async_session = async_session_maker()
+    try:
         promo_code = message.text.strip().upper()
         
         # Check if promo code exists and is valid
@@ -326,7 +314,7 @@ async def process_promo_code(message: Message, state: FSMContext):
         result = await async_session.execute(
             select(PromoUsage).where(
                 and_(
-                    PromoUsage.user_id == user.id,
+                    PromoUsage.user_id == user_ctx.user_id,
                     PromoUsage.promo_code_id == promo.id
                 )
             )
@@ -361,28 +349,27 @@ async def process_promo_code(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("pay_"))
-async def process_payment(callback: CallbackQuery, state: FSMContext):
+async def process_payment(callback: CallbackQuery, state: FSMContext, user_ctx: Optional[UserContext] = None):
     """Process payment with selected method"""
-    async_session = async_session_maker()
     telegram_user_id = callback.from_user.id
     
+    if user_ctx is None:
+        user_ctx = await user_context_cache.get(telegram_user_id)
+    
+    if not user_ctx:
+        await callback.answer("Пользователь не найден", show_alert=True)
+        return
+    
+    async_session = async_session_maker()
     try:
-        # Get user first
-        user_result = await async_session.execute(
-            select(User).where(User.telegram_id == telegram_user_id)
-        )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            await callback.answer("Пользователь не найден", show_alert=True)
-            return
-        
         method_str = callback.data.replace("pay_", "")
         
         # Check if in testing mode - skip payments
         try:
             from bot.config import settings
             if getattr(settings, 'testing_mode', False):
+                # Activation updates the user row, so it needs the ORM object
+                user = await async_session.get(User, user_ctx.user_id)
                 await process_testing_mode_payment(callback, user, async_session, state)
                 return
         except:
@@ -429,11 +416,11 @@ async def process_payment(callback: CallbackQuery, state: FSMContext):
                     final_price = max(price - promo.value, Decimal("1"))
         
         # Create order ID
-        order_id = f"vpn_{user.telegram_id}_{int(datetime.now().timestamp())}"
+        order_id = f"vpn_{user_ctx.telegram_id}_{int(datetime.now().timestamp())}"
         
         # Create payment in database
         db_payment = Payment(
-            user_id=user.id,
+            user_id=user_ctx.user_id,
             amount=final_price,
             currency="RUB",
             payment_method=method_str,
@@ -452,8 +439,8 @@ async def process_payment(callback: CallbackQuery, state: FSMContext):
             customer_email=None,
             webhook_url=f"https://yourbot.com/webhook/payment/{provider_name}",
             metadata={
-                "user_id": str(user.id),
-                "telegram_id": str(user.telegram_id),
+                "user_id": str(user_ctx.user_id),
+                "telegram_id": str(user_ctx.telegram_id),
                 "plan_type": plan_type,
                 "days": str(days),
                 "promo_code": promo_code or "",
@@ -559,19 +546,13 @@ async def process_testing_mode_payment(callback: CallbackQuery, user: User, sess
             if current_subscription:
                 current_subscription.status = SubscriptionStatus.EXPIRED
             
-            # Get plan ID from database
-            from sqlalchemy import select
-            plan_result = await session.execute(
-                select(PricingPlan).where(PricingPlan.name == plan_type)
-            )
-            plan = plan_result.scalar_one_or_none()
+            # Get plan ID from catalog
+            plan = await catalog_cache.get_plan(plan_type, active_only=False)
             
             if not plan:
                 # Fallback - try to find any plan or use default
-                plan_result = await session.execute(
-                    select(PricingPlan).where(PricingPlan.is_active == True).limit(1)
-                )
-                plan = plan_result.scalar_one_or_none()
+                plans = await catalog_cache.get_plans()
+                plan = plans[0] if plans else None
                 if not plan:
                     await callback.answer("❌ Планы не найдены", show_alert=True)
                     return
@@ -592,6 +573,7 @@ async def process_testing_mode_payment(callback: CallbackQuery, user: User, sess
         await ensure_vpn_config_for_testing(user, session)
         
         await async_session.commit()
+        await user_context_cache.invalidate(user.telegram_id)
         
         await callback.message.edit_text(
             f"🧪 **ТЕСТОВЫЙ РЕЖИМ - Подписка активирована!**\n\n"
@@ -646,6 +628,7 @@ async def ensure_vpn_config_for_testing(user: User, session: AsyncSession):
                     is_active=True
                 )
                 async_session.add(vpn_config)
+                await qr_code_cache.prerender(vpn_config.config_data)
         
     except Exception as e:
         logger.error(f"Error ensuring VPN config for testing user {user.telegram_id}: {e}")
@@ -691,10 +674,7 @@ async def activate_trial_subscription(callback: CallbackQuery, user: User, sessi
         
         # Get trial plan ID from database
         logger.info(f"Looking for trial plan in database...")
-        result = await session.execute(
-            select(PricingPlan).where(PricingPlan.name == "Пробный период")
-        )
-        trial_plan = result.scalar_one_or_none()
+        trial_plan = await catalog_cache.get_plan("Пробный период", active_only=False)
         
         if not trial_plan:
             logger.error("Trial plan not found in database")
@@ -881,11 +861,13 @@ async def activate_trial_subscription(callback: CallbackQuery, user: User, sessi
         
         logger.info(f"Committing changes to database...")
         await session.commit()
+        await user_context_cache.invalidate(user.telegram_id)
         logger.info(f"Changes committed successfully")
         
         # Check if VPN config was successfully created
         if vpn_config and vpn_config.is_active and vpn_config.config_data:
             config_message = f"🔑 Получите конфигурацию: /config\n\n"
+            await qr_code_cache.prerender(vpn_config.config_data)
             logger.info(f"VPN config ready for user {user.telegram_id}")
         else:
             config_message = f"⚠️ VPN конфигурация готовится. Попробуйте получить её позже: /config\n\n"
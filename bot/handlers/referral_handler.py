@@ -4,18 +4,31 @@ from aiogram.filters import Command
 from database.models import User, ReferralStat, Subscription, SubscriptionStatus
 from database.connection import async_session_maker
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, exists
+from datetime import timedelta
+from typing import Optional
 from bot.keyboards.user import get_back_button
 from bot.config import settings
+from services.cache import user_context_cache, UserContext
 import logging
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+REFERRAL_HISTORY_LIMIT = 20
+
+
+def has_active_subscription():
+    """Correlated EXISTS: the outer User has an active or trial subscription"""
+    return exists().where(
+        Subscription.user_id == User.id,
+        Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL])
+    )
+
 
 @router.message(Command("referral"))
 @router.callback_query(F.data == "referral")
-async def show_referral_info(event: Message | CallbackQuery):
+async def show_referral_info(event: Message | CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Show referral program information"""
     
     # Get telegram_user_id from event
@@ -26,126 +39,109 @@ async def show_referral_info(event: Message | CallbackQuery):
     else:
         return
     
-    # Create database session
-    session = async_session_maker()
-    try:
-        # Get user first
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == telegram_user_id)
-        )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            text = "❌ Пользователь не найден в системе"
-            if isinstance(event, Message):
-                await event.answer(text)
-            else:
-                await event.message.edit_text(text)
-                await event.answer()
-            return
-        
+    if user_ctx is None:
+        user_ctx = await user_context_cache.get(telegram_user_id)
+    
+    if not user_ctx:
+        text = "❌ Пользователь не найден в системе"
+        if isinstance(event, Message):
+            await event.answer(text)
+        else:
+            await event.message.edit_text(text)
+            await event.answer()
+        return
+    
+    async with async_session_maker() as session:
         # Get or create referral stats
         result = await session.execute(
-            select(ReferralStat).where(ReferralStat.user_id == user.id)
+            select(ReferralStat).where(ReferralStat.user_id == user_ctx.user_id)
         )
         referral_stat = result.scalar_one_or_none()
         
         if not referral_stat:
-            referral_stat = ReferralStat(user_id=user.id)
+            referral_stat = ReferralStat(user_id=user_ctx.user_id)
             session.add(referral_stat)
             await session.commit()
             await session.refresh(referral_stat)
         
-        # Get referrals count and their activity
+        # Referrals and those of them with an active subscription
         result = await session.execute(
-            select(User).where(User.referred_by == user.id)
+            select(
+                func.count(User.id),
+                func.count(User.id).filter(has_active_subscription())
+            ).where(User.referred_by == user_ctx.user_id)
         )
-        referrals = result.scalars().all()
-        
-        # Count active referrals (those who have active subscriptions)
-        active_referrals = 0
-        for referral in referrals:
-            result = await session.execute(
-                select(Subscription)
-                .where(Subscription.user_id == referral.id)
-                .where(Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL]))
-            )
-            if result.scalar_one_or_none():
-                active_referrals += 1
-        
-        # Generate referral link
-        bot_username = settings.bot_username.lstrip('@')
-        referral_link = f"https://t.me/{bot_username}?start=ref_{user.telegram_id}"
+        referral_count, active_referrals = result.one()
+    
+    # Generate referral link
+    bot_username = settings.bot_username.lstrip('@')
+    referral_link = f"https://t.me/{bot_username}?start=ref_{user_ctx.telegram_id}"
+    
+    # Calculate available bonus days
+    available_bonus = referral_stat.bonus_days_earned - referral_stat.bonus_days_used
+    
+    text = (
+        f"👥 **Реферальная программа**\n\n"
+        f"🎁 **Ваши бонусы:**\n"
+        f"• Приглашено друзей: **{referral_count}**\n"
+        f"• Активных рефералов: **{active_referrals}**\n"
+        f"• Заработано дней: **{referral_stat.bonus_days_earned}**\n"
+        f"• Использовано дней: **{referral_stat.bonus_days_used}**\n"
+        f"• Доступно к использованию: **{available_bonus}** дней\n\n"
         
-        # Calculate available bonus days
-        available_bonus = referral_stat.bonus_days_earned - referral_stat.bonus_days_used
+        f"📋 **Условия программы:**\n"
+        f"• Вы получаете **{settings.referral_bonus_days} дней** за каждого друга\n"
+        f"• Ваш друг получает **{settings.referral_friend_bonus_days} дней** при первой оплате\n"
+        f"• Бонусы начисляются после первой оплаты реферала\n"
+        f"• Бонусные дни можно использовать для продления подписки\n\n"
         
-        text = (
-            f"👥 **Реферальная программа**\n\n"
-            f"🎁 **Ваши бонусы:**\n"
-            f"• Приглашено друзей: **{len(referrals)}**\n"
-            f"• Активных рефералов: **{active_referrals}**\n"
-            f"• Заработано дней: **{referral_stat.bonus_days_earned}**\n"
-            f"• Использовано дней: **{referral_stat.bonus_days_used}**\n"
-            f"• Доступно к использованию: **{available_bonus}** дней\n\n"
-            
-            f"📋 **Условия программы:**\n"
-            f"• Вы получаете **{settings.referral_bonus_days} дней** за каждого друга\n"
-            f"• Ваш друг получает **{settings.referral_friend_bonus_days} дней** при первой оплате\n"
-            f"• Бонусы начисляются после первой оплаты реферала\n"
-            f"• Бонусные дни можно использовать для продления подписки\n\n"
-            
-            f"🔗 **Ваша реферальная ссылка:**\n"
-            f"`{referral_link}`\n\n"
-            
-            f"📤 **Как пригласить друзей:**\n"
-            f"1. Скопируйте ссылку выше\n"
-            f"2. Отправьте другу в любой мессенджер\n"
-            f"3. Друг регистрируется по вашей ссылке\n"
-            f"4. После его первой оплаты вы оба получите бонусы!"
-        )
+        f"🔗 **Ваша реферальная ссылка:**\n"
+        f"`{referral_link}`\n\n"
         
-        if isinstance(event, Message):
-            await event.answer(
-                text,
-                reply_markup=get_back_button("main_menu"),
-                parse_mode="Markdown",
-                disable_web_page_preview=True
-            )
-        else:
-            await event.message.edit_text(
-                text,
-                reply_markup=get_back_button("main_menu"),
-                parse_mode="Markdown",
-                disable_web_page_preview=True
-            )
-            await event.answer()
+        f"📤 **Как пригласить друзей:**\n"
+        f"1. Скопируйте ссылку выше\n"
+        f"2. Отправьте другу в любой мессенджер\n"
+        f"3. Друг регистрируется по вашей ссылке\n"
+        f"4. После его первой оплаты вы оба получите бонусы!"
+    )
     
-    finally:
-        await session.close()
+    if isinstance(event, Message):
+        await event.answer(
+            text,
+            reply_markup=get_back_button("main_menu"),
+            parse_mode="Markdown",
+            disable_web_page_preview=True
+        )
+    else:
+        await event.message.edit_text(
+            text,
+            reply_markup=get_back_button("main_menu"),
+            parse_mode="Markdown",
+            disable_web_page_preview=True
+        )
+        await event.answer()
 
 
 @router.callback_query(F.data == "use_bonus_days")
-async def use_bonus_days(callback: CallbackQuery):
+async def use_bonus_days(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Use bonus days to extend subscription"""
     telegram_user_id = callback.from_user.id
     
-    # Create database session
-    session = async_session_maker()
-    try:
-        # Get user first
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == telegram_user_id)
-        )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            await callback.answer("Пользователь не найден", show_alert=True)
-            return
-        
+    if user_ctx is None:
+        user_ctx = await user_context_cache.get(telegram_user_id)
+    
+    if not user_ctx:
+        await callback.answer("Пользователь не найден", show_alert=True)
+        return
+    
+    if not user_ctx.subscription:
+        await callback.answer("У вас нет активной подписки для продления", show_alert=True)
+        return
+    
+    async with async_session_maker() as session:
         # Get referral stats
         result = await session.execute(
-            select(ReferralStat).where(ReferralStat.user_id == user.id)
+            select(ReferralStat).where(ReferralStat.user_id == user_ctx.user_id).with_for_update()
         )
         referral_stat = result.scalar_one_or_none()
         
@@ -159,111 +155,96 @@ async def use_bonus_days(callback: CallbackQuery):
             await callback.answer("У вас нет доступных бонусных дней", show_alert=True)
             return
         
-        # Get current active subscription
-        result = await session.execute(
-            select(Subscription)
-            .where(Subscription.user_id == user.id)
-            .where(Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL]))
-            .order_by(Subscription.created_at.desc())
-        )
-        subscription = result.scalar_one_or_none()
-        
-        if not subscription:
+        subscription = await session.get(Subscription, user_ctx.subscription.id)
+        if not subscription or subscription.status not in (SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL):
             await callback.answer("У вас нет активной подписки для продления", show_alert=True)
             return
         
         # Extend subscription with bonus days
-        from datetime import datetime, timedelta
-        
         subscription.end_date = subscription.end_date + timedelta(days=available_bonus)
         referral_stat.bonus_days_used += available_bonus
         
         await session.commit()
-        
-        await callback.answer(
-            f"✅ Подписка продлена на {available_bonus} дней!",
-            show_alert=True
-        )
-        
-        # Refresh referral info (reload the page)
-        await show_referral_info(callback)
     
-    finally:
-        await session.close()
+    # The cached context still holds the old end date
+    await user_context_cache.invalidate(telegram_user_id)
+    
+    await callback.answer(
+        f"✅ Подписка продлена на {available_bonus} дней!",
+        show_alert=True
+    )
+    
+    # Refresh referral info (reload the page)
+    await show_referral_info(callback)
 
 
 @router.callback_query(F.data == "referral_history")
-async def show_referral_history(callback: CallbackQuery):
+async def show_referral_history(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Show detailed referral history"""
     telegram_user_id = callback.from_user.id
     
-    # Create database session
-    session = async_session_maker()
-    try:
+    if user_ctx is None:
+        user_ctx = await user_context_cache.get(telegram_user_id)
+    
+    if not user_ctx:
+        await callback.message.edit_text(
+            "❌ Пользователь не найден",
+            reply_markup=get_back_button("referral")
+        )
+        await callback.answer()
+        return
+    
+    paid_subscriptions = (
+        select(func.count(Subscription.id))
+        .where(Subscription.user_id == User.id)
+        .where(Subscription.status != SubscriptionStatus.PENDING)
+        .scalar_subquery()
+    )
     
-        # Get user first
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == telegram_user_id)
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(func.count(User.id)).where(User.referred_by == user_ctx.user_id)
         )
-        user = user_result.scalar_one_or_none()
+        total = result.scalar() or 0
         
-        if not user:
-            await callback.message.edit_text(
-                "❌ Пользователь не найден",
-                reply_markup=get_back_button("referral")
-            )
-            await callback.answer()
-            return
-        
-        # Get all referrals with their subscription status
+        # Newest referrals with their subscription status in one query
         result = await session.execute(
-            select(User).where(User.referred_by == user.id).order_by(User.created_at.desc())
+            select(
+                User.first_name,
+                User.created_at,
+                has_active_subscription().label("is_active"),
+                paid_subscriptions.label("payments_count")
+            )
+            .where(User.referred_by == user_ctx.user_id)
+            .order_by(User.created_at.desc())
+            .limit(REFERRAL_HISTORY_LIMIT)
         )
-        referrals = result.scalars().all()
+        referrals = result.all()
+    
+    if not referrals:
+        text = "👥 **История рефералов**\n\nУ вас пока нет приглашенных друзей."
+    else:
+        text = f"👥 **История рефералов** ({total}):\n\n"
         
-        if not referrals:
-            text = "👥 **История рефералов**\n\nУ вас пока нет приглашенных друзей."
-        else:
-            text = f"👥 **История рефералов** ({len(referrals)}):\n\n"
+        for i, referral in enumerate(referrals, 1):
+            status = "✅ Активен" if referral.is_active else "❌ Неактивен"
+            name = referral.first_name or "Пользователь"
             
-            for i, referral in enumerate(referrals[:20], 1):  # Show max 20
-                # Check if referral has active subscription
-                result = await session.execute(
-                    select(Subscription)
-                    .where(Subscription.user_id == referral.id)
-                    .where(Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL]))
-                )
-                active_sub = result.scalar_one_or_none()
-                
-                # Get total payments count
-                result = await session.execute(
-                    select(func.count(Subscription.id))
-                    .where(Subscription.user_id == referral.id)
-                    .where(Subscription.status != SubscriptionStatus.PENDING)
-                )
-                payments_count = result.scalar() or 0
-                
-                status = "✅ Активен" if active_sub else "❌ Неактивен"
-                name = referral.first_name or "Пользователь"
-                
-                text += (
-                    f"{i}. **{name}** {status}\n"
-                    f"   Регистрация: {referral.created_at.strftime('%d.%m.%Y')}\n"
-                    f"   Оплат: {payments_count}\n\n"
-                )
-            
-            if len(referrals) > 20:
-                text += f"... и еще {len(referrals) - 20} рефералов"
+            text += (
+                f"{i}. **{name}** {status}\n"
+                f"   Регистрация: {referral.created_at.strftime('%d.%m.%Y')}\n"
+                f"   Оплат: {referral.payments_count or 0}\n\n"
+            )
         
-        await callback.message.edit_text(
-            text,
-            reply_markup=get_back_button("referral"),
-            parse_mode="Markdown"
-        )
-        await callback.answer()
+        if total > REFERRAL_HISTORY_LIMIT:
+            text += f"... и еще {total - REFERRAL_HISTORY_LIMIT} рефералов"
     
-    finally:
-        await session.close()
+    await callback.message.edit_text(
+        text,
+        reply_markup=get_back_button("referral"),
+        parse_mode="Markdown"
+    )
+    await callback.answer()
 
 
 async def process_referral_bonus(referrer_id: int, referral_id: int, session: AsyncSession):
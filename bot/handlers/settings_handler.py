@@ -5,9 +5,11 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from database.connection import async_session_maker
 from database.models import User
-from sqlalchemy import select, update
+from sqlalchemy import select, update, func
+from typing import Optional
 from bot.keyboards.user import get_back_button
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from services.cache import user_context_cache, UserContext
 import logging
 
 logger = logging.getLogger(__name__)
@@ -57,9 +59,31 @@ def get_settings_keyboard(user) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+SETTINGS_COLUMNS = (User.language_code.label("language"), User.notifications_enabled, User.auto_renew)
+
+SETTINGS_TEXT = (
+    "⚙️ **Настройки**\n\n"
+    "Здесь вы можете настроить параметры вашего аккаунта"
+)
+
+
+async def toggle_setting(user_id: int, column, default: bool):
+    """Flip a boolean user setting in one statement; returns the settings row after the update"""
+    async with async_session_maker() as session:
+        result = await session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values({column: ~func.coalesce(column, default)})
+            .returning(*SETTINGS_COLUMNS)
+        )
+        row = result.first()
+        await session.commit()
+    return row
+
+
 @router.callback_query(F.data == "settings")
 @router.message(Command("settings"))
-async def show_settings(event: Message | CallbackQuery):
+async def show_settings(event: Message | CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Show user settings"""
     
     # Get telegram_user_id
@@ -71,30 +95,28 @@ async def show_settings(event: Message | CallbackQuery):
         answer_func = event.message.edit_text
         await event.answer()
     
-    session = async_session_maker()
     try:
-        # Get user
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == telegram_user_id)
-        )
-        user = user_result.scalar_one_or_none()
+        if user_ctx is None:
+            user_ctx = await user_context_cache.get(telegram_user_id)
         
-        if not user:
+        if not user_ctx:
             await answer_func(
                 "❌ Пользователь не найден в системе\n"
                 "Используйте /start для регистрации"
             )
             return
         
-        text = (
-            "⚙️ **Настройки**\n\n"
-            "Здесь вы можете настроить параметры вашего аккаунта"
-        )
+        # Settings are not part of the cached context
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(*SETTINGS_COLUMNS).where(User.id == user_ctx.user_id)
+            )
+            user_settings = result.first()
         
         await answer_func(
-            text,
+            SETTINGS_TEXT,
             parse_mode="Markdown",
-            reply_markup=get_settings_keyboard(user)
+            reply_markup=get_settings_keyboard(user_settings)
         )
         
     except Exception as e:
@@ -102,117 +124,64 @@ async def show_settings(event: Message | CallbackQuery):
         await answer_func(
             "❌ Произошла ошибка при загрузке настроек"
         )
-    finally:
-        await session.close()
 
 
 @router.callback_query(F.data == "toggle_notifications")
-async def toggle_notifications(callback: CallbackQuery):
+async def toggle_notifications(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Toggle notification settings"""
     telegram_user_id = callback.from_user.id
     
-    session = async_session_maker()
     try:
-        # Get user
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == telegram_user_id)
-        )
-        user = user_result.scalar_one_or_none()
+        if user_ctx is None:
+            user_ctx = await user_context_cache.get(telegram_user_id)
         
-        if not user:
+        if not user_ctx:
             await callback.answer("❌ Пользователь не найден", show_alert=True)
             return
         
-        # Toggle notifications
-        current_state = getattr(user, 'notifications_enabled', True)
-        new_state = not current_state
-        
-        # Update user (assuming notifications_enabled field exists)
-        # If field doesn't exist, this will need to be added to the model
-        await session.execute(
-            update(User)
-            .where(User.id == user.id)
-            .values(notifications_enabled=new_state)
-        )
-        await session.commit()
-        
-        # Refresh user object
-        await session.refresh(user)
-        
-        # Update message
-        text = (
-            "⚙️ **Настройки**\n\n"
-            "Здесь вы можете настроить параметры вашего аккаунта"
-        )
+        user_settings = await toggle_setting(user_ctx.user_id, User.notifications_enabled, True)
         
         await callback.message.edit_text(
-            text,
+            SETTINGS_TEXT,
             parse_mode="Markdown",
-            reply_markup=get_settings_keyboard(user)
+            reply_markup=get_settings_keyboard(user_settings)
         )
         
-        status = "включены" if new_state else "выключены"
+        status = "включены" if user_settings.notifications_enabled else "выключены"
         await callback.answer(f"✅ Уведомления {status}")
         
     except Exception as e:
         logger.error(f"Error toggling notifications: {e}")
         await callback.answer("❌ Произошла ошибка", show_alert=True)
-    finally:
-        await session.close()
 
 
 @router.callback_query(F.data == "toggle_autorenew")
-async def toggle_autorenew(callback: CallbackQuery):
+async def toggle_autorenew(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Toggle auto-renewal settings"""
     telegram_user_id = callback.from_user.id
     
-    session = async_session_maker()
     try:
-        # Get user
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == telegram_user_id)
-        )
-        user = user_result.scalar_one_or_none()
+        if user_ctx is None:
+            user_ctx = await user_context_cache.get(telegram_user_id)
         
-        if not user:
+        if not user_ctx:
             await callback.answer("❌ Пользователь не найден", show_alert=True)
             return
         
-        # Toggle auto-renewal
-        current_state = getattr(user, 'auto_renew', False)
-        new_state = not current_state
-        
-        # Update user
-        await session.execute(
-            update(User)
-            .where(User.id == user.id)
-            .values(auto_renew=new_state)
-        )
-        await session.commit()
-        
-        # Refresh user object
-        await session.refresh(user)
-        
-        # Update message
-        text = (
-            "⚙️ **Настройки**\n\n"
-            "Здесь вы можете настроить параметры вашего аккаунта"
-        )
+        user_settings = await toggle_setting(user_ctx.user_id, User.auto_renew, False)
         
         await callback.message.edit_text(
-            text,
+            SETTINGS_TEXT,
             parse_mode="Markdown",
-            reply_markup=get_settings_keyboard(user)
+            reply_markup=get_settings_keyboard(user_settings)
         )
         
-        status = "включено" if new_state else "выключено"
+        status = "включено" if user_settings.auto_renew else "выключено"
         await callback.answer(f"✅ Автопродление {status}")
         
     except Exception as e:
         logger.error(f"Error toggling auto-renewal: {e}")
         await callback.answer("❌ Произошла ошибка", show_alert=True)
-    finally:
-        await session.close()
 
 
 @router.callback_query(F.data == "change_language")
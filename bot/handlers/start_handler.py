@@ -8,6 +8,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from datetime import datetime, timedelta
 from services.marzban import marzban_client, generate_unique_username
+from services.cache import user_context_cache
 from bot.config import settings
 import re
 import logging
@@ -167,6 +168,7 @@ async def create_trial_subscription(user: User, session: AsyncSession):
             session.add(vpn_config)
         
         await session.commit()
+        await user_context_cache.invalidate(user.telegram_id)
         logger.info(f"Created trial subscription for user {user.telegram_id}")
         
     except Exception as e:
@@ -2,10 +2,12 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
 from aiogram.filters import Command
 from database.connection import async_session_maker
-from database.models import User, Subscription, VPNConfig, Payment, PaymentStatus
+from database.models import User, Subscription, Payment, COMPLETED_PAYMENT_STATUSES
 from sqlalchemy import select, func
-from datetime import datetime, timedelta
+from datetime import datetime
+from typing import Optional
 from bot.keyboards.user import get_back_button
+from services.cache import user_context_cache, UserContext
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,7 +16,7 @@ router = Router()
 
 @router.callback_query(F.data == "stats")
 @router.message(Command("stats"))
-async def show_user_stats(event: Message | CallbackQuery):
+async def show_user_stats(event: Message | CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Show user statistics"""
     
     # Get telegram_user_id
@@ -26,74 +28,38 @@ async def show_user_stats(event: Message | CallbackQuery):
         answer_func = event.message.edit_text
         await event.answer()
     
-    session = async_session_maker()
     try:
-        # Get user
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == telegram_user_id)
-        )
-        user = user_result.scalar_one_or_none()
+        if user_ctx is None:
+            user_ctx = await user_context_cache.get(telegram_user_id)
         
-        if not user:
+        if not user_ctx:
             await answer_func(
                 "❌ Пользователь не найден в системе\n"
                 "Используйте /start для регистрации"
             )
             return
         
-        # Get user's total payments
-        payments_result = await session.execute(
-            select(func.count(Payment.id), func.sum(Payment.amount))
-            .where(Payment.user_id == user.id)
-            .where(Payment.status == PaymentStatus.COMPLETED)
-        )
-        total_payments, total_spent = payments_result.one()
-        total_spent = total_spent or 0
-        
-        # Get active subscription info
-        active_sub_result = await session.execute(
-            select(Subscription)
-            .where(Subscription.user_id == user.id)
-            .where(Subscription.is_active == True)
-            .order_by(Subscription.created_at.desc())
-        )
-        active_sub = active_sub_result.scalar_one_or_none()
+        # Totals that are not part of the cached context, in one round trip
+        async with async_session_maker() as session:
+            result = await session.execute(user_totals_query(user_ctx.user_id))
+            totals = result.one()
         
-        # Get total subscription days
-        subs_result = await session.execute(
-            select(func.sum(Subscription.end_date - Subscription.start_date))
-            .where(Subscription.user_id == user.id)
-        )
-        total_days_raw = subs_result.scalar()
-        total_days = total_days_raw.days if total_days_raw else 0
-        
-        # Get VPN config if exists
-        vpn_result = await session.execute(
-            select(VPNConfig)
-            .where(VPNConfig.user_id == user.id)
-            .where(VPNConfig.is_active == True)
-        )
-        vpn_config = vpn_result.scalar_one_or_none()
-        
-        # Get referral stats
-        referrals_result = await session.execute(
-            select(func.count(User.id))
-            .where(User.referrer_id == user.id)
-        )
-        referral_count = referrals_result.scalar() or 0
+        total_spent = totals.total_spent or 0
+        total_days = totals.total_days.days if totals.total_days else 0
         
         # Build statistics message
         text = (
             f"📊 **Ваша статистика**\n\n"
             f"👤 **Профиль:**\n"
-            f"├ ID: `{user.telegram_id}`\n"
-            f"├ Имя: {user.first_name or 'Не указано'}\n"
-            f"├ Дата регистрации: {user.created_at.strftime('%d.%m.%Y')}\n"
-            f"└ Реферальный код: `ref_{user.telegram_id}`\n\n"
+            f"├ ID: `{user_ctx.telegram_id}`\n"
+            f"├ Имя: {user_ctx.first_name or 'Не указано'}\n"
+            f"├ Дата регистрации: {user_ctx.created_at.strftime('%d.%m.%Y') if user_ctx.created_at else '—'}\n"
+            f"└ Реферальный код: `ref_{user_ctx.telegram_id}`\n\n"
         )
         
         # Subscription info
-        if active_sub:
+        active_sub = user_ctx.subscription
+        if active_sub and active_sub.end_date:
             days_left = (active_sub.end_date - datetime.now()).days
             text += (
                 f"💳 **Подписка:**\n"
@@ -110,6 +76,7 @@ async def show_user_stats(event: Message | CallbackQuery):
             )
         
         # VPN info
+        vpn_config = user_ctx.vpn_config
         if vpn_config:
             text += (
                 f"🔐 **VPN:**\n"
@@ -127,15 +94,15 @@ async def show_user_stats(event: Message | CallbackQuery):
         # Payment info
         text += (
             f"💰 **Платежи:**\n"
-            f"├ Всего платежей: {total_payments}\n"
+            f"├ Всего платежей: {totals.total_payments}\n"
             f"└ Общая сумма: {total_spent:.2f} ₽\n\n"
         )
         
         # Referral info
         text += (
             f"👥 **Рефералы:**\n"
-            f"├ Приглашено: {referral_count} чел.\n"
-            f"└ Бонусные дни: {user.bonus_days or 0}\n"
+            f"├ Приглашено: {totals.referral_count} чел.\n"
+            f"└ Бонусные дни: {totals.bonus_days or 0}\n"
         )
         
         await answer_func(
@@ -150,8 +117,27 @@ async def show_user_stats(event: Message | CallbackQuery):
             "❌ Произошла ошибка при получении статистики\n"
             "Попробуйте позже или обратитесь в поддержку"
         )
-    finally:
-        await session.close()
+
+
+def user_totals_query(user_id: int):
+    """Payment, subscription and referral totals of one user as a single row"""
+    return select(
+        select(func.count(Payment.id))
+        .where(Payment.user_id == user_id, Payment.status.in_(COMPLETED_PAYMENT_STATUSES))
+        .scalar_subquery().label("total_payments"),
+        select(func.sum(Payment.amount))
+        .where(Payment.user_id == user_id, Payment.status.in_(COMPLETED_PAYMENT_STATUSES))
+        .scalar_subquery().label("total_spent"),
+        select(func.sum(Subscription.end_date - Subscription.start_date))
+        .where(Subscription.user_id == user_id)
+        .scalar_subquery().label("total_days"),
+        select(func.count(User.id))
+        .where(User.referred_by == user_id)
+        .scalar_subquery().label("referral_count"),
+        select(User.bonus_days)
+        .where(User.id == user_id)
+        .scalar_subquery().label("bonus_days")
+    )
 
 
 def format_bytes(bytes_count: int) -> str:
@@ -4,6 +4,8 @@ from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.redis import RedisStorage
 from bot.config import settings
 from database.connection import init_db, close_db, redis_client
+from services.marzban import marzban_client
+from services.cache import catalog_cache, qr_code_cache
 from bot.handlers import (
     start_handler,
     subscription_handler,
@@ -20,6 +22,10 @@ from bot.handlers import admin_simple
 from bot.middleware.auth import AuthMiddleware
 from bot.middleware.throttling import ThrottlingMiddleware
 from bot.middleware.logging import LoggingMiddleware
+from bot.middleware.user_context import UserContextMiddleware
+from bot.middleware.metrics import HandlerMetricsMiddleware, TelegramRequestMetricsMiddleware
+from services.monitoring import start_metrics_server
+from services.http import http_clients
 import sentry_sdk
 from sentry_sdk.integrations.logging import LoggingIntegration
 
@@ -54,6 +60,9 @@ async def on_startup(bot: Bot):
     await init_db()
     logger.info("Database initialized")
     
+    # Follow plan/FAQ/settings changes made by the API and admin tools
+    await catalog_cache.start_listener()
+    
     # Set bot commands
     from bot.utils.commands import set_bot_commands, set_admin_commands
     await set_bot_commands(bot)
@@ -71,9 +80,16 @@ async def on_shutdown(bot: Bot):
     """Actions to perform on bot shutdown"""
     logger.info("Shutting down bot...")
     
+    await catalog_cache.close()
+    qr_code_cache.close()
+    
     # Close database connections
     await close_db()
     
+    # Close Marzban and payment provider HTTP pools
+    await marzban_client.close()
+    await http_clients.close()
+    
     # Close bot session
     await bot.session.close()
     
@@ -84,6 +100,10 @@ async def main():
     """Main function to run the bot"""
     # Initialize bot and dispatcher
     bot = Bot(token=settings.bot_token)
+    bot.session.middleware(TelegramRequestMetricsMiddleware())
+    
+    # Expose handler and Bot API metrics for Prometheus
+    start_metrics_server(settings.bot_metrics_port)
     
     # Use Redis for FSM storage
     storage = RedisStorage(redis=redis_client)
@@ -99,6 +119,10 @@ async def main():
     #dp.message.middleware(LoggingMiddleware())
     #dp.callback_query.middleware(ThrottlingMiddleware())
     #dp.callback_query.middleware(LoggingMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware("message"))
+    dp.callback_query.middleware(HandlerMetricsMiddleware("callback_query"))
+    dp.message.middleware(UserContextMiddleware())
+    dp.callback_query.middleware(UserContextMiddleware())
     
     # Temporary fix - remove after config_handler is fixed
     # @dp.callback_query()
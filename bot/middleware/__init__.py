@@ -1,5 +1,8 @@
 from .auth import AuthMiddleware
 from .throttling import ThrottlingMiddleware
 from .logging import LoggingMiddleware
+from .user_context import UserContextMiddleware
+from .metrics import HandlerMetricsMiddleware, TelegramRequestMetricsMiddleware
 
-__all__ = ["AuthMiddleware", "ThrottlingMiddleware", "LoggingMiddleware"]
\ No newline at end of file
+__all__ = ["AuthMiddleware", "ThrottlingMiddleware", "LoggingMiddleware", "UserContextMiddleware",
+           "HandlerMetricsMiddleware", "TelegramRequestMetricsMiddleware"]
@@ -0,0 +1,65 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.types import Message, CallbackQuery
+from services.monitoring import (
+    HANDLER_DURATION, TELEGRAM_REQUEST_DURATION, TELEGRAM_MESSAGES_SENT, TELEGRAM_SEND_FAILURES,
+    TELEGRAM_RETRY_AFTER, TELEGRAM_RETRY_AFTER_SECONDS
+)
+import time
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Middleware that records handler latency per router and handler"""
+    
+    def __init__(self, event_type: str):
+        self.event_type = event_type
+    
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message | CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        router = getattr(callback, "__module__", "unknown").rsplit(".", 1)[-1]
+        name = getattr(callback, "__name__", "unknown")
+        
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await handler(event, data)
+            status = "ok"
+            return result
+        finally:
+            HANDLER_DURATION.labels(router, name, self.event_type, status).observe(time.perf_counter() - started)
+
+
+class TelegramRequestMetricsMiddleware(BaseRequestMiddleware):
+    """Bot session middleware that records Bot API calls, failures and flood waits"""
+    
+    async def __call__(self, make_request, bot, method):
+        api_method = getattr(method, "__api_method__", type(method).__name__)
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await make_request(bot, method)
+            status = "ok"
+            if api_method.startswith("send"):
+                TELEGRAM_MESSAGES_SENT.labels(api_method).inc()
+            return response
+        except TelegramRetryAfter as e:
+            status = "retry_after"
+            TELEGRAM_RETRY_AFTER.labels(api_method).inc()
+            TELEGRAM_RETRY_AFTER_SECONDS.labels(api_method).inc(e.retry_after)
+            raise
+        except TelegramAPIError as e:
+            TELEGRAM_SEND_FAILURES.labels(api_method, type(e).__name__).inc()
+            raise
+        except Exception as e:
+            TELEGRAM_SEND_FAILURES.labels(api_method, type(e).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_REQUEST_DURATION.labels(api_method, status).observe(time.perf_counter() - started)
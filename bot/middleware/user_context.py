@@ -0,0 +1,30 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import Message, CallbackQuery
+from services.cache import user_context_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Middleware that provides cached user context as `user_ctx`"""
+    
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message | CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        user_data = getattr(event, "from_user", None)
+        
+        user_ctx = None
+        if user_data:
+            try:
+                user_ctx = await user_context_cache.get(user_data.id)
+            except Exception as e:
+                # Handlers fall back to their own queries
+                logger.error(f"Error loading user context for {user_data.id}: {e}")
+        
+        data["user_ctx"] = user_ctx
+        return await handler(event, data)
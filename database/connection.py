@@ -1,6 +1,7 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 from bot.config import settings
+from services.monitoring import instrument_engine
 import redis.asyncio as redis
 from typing import AsyncGenerator
 
@@ -14,6 +15,7 @@ engine = create_async_engine(
     max_overflow=40,
     pool_pre_ping=True,
 )
+instrument_engine(engine)
 
 # Create session factory
 async_session_maker = async_sessionmaker(
@@ -0,0 +1,42 @@
+"""Daily metrics rollup tables
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('daily_metrics',
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('revenue', sa.Numeric(precision=12, scale=2), server_default='0', nullable=False),
+    sa.Column('transactions', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('new_users', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('trials_started', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('conversions', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('expirations', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('date')
+    )
+    
+    op.create_table('daily_payment_metrics',
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('payment_system', sa.String(length=20), nullable=False),
+    sa.Column('revenue', sa.Numeric(precision=12, scale=2), server_default='0', nullable=False),
+    sa.Column('transactions', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('date', 'payment_system')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('daily_payment_metrics')
+    op.drop_table('daily_metrics')
@@ -0,0 +1,66 @@
+"""Composite and partial indexes for hot query predicates
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-17 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns, unique, partial predicate)
+INDEXES = [
+    ('ix_subscriptions_user_status_end_date', 'subscriptions', ['user_id', 'status', 'end_date'], False, None),
+    ('ix_subscriptions_active_end_date', 'subscriptions', ['end_date'], False, "status IN ('active', 'trial')"),
+    ('ix_payments_status_created_at', 'payments', ['status', 'created_at'], False, None),
+    ('ix_payments_user_status', 'payments', ['user_id', 'status'], False, None),
+    ('uq_usage_stats_user_date', 'usage_stats', ['user_id', 'date'], True, None),
+    ('ix_vpn_configs_user_active', 'vpn_configs', ['user_id', 'is_active'], False, None),
+    ('ix_users_referred_by', 'users', ['referred_by'], False, None),
+]
+
+
+def _existing_tables():
+    inspector = sa.inspect(op.get_bind())
+    return {
+        table: {column['name'] for column in inspector.get_columns(table)}
+        for table in inspector.get_table_names()
+    }
+
+
+def upgrade() -> None:
+    tables = _existing_tables()
+
+    # The upsert in UsageTracker needs (user_id, date) to be unique
+    if 'usage_stats' in tables:
+        op.execute("""
+            DELETE FROM usage_stats a
+            USING usage_stats b
+            WHERE a.user_id = b.user_id AND a.date = b.date AND a.id < b.id
+        """)
+
+    # Build indexes without blocking writes on live tables
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique, where in INDEXES:
+            if table not in tables or not set(columns) <= tables[table]:
+                continue
+            op.create_index(
+                name, table, columns,
+                unique=unique,
+                postgresql_where=sa.text(where) if where else None,
+                postgresql_concurrently=True,
+                if_not_exists=True
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
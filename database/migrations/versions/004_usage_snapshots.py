@@ -0,0 +1,30 @@
+"""Usage snapshots for incremental traffic ingestion
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('usage_snapshots',
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.Column('used_traffic', sa.BigInteger(), server_default='0', nullable=False),
+    sa.Column('lifetime_used_traffic', sa.BigInteger(), server_default='0', nullable=False),
+    sa.Column('captured_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('usage_snapshots')
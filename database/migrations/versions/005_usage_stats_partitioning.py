@@ -0,0 +1,91 @@
+"""Partition usage_stats by month and add monthly usage aggregates
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-17 13:30:00.000000
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = """
+    id BIGINT NOT NULL DEFAULT nextval('usage_stats_id_seq'),
+    user_id BIGINT NOT NULL REFERENCES users (id),
+    date DATE NOT NULL,
+    bytes_uploaded BIGINT,
+    bytes_downloaded BIGINT,
+    connections_count INTEGER,
+    unique_ips VARCHAR[],
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+"""
+COPY_COLUMNS = "id, user_id, date, bytes_uploaded, bytes_downloaded, connections_count, unique_ips, created_at"
+MONTHS_AHEAD = 2
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _replace_usage_stats(create_statements):
+    """Copy usage_stats into a table created as usage_stats_new and swap them"""
+    # Keep the id sequence (and so the ids) across the swap
+    op.execute("ALTER SEQUENCE usage_stats_id_seq OWNED BY NONE")
+    for statement in create_statements:
+        op.execute(statement)
+    op.execute(f"INSERT INTO usage_stats_new ({COPY_COLUMNS}) SELECT {COPY_COLUMNS} FROM usage_stats")
+    op.execute("DROP TABLE usage_stats")
+    op.execute("ALTER TABLE usage_stats_new RENAME TO usage_stats")
+    op.execute("ALTER TABLE usage_stats RENAME CONSTRAINT usage_stats_new_pkey TO usage_stats_pkey")
+    op.execute("ALTER TABLE usage_stats RENAME CONSTRAINT usage_stats_new_user_id_fkey TO usage_stats_user_id_fkey")
+    op.execute("ALTER SEQUENCE usage_stats_id_seq OWNED BY usage_stats.id")
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    first_day, last_day = bind.execute(sa.text("SELECT min(date), max(date) FROM usage_stats")).one()
+    current_month = date.today().replace(day=1)
+    month = (first_day or current_month).replace(day=1)
+    last_month = max((last_day or current_month).replace(day=1), _add_months(current_month, MONTHS_AHEAD))
+
+    statements = [f"CREATE TABLE usage_stats_new ({COLUMNS}, PRIMARY KEY (id, date)) PARTITION BY RANGE (date)"]
+    while month <= last_month:
+        statements.append(
+            f"CREATE TABLE usage_stats_{month.year:04d}_{month.month:02d} PARTITION OF usage_stats_new "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+        )
+        month = _add_months(month, 1)
+    _replace_usage_stats(statements)
+
+    op.create_index('uq_usage_stats_user_date', 'usage_stats', ['user_id', 'date'], unique=True)
+
+    op.create_table('usage_stats_monthly',
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('bytes_uploaded', sa.BigInteger(), server_default='0', nullable=False),
+    sa.Column('bytes_downloaded', sa.BigInteger(), server_default='0', nullable=False),
+    sa.Column('connections_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('days_active', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'month')
+    )
+
+
+def downgrade() -> None:
+    # Months that were already downsampled are not restored as daily rows
+    op.drop_table('usage_stats_monthly')
+    op.execute("DELETE FROM system_settings WHERE key = 'usage_rollup_watermark'")
+
+    _replace_usage_stats([f"CREATE TABLE usage_stats_new ({COLUMNS}, PRIMARY KEY (id))"])
+
+    op.create_index(op.f('ix_usage_stats_id'), 'usage_stats', ['id'], unique=False)
+    op.create_index('uq_usage_stats_user_date', 'usage_stats', ['user_id', 'date'], unique=True)
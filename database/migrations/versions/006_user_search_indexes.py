@@ -0,0 +1,44 @@
+"""Trigram search and latest-subscription indexes for the admin users list
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns, index method, operator classes)
+INDEXES = [
+    ('ix_users_username_trgm', 'users', ['username'], 'gin', {'username': 'gin_trgm_ops'}),
+    ('ix_users_first_name_trgm', 'users', ['first_name'], 'gin', {'first_name': 'gin_trgm_ops'}),
+    ('ix_subscriptions_user_created_at', 'subscriptions', ['user_id', 'created_at'], None, None),
+]
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # Build indexes without blocking writes on live tables
+    with op.get_context().autocommit_block():
+        for name, table, columns, using, ops in INDEXES:
+            op.create_index(
+                name, table, columns,
+                postgresql_using=using,
+                postgresql_ops=ops,
+                postgresql_concurrently=True,
+                if_not_exists=True
+            )
+
+
+def downgrade() -> None:
+    # pg_trgm is left installed, other objects may depend on it
+    with op.get_context().autocommit_block():
+        for name, table, _, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,35 @@
+"""(created_at, id) indexes for keyset pagination of admin lists
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-17 14:30:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns)
+INDEXES = [
+    ('ix_users_created_at_id', 'users', ['created_at', 'id']),
+    ('ix_payments_created_at_id', 'payments', ['created_at', 'id']),
+    ('ix_subscriptions_created_at_id', 'subscriptions', ['created_at', 'id']),
+]
+
+
+def upgrade() -> None:
+    # Build indexes without blocking writes on live tables
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,34 @@
+"""updated_at indexes for the daily metrics rollup
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns)
+INDEXES = [
+    ('ix_payments_updated_at', 'payments', ['updated_at']),
+    ('ix_subscriptions_updated_at', 'subscriptions', ['updated_at']),
+]
+
+
+def upgrade() -> None:
+    # Build indexes without blocking writes on live tables
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
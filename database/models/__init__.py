@@ -1,9 +1,10 @@
 from .user import User, ReferralStat, ActionLog
 from .subscription import Subscription, PricingPlan, PlanType, SubscriptionStatus
-from .payment import Payment, PaymentStatus, PaymentMethod, PaymentSystem
-from .vpn import VPNConfig, UsageStat
+from .payment import Payment, PaymentStatus, PaymentMethod, PaymentSystem, COMPLETED_PAYMENT_STATUSES
+from .vpn import VPNConfig, UsageStat, UsageStatMonthly, UsageSnapshot
 from .promo import PromoCode, PromoUsage, PromoType
-from .system import SystemSetting, FAQItem, BroadcastMessage
+from .system import SystemSetting, FAQItem, BroadcastMessage, BackupRecord
+from .metrics import DailyMetric, DailyPaymentMetric
 
 # Compatibility aliases for consistent naming
 UsageStats = UsageStat
@@ -13,8 +14,9 @@ SystemSettings = SystemSetting
 __all__ = [
     "User", "ReferralStat", "ReferralStats", "ActionLog",
     "Subscription", "PricingPlan", "PlanType", "SubscriptionStatus",
-    "Payment", "PaymentStatus", "PaymentMethod", "PaymentSystem",
-    "VPNConfig", "UsageStat", "UsageStats",
+    "Payment", "PaymentStatus", "PaymentMethod", "PaymentSystem", "COMPLETED_PAYMENT_STATUSES",
+    "VPNConfig", "UsageStat", "UsageStats", "UsageStatMonthly", "UsageSnapshot",
     "PromoCode", "PromoUsage", "PromoType",
-    "SystemSetting", "SystemSettings", "FAQItem", "BroadcastMessage"
+    "SystemSetting", "SystemSettings", "FAQItem", "BroadcastMessage", "BackupRecord",
+    "DailyMetric", "DailyPaymentMetric"
 ]
\ No newline at end of file
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, String, DateTime, Date, Integer, Numeric
+from sqlalchemy.sql import func
+from database.connection import Base
+
+
+class DailyMetric(Base):
+    """Daily rollup of revenue, signups and subscription events"""
+    __tablename__ = "daily_metrics"
+    
+    date = Column(Date, primary_key=True)
+    revenue = Column(Numeric(12, 2), nullable=False, default=0)
+    transactions = Column(Integer, nullable=False, default=0)
+    new_users = Column(Integer, nullable=False, default=0)
+    trials_started = Column(Integer, nullable=False, default=0)
+    conversions = Column(Integer, nullable=False, default=0)  # First successful payment
+    expirations = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class DailyPaymentMetric(Base):
+    """Daily rollup of successful payments per payment system"""
+    __tablename__ = "daily_payment_metrics"
+    
+    date = Column(Date, primary_key=True)
+    payment_system = Column(String(20), primary_key=True)
+    revenue = Column(Numeric(12, 2), nullable=False, default=0)
+    transactions = Column(Integer, nullable=False, default=0)
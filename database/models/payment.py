@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, String, DateTime, ForeignKey, Numeric, Text
+from sqlalchemy import Column, BigInteger, String, DateTime, ForeignKey, Numeric, Text, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database.connection import Base
@@ -13,6 +13,10 @@ class PaymentStatus(str, Enum):
     REFUNDED = "refunded"
 
 
+# Paid payments: "success" is written now, older rows may say "completed"
+COMPLETED_PAYMENT_STATUSES = (PaymentStatus.SUCCESS.value, 'completed')
+
+
 class PaymentMethod(str, Enum):
     SBP = "sbp"
     CARD = "card"
@@ -26,6 +30,14 @@ class PaymentSystem(str, Enum):
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        Index("ix_payments_status_created_at", "status", "created_at"),
+        Index("ix_payments_user_status", "user_id", "status"),
+        # Keyset pagination of the admin list
+        Index("ix_payments_created_at_id", "created_at", "id"),
+        # Rows changed since the daily metrics watermark
+        Index("ix_payments_updated_at", "updated_at"),
+    )
     
     id = Column(BigInteger, primary_key=True, index=True)
     user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
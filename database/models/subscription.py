@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, String, Boolean, DateTime, ForeignKey, Numeric, Integer, Text
+from sqlalchemy import Column, BigInteger, String, Boolean, DateTime, ForeignKey, Numeric, Integer, Text, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database.connection import Base
@@ -21,6 +21,19 @@ class SubscriptionStatus(str, Enum):
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
+    __table_args__ = (
+        Index("ix_subscriptions_user_status_end_date", "user_id", "status", "end_date"),
+        # Latest subscription per user
+        Index("ix_subscriptions_user_created_at", "user_id", "created_at"),
+        # Keyset pagination of the admin list
+        Index("ix_subscriptions_created_at_id", "created_at", "id"),
+        Index(
+            "ix_subscriptions_active_end_date", "end_date",
+            postgresql_where=text("status IN ('active', 'trial')")
+        ),
+        # Rows changed since the daily metrics watermark
+        Index("ix_subscriptions_updated_at", "updated_at"),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -31,7 +44,7 @@ class Subscription(Base):
     auto_renew = Column(Boolean, default=False)
     payment_id = Column(Integer)
     created_at = Column(DateTime(timezone=False), server_default=func.current_timestamp())
-    updated_at = Column(DateTime(timezone=False), server_default=func.current_timestamp())
+    updated_at = Column(DateTime(timezone=False), server_default=func.current_timestamp(), onupdate=func.current_timestamp())
     
     # Relationships
     user = relationship("User", back_populates="subscriptions")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, String, Text, DateTime, Boolean, Integer
+from sqlalchemy import Column, BigInteger, String, Text, DateTime, Boolean, Integer, Float
 from sqlalchemy.sql import func
 from database.connection import Base
 
@@ -39,4 +39,23 @@ class BroadcastMessage(Base):
     created_by = Column(BigInteger)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     scheduled_at = Column(DateTime(timezone=True))
-    completed_at = Column(DateTime(timezone=True))
\ No newline at end of file
+    completed_at = Column(DateTime(timezone=True))
+
+
+class BackupRecord(Base):
+    """Metadata of a database backup (pg_dump directory format)"""
+    __tablename__ = "backup_records"
+    
+    id = Column(BigInteger, primary_key=True)
+    name = Column(String(100), unique=True, nullable=False)
+    path = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default="running")  # running, success, failed
+    size_bytes = Column(BigInteger)
+    duration_seconds = Column(Float)
+    checksum = Column(String(64))  # sha256 over the dump directory
+    toc_entries = Column(Integer)  # Entries listed by pg_restore --list
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    completed_at = Column(DateTime(timezone=True))
+    verified_at = Column(DateTime(timezone=True))
+    deleted_at = Column(DateTime(timezone=True))
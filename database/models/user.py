@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, String, Boolean, Text, DateTime, ForeignKey, Integer
+from sqlalchemy import Column, BigInteger, String, Boolean, Text, DateTime, ForeignKey, Integer, Index
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.sql import func
 from database.connection import Base
@@ -6,6 +6,15 @@ from database.connection import Base
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Substring search in the admin users list (needs pg_trgm)
+        Index("ix_users_username_trgm", "username", postgresql_using="gin",
+              postgresql_ops={"username": "gin_trgm_ops"}),
+        Index("ix_users_first_name_trgm", "first_name", postgresql_using="gin",
+              postgresql_ops={"first_name": "gin_trgm_ops"}),
+        # Keyset pagination of the admin list
+        Index("ix_users_created_at_id", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True)
     telegram_id = Column(BigInteger, unique=True, nullable=False)
@@ -21,7 +30,7 @@ class User(Base):
     notifications_enabled = Column(Boolean, default=True)
     auto_renew = Column(Boolean, default=False)
     bonus_days = Column(Integer, default=0)
-    referred_by = Column(Integer, ForeignKey("users.id"))
+    referred_by = Column(Integer, ForeignKey("users.id"), index=True)
     created_at = Column(DateTime(timezone=False), server_default=func.current_timestamp())
     updated_at = Column(DateTime(timezone=False), server_default=func.current_timestamp())
     last_activity = Column(DateTime(timezone=False), server_default=func.current_timestamp())
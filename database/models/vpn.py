@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, String, Boolean, Text, DateTime, ForeignKey, Date, Integer, ARRAY
+from sqlalchemy import Column, BigInteger, String, Boolean, Text, DateTime, ForeignKey, Date, Integer, ARRAY, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database.connection import Base
@@ -6,6 +6,9 @@ from database.connection import Base
 
 class VPNConfig(Base):
     __tablename__ = "vpn_configs"
+    __table_args__ = (
+        Index("ix_vpn_configs_user_active", "user_id", "is_active"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -24,11 +27,18 @@ class VPNConfig(Base):
 
 
 class UsageStat(Base):
+    """Daily usage, range-partitioned by month (see services.stats.usage_storage)"""
     __tablename__ = "usage_stats"
+    __table_args__ = (
+        # Also the conflict target of the usage stats upsert
+        Index("uq_usage_stats_user_date", "user_id", "date", unique=True),
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
     
-    id = Column(BigInteger, primary_key=True, index=True)
+    # Keys of a partitioned table must include the partition column
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
-    date = Column(Date, nullable=False)
+    date = Column(Date, primary_key=True)
     bytes_uploaded = Column(BigInteger, default=0)
     bytes_downloaded = Column(BigInteger, default=0)
     connections_count = Column(Integer, default=0)
@@ -36,4 +46,26 @@ class UsageStat(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
-    user = relationship("User", back_populates="usage_stats")
\ No newline at end of file
+    user = relationship("User", back_populates="usage_stats")
+
+
+class UsageSnapshot(Base):
+    """Last cumulative Marzban traffic counters seen per user"""
+    __tablename__ = "usage_snapshots"
+    
+    user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    used_traffic = Column(BigInteger, nullable=False, default=0)
+    lifetime_used_traffic = Column(BigInteger, nullable=False, default=0)
+    captured_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class UsageStatMonthly(Base):
+    """Usage downsampled to one row per user and month"""
+    __tablename__ = "usage_stats_monthly"
+    
+    user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    month = Column(Date, primary_key=True)  # First day of the month
+    bytes_uploaded = Column(BigInteger, nullable=False, default=0)
+    bytes_downloaded = Column(BigInteger, nullable=False, default=0)
+    connections_count = Column(Integer, nullable=False, default=0)
+    days_active = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, delete, func, inspect, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import SystemSetting
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY = 'purge_checkpoint:{table}'
+
+# Range partitions of `table` on `column` whose upper bound is at or before the cutoff
+EXPIRED_PARTITIONS_SQL = """
+    SELECT child.relname
+    FROM pg_inherits
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = to_regclass(:table)
+      AND pg_get_partkeydef(pg_inherits.inhparent) = 'RANGE (' || :column || ')'
+      AND substring(pg_get_expr(child.relpartbound, child.oid) from 'TO \\(''([^'']+)''\\)')::timestamptz
+          <= CAST(:cutoff AS timestamptz)
+    ORDER BY child.relname
+"""
+
+
+@dataclass(frozen=True)
+class PurgeTarget:
+    """Rows of `model` with `column` before `cutoff` (and matching `conditions`)"""
+    model: Any
+    column: Any
+    cutoff: datetime
+    conditions: Tuple[Any, ...] = ()
+
+    @property
+    def table(self) -> str:
+        return self.model.__tablename__
+
+
+class ChunkedPurger:
+    """Deletes expired rows in short transactions.
+
+    Rows go in primary-key order, `batch_size` per transaction, with a
+    pause between batches so locks and WAL stay small and concurrent
+    writers get through. The last deleted key is checkpointed in
+    system_settings, so a run stopped by `max_duration` (or a crash)
+    resumes where it left off. Range-partitioned tables first lose whole
+    partitions that lie before the cutoff.
+    """
+
+    def __init__(self, batch_size: int = 5000, pause: float = 0.1, max_duration: Optional[float] = None):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.max_duration = max_duration
+
+    async def purge_all(self, session: AsyncSession, targets: Sequence[PurgeTarget]) -> Dict[str, Dict[str, Any]]:
+        deadline = time.monotonic() + self.max_duration if self.max_duration else None
+        results = {}
+        for target in targets:
+            results[target.table] = await self.purge(session, target, deadline)
+        return results
+
+    async def purge(
+        self,
+        session: AsyncSession,
+        target: PurgeTarget,
+        deadline: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Purge one table; returns rows and partitions removed and whether it finished"""
+        partitions = []
+        # Extra filters can't be applied to a whole partition
+        if not target.conditions:
+            partitions = await self._drop_partitions(session, target)
+
+        rows, complete = await self._delete_batches(session, target, deadline)
+        logger.info(
+            f"Purged {rows} rows and {len(partitions)} partitions from {target.table}"
+            + ("" if complete else " (stopped early, will resume)")
+        )
+        return {"rows": rows, "partitions": len(partitions), "complete": complete}
+
+    async def _drop_partitions(self, session: AsyncSession, target: PurgeTarget) -> List[str]:
+        result = await session.execute(
+            text(EXPIRED_PARTITIONS_SQL),
+            {"table": target.table, "column": target.column.name, "cutoff": target.cutoff.isoformat()}
+        )
+        names = result.scalars().all()
+        for name in names:
+            await session.execute(text(f'ALTER TABLE {target.table} DETACH PARTITION "{name}"'))
+            await session.execute(text(f'DROP TABLE "{name}"'))
+            await session.commit()
+            logger.info(f"Dropped expired partition {name} of {target.table}")
+        return names
+
+    async def _delete_batches(
+        self,
+        session: AsyncSession,
+        target: PurgeTarget,
+        deadline: Optional[float]
+    ) -> Tuple[int, bool]:
+        key = inspect(target.model).primary_key[0]
+        checkpoint_key = CHECKPOINT_KEY.format(table=target.table)
+        last_key = await self._get_checkpoint(session, checkpoint_key)
+        purged = 0
+
+        while True:
+            batch = (
+                select(key)
+                .where(target.column < target.cutoff, *target.conditions)
+                .order_by(key)
+                .limit(self.batch_size)
+            )
+            if last_key is not None:
+                batch = batch.where(key > last_key)
+
+            result = await session.execute(
+                delete(target.model)
+                .where(key.in_(batch.scalar_subquery()))
+                .returning(key)
+                .execution_options(synchronize_session=False)
+            )
+            deleted = result.scalars().all()
+
+            if not deleted:
+                await self._clear_checkpoint(session, checkpoint_key)
+                await session.commit()
+                return purged, True
+
+            purged += len(deleted)
+            last_key = max(deleted)
+            await self._set_checkpoint(session, checkpoint_key, last_key)
+            await session.commit()
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return purged, False
+            await asyncio.sleep(self.pause)
+
+    async def _get_checkpoint(self, session: AsyncSession, key: str) -> Optional[Any]:
+        setting = await session.get(SystemSetting, key)
+        return json.loads(setting.value) if setting else None
+
+    async def _set_checkpoint(self, session: AsyncSession, key: str, value: Any):
+        await session.execute(
+            insert(SystemSetting).values(
+                key=key,
+                value=json.dumps(value),
+                description="Last primary key removed by an unfinished purge"
+            ).on_conflict_do_update(
+                index_elements=[SystemSetting.key],
+                set_={'value': json.dumps(value), 'updated_at': func.now()}
+            )
+        )
+
+    async def _clear_checkpoint(self, session: AsyncSession, key: str):
+        await session.execute(delete(SystemSetting).where(SystemSetting.key == key))
+
+
+# Stops within the Celery soft time limit, the next run resumes
+chunked_purger = ChunkedPurger(max_duration=20 * 60)
@@ -77,6 +77,51 @@ CREATE TABLE IF NOT EXISTS vpn_configs (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Create usage snapshots table (last cumulative traffic counters per user)
+CREATE TABLE IF NOT EXISTS usage_snapshots (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    used_traffic BIGINT NOT NULL DEFAULT 0,
+    lifetime_used_traffic BIGINT NOT NULL DEFAULT 0,
+    captured_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create daily metrics rollup tables
+CREATE TABLE IF NOT EXISTS daily_metrics (
+    date DATE PRIMARY KEY,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    transactions INTEGER NOT NULL DEFAULT 0,
+    new_users INTEGER NOT NULL DEFAULT 0,
+    trials_started INTEGER NOT NULL DEFAULT 0,
+    conversions INTEGER NOT NULL DEFAULT 0,
+    expirations INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS daily_payment_metrics (
+    date DATE NOT NULL,
+    payment_system VARCHAR(20) NOT NULL,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    transactions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, payment_system)
+);
+
+-- Create backup metadata table
+CREATE TABLE IF NOT EXISTS backup_records (
+    id BIGSERIAL PRIMARY KEY,
+    name VARCHAR(100) UNIQUE NOT NULL,
+    path TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    size_bytes BIGINT,
+    duration_seconds DOUBLE PRECISION,
+    checksum VARCHAR(64),
+    toc_entries INTEGER,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP WITH TIME ZONE,
+    verified_at TIMESTAMP WITH TIME ZONE,
+    deleted_at TIMESTAMP WITH TIME ZONE
+);
+
 -- Create indexes
 CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);
 CREATE INDEX IF NOT EXISTS idx_users_referral_code ON users(referral_code);
@@ -90,6 +135,25 @@ CREATE INDEX IF NOT EXISTS idx_payments_external_id ON payments(external_id);
 CREATE INDEX IF NOT EXISTS idx_vpn_configs_user_id ON vpn_configs(user_id);
 CREATE INDEX IF NOT EXISTS idx_vpn_configs_marzban_user_id ON vpn_configs(marzban_user_id);
 
+-- Composite and partial indexes for hot query predicates
+CREATE INDEX IF NOT EXISTS ix_subscriptions_user_status_end_date ON subscriptions(user_id, status, end_date);
+CREATE INDEX IF NOT EXISTS ix_subscriptions_active_end_date ON subscriptions(end_date) WHERE status IN ('active', 'trial');
+CREATE INDEX IF NOT EXISTS ix_payments_status_created_at ON payments(status, created_at);
+CREATE INDEX IF NOT EXISTS ix_payments_user_status ON payments(user_id, status);
+CREATE INDEX IF NOT EXISTS ix_vpn_configs_user_active ON vpn_configs(user_id, is_active);
+CREATE INDEX IF NOT EXISTS ix_users_referred_by ON users(referred_by);
+CREATE INDEX IF NOT EXISTS ix_subscriptions_user_created_at ON subscriptions(user_id, created_at);
+
+-- Keyset pagination of admin lists
+CREATE INDEX IF NOT EXISTS ix_users_created_at_id ON users(created_at, id);
+CREATE INDEX IF NOT EXISTS ix_payments_created_at_id ON payments(created_at, id);
+CREATE INDEX IF NOT EXISTS ix_subscriptions_created_at_id ON subscriptions(created_at, id);
+
+-- Trigram indexes for substring search in the admin users list
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (username gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_users_first_name_trgm ON users USING gin (first_name gin_trgm_ops);
+
 -- Insert default pricing plans
 INSERT INTO pricing_plans (name, description, price, duration_days, plan_type) VALUES
 ('Месячная подписка', 'Доступ к VPN на 1 месяц', 200.00, 30, 'regular'),
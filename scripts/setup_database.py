@@ -12,6 +12,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database.connection import async_session_maker, init_db
 from database.models import PricingPlan, SystemSetting, FAQItem
+from services.cache import catalog_cache
 from decimal import Decimal
 import logging
 import json
@@ -239,6 +240,9 @@ async def main():
         await create_default_faq()
         logger.info("✅ Default FAQ items created")
         
+        # Running bots drop their cached catalog
+        await catalog_cache.invalidate()
+        
         logger.info("\n🎉 Database setup completed successfully!")
         logger.info("Next steps:")
         logger.info("1. Create admin user: python scripts/init_admin.py <your_telegram_id>")
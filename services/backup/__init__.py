@@ -0,0 +1,3 @@
+from .dump import BackupError, DatabaseBackup, database_backup, directory_checksum
+
+__all__ = ["BackupError", "DatabaseBackup", "database_backup", "directory_checksum"]
@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import settings
+from database.models import BackupRecord
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PREFIX = "vpn_bot_backup_"
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+
+class BackupError(Exception):
+    """pg_dump or pg_restore failed"""
+
+
+def pg_dsn(database_url: str) -> str:
+    """libpq connection URL for the pg_* tools"""
+    return database_url.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+def directory_checksum(path: str) -> Tuple[str, int]:
+    """sha256 over every file of a dump directory, read in chunks; returns (hex digest, total bytes)"""
+    digest = hashlib.sha256()
+    total_size = 0
+    for name in sorted(os.listdir(path)):
+        digest.update(name.encode() + b"\0")
+        with open(os.path.join(path, name), "rb") as f:
+            while chunk := f.read(CHECKSUM_CHUNK_SIZE):
+                digest.update(chunk)
+                total_size += len(chunk)
+    return digest.hexdigest(), total_size
+
+
+async def run_command(args: List[str], timeout: float) -> str:
+    """Run a command without blocking the event loop; returns stdout.
+
+    The child is killed if it outlives `timeout` or the awaiting task is
+    cancelled, so no pg_dump is left running behind a dead task.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise BackupError(f"{args[0]} timed out after {timeout:.0f}s")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    if process.returncode != 0:
+        raise BackupError(f"{args[0]} exited with {process.returncode}: {stderr.decode(errors='replace').strip()}")
+    return stdout.decode(errors="replace")
+
+
+def remaining(deadline: float) -> float:
+    """Seconds left until `deadline` (monotonic clock)"""
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise BackupError("Backup ran out of time")
+    return left
+
+
+class DatabaseBackup:
+    """Parallel, compressed pg_dump backups with metadata records.
+
+    Dumps use the directory format, the only one pg_dump can write with
+    several jobs. Each backup gets a `BackupRecord` with its size,
+    duration and checksum, and is verified by listing its table of
+    contents with pg_restore. `timeout` bounds the whole run, dump,
+    checksum and verification together. Retention works on the records,
+    newest successful backups are kept.
+    """
+
+    def __init__(
+        self,
+        backup_dir: str = "/app/backups",
+        jobs: int = 4,
+        compress_level: int = 6,
+        timeout: float = 1200
+    ):
+        self.backup_dir = backup_dir
+        self.jobs = jobs
+        self.compress_level = compress_level
+        self.timeout = timeout
+
+    async def create(self, session: AsyncSession) -> BackupRecord:
+        """Dump, checksum and verify a new backup"""
+        name = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        path = os.path.join(self.backup_dir, name)
+        os.makedirs(self.backup_dir, exist_ok=True)
+
+        record = BackupRecord(name=name, path=path, status="running")
+        session.add(record)
+        await session.commit()
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        try:
+            await run_command([
+                "pg_dump",
+                "--format=directory",
+                f"--jobs={self.jobs}",
+                f"--compress={self.compress_level}",
+                "--no-password",
+                "--file", path,
+                pg_dsn(settings.database_url)
+            ], remaining(deadline))
+            record.duration_seconds = time.monotonic() - started
+            record.completed_at = datetime.now(timezone.utc)
+
+            record.checksum, record.size_bytes = await asyncio.wait_for(
+                asyncio.to_thread(directory_checksum, path), remaining(deadline)
+            )
+            record.toc_entries = await self.verify(path, remaining(deadline))
+            record.verified_at = datetime.now(timezone.utc)
+            record.status = "success"
+        except BaseException as e:
+            # Cancellation (worker shutdown, time limit) must not leave the record running
+            record.status = "failed"
+            record.error = str(e) or type(e).__name__
+            record.duration_seconds = time.monotonic() - started
+            await asyncio.to_thread(shutil.rmtree, path, True)
+            logger.error(f"Database backup {name} failed: {record.error}")
+            if not isinstance(e, Exception):
+                await session.commit()
+                raise
+        await session.commit()
+
+        if record.status == "success":
+            logger.info(
+                f"Database backup created: {name} ({record.size_bytes} bytes, "
+                f"{record.duration_seconds:.1f}s, {record.toc_entries} TOC entries)"
+            )
+        return record
+
+    async def verify(self, path: str, timeout: Optional[float] = None) -> int:
+        """Read the dump's table of contents back; returns the number of entries"""
+        toc = await run_command(["pg_restore", "--list", path], timeout or self.timeout)
+        entries = sum(1 for line in toc.splitlines() if line.strip() and not line.startswith(";"))
+        if not entries:
+            raise BackupError(f"Backup {path} has an empty table of contents")
+        return entries
+
+    async def apply_retention(self, session: AsyncSession, keep_count: int) -> List[str]:
+        """Delete all but the newest `keep_count` successful backups"""
+        result = await session.execute(
+            select(BackupRecord)
+            .where(BackupRecord.status == "success", BackupRecord.deleted_at.is_(None))
+            .order_by(BackupRecord.created_at.desc(), BackupRecord.id.desc())
+            .offset(keep_count)
+        )
+        removed = []
+        for record in result.scalars().all():
+            try:
+                await asyncio.to_thread(shutil.rmtree, record.path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Error removing backup {record.name}: {e}")
+                continue
+            record.deleted_at = datetime.now(timezone.utc)
+            removed.append(record.name)
+            logger.info(f"Removed old backup: {record.name}")
+
+        await session.commit()
+        return removed
+
+    @staticmethod
+    def describe(record: BackupRecord) -> Dict[str, Any]:
+        return {
+            "status": record.status,
+            "filename": record.name,
+            "size": record.size_bytes,
+            "duration": record.duration_seconds,
+            "checksum": record.checksum,
+            "toc_entries": record.toc_entries,
+            "error": record.error
+        }
+
+
+database_backup = DatabaseBackup(
+    backup_dir=settings.backup_dir,
+    jobs=settings.backup_jobs,
+    compress_level=settings.backup_compress_level,
+    timeout=settings.backup_timeout
+)
@@ -0,0 +1,11 @@
+from .models import UserContext, SubscriptionContext, VPNConfigContext, PlanInfo, FAQEntry
+from .user_context import UserContextCache, user_context_cache
+from .catalog import CatalogCache, catalog_cache
+from .qr import QRCodeCache, qr_code_cache
+
+__all__ = [
+    "UserContext", "SubscriptionContext", "VPNConfigContext", "PlanInfo", "FAQEntry",
+    "UserContextCache", "user_context_cache",
+    "CatalogCache", "catalog_cache",
+    "QRCodeCache", "qr_code_cache"
+]
@@ -0,0 +1,205 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import time
+
+from sqlalchemy import select
+
+from bot.config import settings
+from database.connection import async_session_maker, redis_client
+from database.models import PricingPlan, FAQItem, SystemSetting
+from .models import PlanInfo, FAQEntry
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CHANNEL = "catalog:invalidate"
+
+PLANS = "plans"
+FAQ = "faq"
+SETTINGS = "settings"
+SECTIONS = (PLANS, FAQ, SETTINGS)
+
+
+class CatalogCache:
+    """Process-local cache of pricing plans, FAQ items and system settings.
+
+    These tables change rarely, so they are kept in memory and dropped when
+    a writer publishes the changed section on a Redis pub/sub channel.
+    Values derived from a section (rendered keyboards, texts) are cached
+    alongside it and dropped with it. Entries also expire after `max_age`
+    in case an invalidation message is lost.
+    """
+
+    def __init__(self, session_factory=None, max_age: Optional[float] = None):
+        self.session_factory = session_factory or async_session_maker
+        self.max_age = max_age or settings.catalog_cache_max_age
+        self._sections: Dict[str, Tuple[float, Any]] = {}
+        self._derived: Dict[Tuple[str, str], Any] = {}
+        self._listener_task: Optional[asyncio.Task] = None
+
+    async def _get_section(self, section: str, loader: Callable) -> Any:
+        entry = self._sections.get(section)
+        if entry is not None and time.monotonic() - entry[0] < self.max_age:
+            return entry[1]
+
+        async with self.session_factory() as session:
+            value = await loader(session)
+
+        self._drop(section)
+        self._sections[section] = (time.monotonic(), value)
+        return value
+
+    async def get_all_plans(self) -> List[PlanInfo]:
+        """Every pricing plan, active or not"""
+        async def load(session):
+            result = await session.execute(select(PricingPlan).order_by(PricingPlan.id))
+            return [
+                PlanInfo(
+                    id=plan.id,
+                    name=plan.name,
+                    description=plan.description,
+                    price=plan.price,
+                    currency=plan.currency,
+                    duration_days=plan.duration_days,
+                    plan_type=plan.plan_type,
+                    is_active=bool(plan.is_active)
+                )
+                for plan in result.scalars().all()
+            ]
+
+        return await self._get_section(PLANS, load)
+
+    async def get_plans(self) -> List[PlanInfo]:
+        """Active pricing plans, as offered in /pay"""
+        return [plan for plan in await self.get_all_plans() if plan.is_active]
+
+    async def get_plan(self, name: str, active_only: bool = True) -> Optional[PlanInfo]:
+        """Pricing plan by name; `active_only=False` also finds plans hidden from /pay"""
+        plans = await self.get_plans() if active_only else await self.get_all_plans()
+        for plan in plans:
+            if plan.name == name:
+                return plan
+        return None
+
+    async def get_faq(self) -> List[FAQEntry]:
+        """Active FAQ items ordered for display"""
+        async def load(session):
+            result = await session.execute(
+                select(FAQItem).where(FAQItem.is_active == True).order_by(FAQItem.order_index)
+            )
+            return [
+                FAQEntry(
+                    id=item.id,
+                    question=item.question,
+                    answer=item.answer,
+                    category=item.category,
+                    order_index=item.order_index or 0
+                )
+                for item in result.scalars().all()
+            ]
+
+        return await self._get_section(FAQ, load)
+
+    async def get_faq_categories(self) -> List[str]:
+        return sorted({item.category for item in await self.get_faq() if item.category})
+
+    async def get_faq_items(self, category: str) -> List[FAQEntry]:
+        return [item for item in await self.get_faq() if item.category == category]
+
+    async def get_settings(self) -> Dict[str, str]:
+        """All system settings as raw (JSON) strings"""
+        async def load(session):
+            result = await session.execute(select(SystemSetting.key, SystemSetting.value))
+            return dict(result.all())
+
+        return await self._get_section(SETTINGS, load)
+
+    async def get_setting(self, key: str, default: Any = None) -> Any:
+        """System setting value decoded from JSON"""
+        value = (await self.get_settings()).get(key)
+        if value is None:
+            return default
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+
+    async def cached(self, section: str, key: str, factory: Callable[[], Any]) -> Any:
+        """Cache a value derived from a section until the section changes.
+
+        `factory` may be sync or async and is expected to read the section
+        through this cache.
+        """
+        entry = self._sections.get(section)
+        if entry is not None and time.monotonic() - entry[0] < self.max_age:
+            if (section, key) in self._derived:
+                return self._derived[(section, key)]
+
+        value = factory()
+        if asyncio.iscoroutine(value):
+            value = await value
+        # The factory may have reloaded the section, which drops derived values
+        self._derived[(section, key)] = value
+        return value
+
+    def _drop(self, section: str):
+        self._sections.pop(section, None)
+        for derived_key in [k for k in self._derived if k[0] == section]:
+            del self._derived[derived_key]
+
+    def invalidate_local(self, *sections: str):
+        """Drop sections from this process only"""
+        for section in sections or SECTIONS:
+            self._drop(section)
+
+    async def invalidate(self, *sections: str):
+        """Drop sections in every process subscribed to the catalog channel"""
+        self.invalidate_local(*sections)
+        try:
+            await redis_client.publish(CATALOG_CHANNEL, ",".join(sections or SECTIONS))
+        except Exception as e:
+            logger.error(f"Failed to publish catalog invalidation: {e}")
+
+    async def start_listener(self):
+        """Start listening for invalidations on the running loop"""
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(CATALOG_CHANNEL)
+                # Messages may have been missed while disconnected
+                self.invalidate_local()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    sections = [s for s in str(message["data"]).split(",") if s in SECTIONS]
+                    self.invalidate_local(*sections)
+                    logger.info(f"Catalog cache invalidated: {', '.join(sections)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Catalog invalidation listener error: {e}")
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    async def close(self):
+        """Stop listening for invalidations"""
+        if self._listener_task is not None and not self._listener_task.done():
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except (asyncio.CancelledError, RuntimeError):
+                pass
+        self._listener_task = None
+
+
+# Singleton instance
+catalog_cache = CatalogCache()
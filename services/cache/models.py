@@ -0,0 +1,54 @@
+from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime
+from decimal import Decimal
+
+
+class SubscriptionContext(BaseModel):
+    id: int
+    status: str
+    plan_name: Optional[str] = None
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    auto_renew: bool = False
+
+
+class VPNConfigContext(BaseModel):
+    id: int
+    marzban_user_id: Optional[str] = None
+    config_data: Optional[str] = None
+    protocol: Optional[str] = None
+    traffic_used: int = 0
+    last_connected_at: Optional[datetime] = None
+
+
+class UserContext(BaseModel):
+    """User with current subscription and active VPN config, as seen by handlers"""
+    user_id: int
+    telegram_id: int
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    status: Optional[str] = None
+    created_at: Optional[datetime] = None
+    subscription: Optional[SubscriptionContext] = None
+    vpn_config: Optional[VPNConfigContext] = None
+
+
+class PlanInfo(BaseModel):
+    """Pricing plan as shown in the bot"""
+    id: int
+    name: str
+    description: Optional[str] = None
+    price: Decimal
+    currency: Optional[str] = None
+    duration_days: int
+    plan_type: Optional[str] = None
+    is_active: bool = True
+
+
+class FAQEntry(BaseModel):
+    id: int
+    question: str
+    answer: str
+    category: Optional[str] = None
+    order_index: int = 0
@@ -0,0 +1,149 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Union
+import asyncio
+import base64
+import hashlib
+import logging
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message
+
+from database.connection import redis_client
+from services.marzban.utils import generate_config_qr
+
+logger = logging.getLogger(__name__)
+
+QR_PNG_TTL = 30 * 24 * 3600
+# file_ids are tied to the bot token; stale ones are also dropped when rejected
+QR_FILE_ID_TTL = 30 * 24 * 3600
+QR_FILENAME = "vpn_config_qr.png"
+
+
+def config_digest(config_data: str) -> str:
+    """Content address of a config"""
+    return hashlib.sha256(config_data.encode()).hexdigest()
+
+
+def render_qr_png(config_data: str) -> bytes:
+    """Render config QR code as PNG bytes (CPU bound)"""
+    return generate_config_qr(config_data).getvalue()
+
+
+class QRCodeCache:
+    """Content-addressed cache of config QR codes.
+
+    PNGs are rendered in a thread pool, off the event loop, and stored in
+    Redis by a hash of the config. Once a QR code was sent, Telegram's
+    file_id is stored as well and later sends reuse the uploaded photo.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._renders: Dict[str, asyncio.Future] = {}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="qr-render")
+        return self._executor
+
+    @staticmethod
+    def _png_key(digest: str) -> str:
+        return f"qr:png:{digest}"
+
+    @staticmethod
+    def _file_id_key(digest: str) -> str:
+        return f"qr:file_id:{digest}"
+
+    async def get_png(self, config_data: str) -> bytes:
+        """Get PNG for a config, rendering it once if missing"""
+        digest = config_digest(config_data)
+
+        try:
+            cached = await redis_client.get(self._png_key(digest))
+            if cached:
+                return base64.b64decode(cached)
+        except Exception as e:
+            logger.warning(f"QR cache read failed: {e}")
+
+        # Concurrent requests for the same config share one render
+        render = self._renders.get(digest)
+        if render is None:
+            loop = asyncio.get_running_loop()
+            render = loop.run_in_executor(self._get_executor(), render_qr_png, config_data)
+            self._renders[digest] = render
+            render.add_done_callback(lambda _: self._renders.pop(digest, None))
+        png = await asyncio.shield(render)
+
+        try:
+            await redis_client.set(self._png_key(digest), base64.b64encode(png).decode(), ex=QR_PNG_TTL)
+        except Exception as e:
+            logger.warning(f"QR cache write failed: {e}")
+        return png
+
+    async def get_photo(self, config_data: str) -> Union[str, BufferedInputFile]:
+        """Photo to send: a known Telegram file_id or the PNG to upload"""
+        try:
+            file_id = await redis_client.get(self._file_id_key(config_digest(config_data)))
+            if file_id:
+                return file_id
+        except Exception as e:
+            logger.warning(f"QR file_id read failed: {e}")
+
+        png = await self.get_png(config_data)
+        return BufferedInputFile(png, filename=QR_FILENAME)
+
+    async def send_photo(
+        self,
+        config_data: str,
+        send: Callable[[Union[str, BufferedInputFile]], Awaitable[Message]]
+    ) -> Message:
+        """Send the QR photo with `send`, uploading the PNG again if Telegram rejects a cached file_id"""
+        photo = await self.get_photo(config_data)
+        try:
+            sent = await send(photo)
+        except TelegramBadRequest as e:
+            if not isinstance(photo, str):
+                raise
+            logger.warning(f"Cached QR file_id rejected, uploading the PNG again: {e}")
+            await self.forget_file_id(config_data)
+            sent = await send(BufferedInputFile(await self.get_png(config_data), filename=QR_FILENAME))
+
+        await self.remember_file_id(config_data, sent)
+        return sent
+
+    async def remember_file_id(self, config_data: str, message: Message):
+        """Store the file_id of a sent QR photo"""
+        if not message or not message.photo:
+            return
+        try:
+            await redis_client.set(
+                self._file_id_key(config_digest(config_data)), message.photo[-1].file_id, ex=QR_FILE_ID_TTL
+            )
+        except Exception as e:
+            logger.warning(f"QR file_id write failed: {e}")
+
+    async def forget_file_id(self, config_data: str):
+        """Drop a file_id Telegram no longer accepts"""
+        try:
+            await redis_client.delete(self._file_id_key(config_digest(config_data)))
+        except Exception as e:
+            logger.warning(f"QR file_id delete failed: {e}")
+
+    async def prerender(self, config_data: Optional[str]):
+        """Render and store a config QR code ahead of the first request"""
+        if not config_data:
+            return
+        try:
+            await self.get_png(config_data)
+        except Exception as e:
+            logger.error(f"Failed to prerender QR code: {e}")
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+# Singleton instance
+qr_code_cache = QRCodeCache()
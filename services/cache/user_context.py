@@ -0,0 +1,231 @@
+from typing import Iterable, Optional, Tuple
+from collections import OrderedDict
+import logging
+import time
+
+from sqlalchemy import select, true
+
+from bot.config import settings
+from database.connection import async_session_maker, redis_client
+from database.models import User, Subscription, SubscriptionStatus, VPNConfig, PricingPlan
+from .models import UserContext, SubscriptionContext, VPNConfigContext
+
+logger = logging.getLogger(__name__)
+
+
+class LocalLRU:
+    """Small process-local LRU with per-entry expiry"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[int, Tuple[float, UserContext]]" = OrderedDict()
+
+    def get(self, key: int) -> Optional[UserContext]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: int, value: UserContext):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: int):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class UserContextCache:
+    """Read-through cache of the User / active Subscription / active VPNConfig tuple.
+
+    Lookups go to a process-local LRU first, then Redis, then a single
+    PostgreSQL query. Entries live for a short TTL and are invalidated
+    explicitly whenever a subscription or VPN config changes.
+    """
+
+    KEY_PREFIX = "user_ctx"
+
+    def __init__(
+        self,
+        ttl: Optional[int] = None,
+        local_ttl: Optional[float] = None,
+        local_size: Optional[int] = None,
+        session_factory=None
+    ):
+        self.ttl = ttl or settings.user_context_ttl
+        self.local = LocalLRU(
+            maxsize=local_size or settings.user_context_local_size,
+            ttl=local_ttl if local_ttl is not None else settings.user_context_local_ttl
+        )
+        self.session_factory = session_factory or async_session_maker
+
+    def _key(self, telegram_id: int) -> str:
+        return f"{self.KEY_PREFIX}:{telegram_id}"
+
+    def _user_key(self, user_id: int) -> str:
+        # Maps internal user id to telegram id, so tasks can invalidate by user id
+        return f"{self.KEY_PREFIX}:uid:{user_id}"
+
+    async def get(self, telegram_id: int) -> Optional[UserContext]:
+        """Get user context, loading it from the database on a miss"""
+        context = self.local.get(telegram_id)
+        if context is not None:
+            return context
+
+        try:
+            cached = await redis_client.get(self._key(telegram_id))
+            if cached:
+                context = UserContext.model_validate_json(cached)
+                self.local.set(telegram_id, context)
+                return context
+        except Exception as e:
+            logger.warning(f"User context cache read failed for {telegram_id}: {e}")
+
+        context = await self.load(telegram_id)
+        if context is not None:
+            await self.set(context)
+        return context
+
+    async def set(self, context: UserContext):
+        """Store user context in both cache levels"""
+        self.local.set(context.telegram_id, context)
+        try:
+            pipe = redis_client.pipeline()
+            pipe.set(self._key(context.telegram_id), context.model_dump_json(), ex=self.ttl)
+            pipe.set(self._user_key(context.user_id), context.telegram_id, ex=self.ttl)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"User context cache write failed for {context.telegram_id}: {e}")
+
+    async def invalidate(self, *telegram_ids: int):
+        """Drop cached contexts by telegram id"""
+        if not telegram_ids:
+            return
+        for telegram_id in telegram_ids:
+            self.local.pop(telegram_id)
+        try:
+            await redis_client.delete(*(self._key(telegram_id) for telegram_id in telegram_ids))
+        except Exception as e:
+            logger.warning(f"User context cache invalidation failed: {e}")
+
+    async def invalidate_users(self, user_ids: Iterable[int]):
+        """Drop cached contexts by internal user id"""
+        user_ids = list(set(user_ids))
+        if not user_ids:
+            return
+        try:
+            telegram_ids = await redis_client.mget([self._user_key(user_id) for user_id in user_ids])
+        except Exception as e:
+            logger.warning(f"User context cache invalidation failed: {e}")
+            return
+
+        # A missing mapping means the context is not cached
+        await self.invalidate(*(int(telegram_id) for telegram_id in telegram_ids if telegram_id))
+
+    async def load(self, telegram_id: int) -> Optional[UserContext]:
+        """Load user context from the database in a single query"""
+        subscription = (
+            select(
+                Subscription.id,
+                Subscription.status,
+                Subscription.start_date,
+                Subscription.end_date,
+                Subscription.auto_renew,
+                PricingPlan.name.label("plan_name")
+            )
+            .outerjoin(PricingPlan, PricingPlan.id == Subscription.plan_id)
+            .where(
+                Subscription.user_id == User.id,
+                Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL])
+            )
+            .order_by(Subscription.created_at.desc())
+            .limit(1)
+            .lateral("subscription")
+        )
+        vpn_config = (
+            select(
+                VPNConfig.id,
+                VPNConfig.marzban_user_id,
+                VPNConfig.config_data,
+                VPNConfig.protocol,
+                VPNConfig.traffic_used,
+                VPNConfig.last_connected_at
+            )
+            .where(VPNConfig.user_id == User.id, VPNConfig.is_active == True)
+            .order_by(VPNConfig.id.desc())
+            .limit(1)
+            .lateral("vpn_config")
+        )
+
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(
+                    User.id, User.telegram_id, User.username, User.first_name,
+                    User.status, User.created_at,
+                    subscription.c.id.label("subscription_id"),
+                    subscription.c.status.label("subscription_status"),
+                    subscription.c.plan_name,
+                    subscription.c.start_date,
+                    subscription.c.end_date,
+                    subscription.c.auto_renew,
+                    vpn_config.c.id.label("vpn_config_id"),
+                    vpn_config.c.marzban_user_id,
+                    vpn_config.c.config_data,
+                    vpn_config.c.protocol,
+                    vpn_config.c.traffic_used,
+                    vpn_config.c.last_connected_at
+                )
+                .select_from(User)
+                .outerjoin(subscription, true())
+                .outerjoin(vpn_config, true())
+                .where(User.telegram_id == telegram_id)
+            )
+            row = result.first()
+
+        if row is None:
+            return None
+        return self._build_context(row)
+
+    @staticmethod
+    def _build_context(row) -> UserContext:
+        context = UserContext(
+            user_id=row.id,
+            telegram_id=row.telegram_id,
+            username=row.username,
+            first_name=row.first_name,
+            status=row.status,
+            created_at=row.created_at
+        )
+        if row.subscription_id is not None:
+            context.subscription = SubscriptionContext(
+                id=row.subscription_id,
+                status=row.subscription_status,
+                plan_name=row.plan_name,
+                start_date=row.start_date,
+                end_date=row.end_date,
+                auto_renew=bool(row.auto_renew)
+            )
+        if row.vpn_config_id is not None:
+            context.vpn_config = VPNConfigContext(
+                id=row.vpn_config_id,
+                marzban_user_id=row.marzban_user_id,
+                config_data=row.config_data,
+                protocol=row.protocol,
+                traffic_used=row.traffic_used or 0,
+                last_connected_at=row.last_connected_at
+            )
+        return context
+
+
+# Singleton instance
+user_context_cache = UserContextCache()
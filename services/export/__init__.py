@@ -0,0 +1,11 @@
+from .writers import ExportError, PARQUET_AVAILABLE, STREAMABLE_FORMATS
+from .users import UserDataExporter, user_data_exporter, USER_EXPORT_COLUMNS
+
+__all__ = [
+    "ExportError",
+    "PARQUET_AVAILABLE",
+    "STREAMABLE_FORMATS",
+    "UserDataExporter",
+    "user_data_exporter",
+    "USER_EXPORT_COLUMNS"
+]
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from sqlalchemy import select, func, true
+
+from database.connection import engine
+from database.models import User, Subscription, VPNConfig
+from .writers import (
+    INT, STR, BOOL, DATETIME, FILE_EXTENSIONS, STREAMABLE_FORMATS,
+    CSVEncoder, ExportError, open_writer
+)
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = "/app/exports"
+
+USER_EXPORT_COLUMNS = [
+    ("telegram_id", INT),
+    ("username", STR),
+    ("first_name", STR),
+    ("last_name", STR),
+    ("registration_date", DATETIME),
+    ("status", STR),
+    ("subscription_status", STR),
+    ("subscription_end", DATETIME),
+    ("has_vpn_config", BOOL),
+    ("last_used", DATETIME),
+]
+
+
+def user_export_query():
+    """One row per user with the latest subscription and VPN config summary"""
+    latest_sub = (
+        select(Subscription.status, Subscription.end_date)
+        .where(Subscription.user_id == User.id)
+        .order_by(Subscription.created_at.desc(), Subscription.id.desc())
+        .limit(1)
+        .lateral("latest_sub")
+    )
+    vpn = (
+        select(
+            func.bool_or(VPNConfig.is_active).label("is_active"),
+            func.max(VPNConfig.last_connected_at).label("last_connected_at")
+        )
+        .where(VPNConfig.user_id == User.id)
+        .lateral("vpn")
+    )
+    return (
+        select(
+            User.telegram_id,
+            User.username,
+            User.first_name,
+            User.last_name,
+            User.created_at,
+            User.status,
+            latest_sub.c.status,
+            latest_sub.c.end_date,
+            func.coalesce(vpn.c.is_active, False),
+            vpn.c.last_connected_at
+        )
+        .select_from(User)
+        .outerjoin(latest_sub, true())
+        .join(vpn, true())
+        .order_by(User.id)
+    )
+
+
+class UserDataExporter:
+    """Streams the users export from a server-side cursor.
+
+    Rows are fetched and written `chunk_size` at a time, so memory use
+    does not grow with the number of users.
+    """
+
+    def __init__(self, export_dir: str = EXPORT_DIR, chunk_size: int = 5000, progress_interval: float = 2.0):
+        self.export_dir = export_dir
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+
+    async def export_to_file(
+        self,
+        fmt: str = "csv",
+        progress: Optional[Callable[[int], Any]] = None
+    ) -> Dict[str, Any]:
+        """Write the export to `export_dir`.
+
+        `progress` gets the running row count at most every
+        `progress_interval` seconds, called in a worker thread since it
+        may block (e.g. on the Celery result backend).
+        """
+        fmt = fmt.lower()
+        if fmt not in FILE_EXTENSIONS:
+            raise ExportError(f"Unsupported format: {fmt}")
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"users_export_{timestamp}.{FILE_EXTENSIONS[fmt]}"
+        filepath = os.path.join(self.export_dir, filename)
+        partial_path = f"{filepath}.part"
+        os.makedirs(self.export_dir, exist_ok=True)
+
+        records = 0
+        reported_at = time.monotonic()
+        writer = open_writer(fmt, partial_path, USER_EXPORT_COLUMNS)
+        try:
+            async for rows in self._chunks():
+                # Compression and file IO off the event loop
+                await asyncio.to_thread(writer.write, rows)
+                records += len(rows)
+                if progress and time.monotonic() - reported_at >= self.progress_interval:
+                    await asyncio.to_thread(progress, records)
+                    reported_at = time.monotonic()
+            await asyncio.to_thread(writer.close)
+        except BaseException:
+            writer.close()
+            os.remove(partial_path)
+            raise
+
+        # Readers never see a half-written file under the final name
+        os.replace(partial_path, filepath)
+        file_size = os.path.getsize(filepath)
+        logger.info(f"User data exported: {filename} ({records} records, {file_size} bytes)")
+
+        return {
+            "filename": filename,
+            "format": fmt,
+            "records": records,
+            "size": file_size
+        }
+
+    async def stream(self, fmt: str = "csv") -> AsyncIterator[bytes]:
+        """Yield the export as CSV (or gzip-compressed CSV) bytes, chunk by chunk"""
+        if fmt not in STREAMABLE_FORMATS:
+            raise ExportError(f"Format {fmt} cannot be streamed")
+
+        encoder = CSVEncoder(compress=fmt == "csv.gz")
+        yield encoder.header(USER_EXPORT_COLUMNS)
+        async for rows in self._chunks():
+            data = encoder.encode(rows)
+            if data:
+                yield data
+        yield encoder.finish()
+
+    async def _chunks(self) -> AsyncIterator[List[Any]]:
+        async with engine.connect() as conn:
+            result = await conn.stream(user_export_query().execution_options(yield_per=self.chunk_size))
+            async for rows in result.partitions():
+                yield rows
+
+
+user_data_exporter = UserDataExporter()
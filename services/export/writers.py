@@ -0,0 +1,116 @@
+import csv
+import importlib.util
+import io
+import logging
+import zlib
+from datetime import date, datetime
+from typing import Any, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+# Column kinds used to type columnar output
+INT, STR, BOOL, DATETIME = "int", "str", "bool", "datetime"
+
+FILE_EXTENSIONS = {
+    "csv": "csv",
+    "csv.gz": "csv.gz",
+    "parquet": "parquet",
+}
+STREAMABLE_FORMATS = ("csv", "csv.gz")
+
+
+class ExportError(Exception):
+    """Export cannot be produced in the requested format"""
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    return value
+
+
+class CSVEncoder:
+    """Encodes row chunks to CSV bytes, optionally as one gzip stream"""
+
+    def __init__(self, compress: bool = False):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        # wbits=31 writes a gzip container, readable by gunzip and zcat
+        self._compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def header(self, columns: Sequence[Tuple[str, str]]) -> bytes:
+        self._writer.writerow([name for name, _ in columns])
+        return self._flush()
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        self._writer.writerows([_csv_value(value) for value in row] for row in rows)
+        return self._flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.flush() if self._compressor else b""
+
+    def _flush(self) -> bytes:
+        data = self._buffer.getvalue().encode("utf-8")
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return self._compressor.compress(data) if self._compressor else data
+
+
+class CSVFileWriter:
+    def __init__(self, path: str, columns: Sequence[Tuple[str, str]], compress: bool = False):
+        self._encoder = CSVEncoder(compress)
+        self._file = open(path, "wb")
+        self._file.write(self._encoder.header(columns))
+
+    def write(self, rows: List[Sequence[Any]]):
+        self._file.write(self._encoder.encode(rows))
+
+    def close(self):
+        try:
+            self._file.write(self._encoder.finish())
+        finally:
+            self._file.close()
+
+
+class ParquetFileWriter:
+    """Writes each chunk as a Parquet row group"""
+
+    def __init__(self, path: str, columns: Sequence[Tuple[str, str]]):
+        if not PARQUET_AVAILABLE:
+            raise ExportError("Parquet export needs the pyarrow package")
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {INT: pa.int64(), STR: pa.string(), BOOL: pa.bool_(), DATETIME: pa.timestamp("us")}
+        self._pa = pa
+        self._schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+
+    def write(self, rows: List[Sequence[Any]]):
+        columns = list(zip(*rows)) if rows else [() for _ in self._schema]
+        table = self._pa.Table.from_arrays(
+            [self._pa.array(values, type=field.type) for values, field in zip(columns, self._schema)],
+            schema=self._schema
+        )
+        self._writer.write_table(table)
+
+    def close(self):
+        self._writer.close()
+
+
+def open_writer(fmt: str, path: str, columns: Sequence[Tuple[str, str]]):
+    if fmt == "csv":
+        return CSVFileWriter(path, columns)
+    if fmt == "csv.gz":
+        return CSVFileWriter(path, columns, compress=True)
+    if fmt == "parquet":
+        return ParquetFileWriter(path, columns)
+    raise ExportError(f"Unsupported format: {fmt}")
@@ -0,0 +1,3 @@
+from .pool import PoolConfig, HTTPClientPool, http_clients
+
+__all__ = ["PoolConfig", "HTTPClientPool", "http_clients"]
@@ -0,0 +1,114 @@
+from dataclasses import dataclass, replace
+from typing import Dict, Optional
+import asyncio
+import importlib.util
+import logging
+import weakref
+
+import httpx
+
+from bot.config import settings
+from services.monitoring import InstrumentedTransport
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    """Connection pool and timeout settings of one outbound service"""
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    write_timeout: float = 30.0
+    pool_timeout: float = 10.0
+    http2: bool = True
+
+    @classmethod
+    def from_settings(cls, **overrides) -> "PoolConfig":
+        config = cls(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry,
+            connect_timeout=settings.http_connect_timeout,
+            read_timeout=settings.http_read_timeout,
+            write_timeout=settings.http_write_timeout,
+            pool_timeout=settings.http_pool_timeout,
+            http2=settings.http2_enabled,
+        )
+        return replace(config, **overrides)
+
+
+class HTTPClientPool:
+    """Shared outbound HTTP clients, one connection pool per service.
+
+    Clients are created lazily for the running event loop and reused by
+    everything on that loop: the bot, the API and each Celery worker runtime
+    get their own pools, and a pool never outlives the loop it was bound to.
+    """
+
+    def __init__(self):
+        self._configs: Dict[str, PoolConfig] = {}
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._http2_warned = False
+
+    def configure(self, service: str, config: Optional[PoolConfig] = None, **overrides):
+        """Set pool settings of a service (applies to clients created later)"""
+        self._configs[service] = config or PoolConfig.from_settings(**overrides)
+
+    def get(self, service: str) -> httpx.AsyncClient:
+        """Get the client of a service for the running event loop"""
+        loop = asyncio.get_running_loop()
+        clients = self._clients.setdefault(loop, {})
+
+        client = clients.get(service)
+        if client is None or client.is_closed:
+            client = self._create_client(service)
+            clients[service] = client
+        return client
+
+    def _create_client(self, service: str) -> httpx.AsyncClient:
+        config = self._configs.get(service) or PoolConfig.from_settings()
+
+        http2 = config.http2 and HTTP2_AVAILABLE
+        if config.http2 and not HTTP2_AVAILABLE and not self._http2_warned:
+            logger.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+            self._http2_warned = True
+
+        limits = httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry
+        )
+        timeout = httpx.Timeout(
+            connect=config.connect_timeout,
+            read=config.read_timeout,
+            write=config.write_timeout,
+            pool=config.pool_timeout
+        )
+        transport = InstrumentedTransport(service, httpx.AsyncHTTPTransport(limits=limits, http2=http2))
+        logger.info(f"Created HTTP pool for {service} (max {config.max_connections} connections, http2={http2})")
+        return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+    async def close(self, service: Optional[str] = None):
+        """Close clients of the running loop (one service or all)"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        clients = self._clients.get(loop, {})
+
+        names = [service] if service else list(clients)
+        for name in names:
+            client = clients.pop(name, None)
+            if client is not None:
+                await client.aclose()
+
+
+# Singleton instance
+http_clients = HTTPClientPool()
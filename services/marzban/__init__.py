@@ -1,4 +1,5 @@
 from .client import MarzbanClient, marzban_client
+from .reconciler import MarzbanReconciler, marzban_reconciler
 from .models import (
     MarzbanUser, CreateUserRequest, UpdateUserRequest,
     UserUsageResponse, SystemStats, UserStatus, ProxyProtocol
@@ -11,6 +12,7 @@ from .utils import (
 
 __all__ = [
     "MarzbanClient", "marzban_client",
+    "MarzbanReconciler", "marzban_reconciler",
     "MarzbanUser", "CreateUserRequest", "UpdateUserRequest",
     "UserUsageResponse", "SystemStats", "UserStatus", "ProxyProtocol",
     "generate_unique_username", "format_traffic", "parse_vless_url",
@@ -1,8 +1,11 @@
 import httpx
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterable, Callable, Awaitable, AsyncIterator, Tuple
 from datetime import datetime, timedelta
 import logging
+import time
 from bot.config import settings
+from services.http import http_clients
+from .token_manager import TokenManager
 from .models import (
     MarzbanUser, CreateUserRequest, UpdateUserRequest,
     UserUsageResponse, SystemStats, AdminToken, UserStatus
@@ -32,33 +35,163 @@ def retry_on_failure(max_retries: int = 3, delay: float = 1.0):
     return decorator
 
 
+class TokenBucket:
+    """Token bucket rate limiter for async callers"""
+    
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def _get_lock(self) -> asyncio.Lock:
+        """Get lock bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        return self._lock
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        if self.rate <= 0:
+            return
+        
+        async with self._get_lock():
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
 class MarzbanClient:
-    def __init__(self):
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        rate_limit: Optional[float] = None,
+        rate_burst: Optional[int] = None
+    ):
         self.base_url = settings.marzban_api_url.rstrip('/')
         self.username = settings.marzban_admin_username
         self.password = settings.marzban_admin_password
-        self.token: Optional[str] = None
-        self.token_expires: Optional[datetime] = None
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self.tokens = TokenManager(self._fetch_token)
+        
+        # Request scheduler: max in-flight requests + token bucket rate limit
+        self.max_concurrency = max_concurrency or settings.marzban_max_concurrency
+        self.rate_limiter = TokenBucket(
+            rate=rate_limit if rate_limit is not None else settings.marzban_rate_limit,
+            capacity=rate_burst or settings.marzban_rate_burst
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+        
+        # Pool sized to the scheduler, so admitted requests never queue for a connection
+        http_clients.configure(
+            "marzban",
+            max_connections=self.max_concurrency,
+            max_keepalive_connections=self.max_concurrency
+        )
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Pooled HTTP client for the running event loop"""
+        return http_clients.get("marzban")
     
     async def __aenter__(self):
         await self.authenticate()
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.close()
+        # The HTTP pool is shared by the module-level client and reused
+        # across requests; it is closed explicitly on shutdown via close()
+        pass
     
     async def close(self):
         """Close the HTTP client"""
-        await self.client.aclose()
+        await self.tokens.close()
+        await http_clients.close("marzban")
     
-    async def authenticate(self) -> str:
-        """Authenticate with Marzban API and get access token"""
-        if self.token and self.token_expires and datetime.now() < self.token_expires:
-            return self.token
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Get in-flight semaphore bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+    
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send request within the client's concurrency and rate limits"""
+        async with self._get_semaphore():
+            await self.rate_limiter.acquire()
+            response = await self.client.request(method, url, **kwargs)
+        
+        # Token rejected (revoked or expired early): refresh once and retry
+        headers = kwargs.get("headers") or {}
+        authorization = headers.get("Authorization")
+        if response.status_code == 401 and authorization:
+            token = await self.tokens.invalidate(authorization.removeprefix("Bearer "))
+            kwargs["headers"] = {**headers, "Authorization": f"Bearer {token}"}
+            async with self._get_semaphore():
+                await self.rate_limiter.acquire()
+                response = await self.client.request(method, url, **kwargs)
+        
+        return response
+    
+    async def map_users(
+        self,
+        usernames: Iterable[str],
+        op: Callable[[str], Awaitable[Any]]
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """Run a per-user operation concurrently within the client limits.
+        
+        Yields (username, result) pairs as they complete. A failed operation
+        yields its exception as the result instead of aborting the batch.
+        """
+        pending = set()
+        usernames_iter = iter(usernames)
+        
+        async def run(username: str) -> Tuple[str, Any]:
+            try:
+                return username, await op(username)
+            except Exception as e:
+                return username, e
         
+        def fill():
+            # Keep at most max_concurrency operations scheduled at a time
+            for username in usernames_iter:
+                pending.add(asyncio.ensure_future(run(username)))
+                if len(pending) >= self.max_concurrency:
+                    break
+        
+        fill()
         try:
-            response = await self.client.post(
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.discard(task)
+                    yield task.result()
+                fill()
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def authenticate(self) -> str:
+        """Get a valid access token for Marzban API"""
+        return await self.tokens.get_token()
+    
+    async def _fetch_token(self) -> str:
+        """Request a new access token from Marzban API"""
+        try:
+            response = await self._request(
+                "POST",
                 f"{self.base_url}/api/admin/token",
                 data={
                     "username": self.username,
@@ -69,12 +202,8 @@ class MarzbanClient:
             response.raise_for_status()
             
             data = response.json()
-            self.token = data["access_token"]
-            # Token expires in 1 hour by default
-            self.token_expires = datetime.now() + timedelta(hours=1)
-            
             logger.info("Successfully authenticated with Marzban API")
-            return self.token
+            return data["access_token"]
             
         except httpx.HTTPError as e:
             logger.error(f"Failed to authenticate with Marzban: {str(e)}")
@@ -120,7 +249,8 @@ class MarzbanClient:
             request_json = request_data.model_dump(exclude_none=True)
             logger.info(f"Creating Marzban user with data: {request_json}")
             
-            response = await self.client.post(
+            response = await self._request(
+                "POST",
                 f"{self.base_url}/api/user",
                 headers=headers,
                 json=request_json
@@ -141,7 +271,8 @@ class MarzbanClient:
         headers = await self._get_headers()
         
         try:
-            response = await self.client.get(
+            response = await self._request(
+                "GET",
                 f"{self.base_url}/api/user/{username}",
                 headers=headers
             )
@@ -189,7 +320,8 @@ class MarzbanClient:
         
         try:
             logger.info(f"Updating user {username} with data: {update_data}")
-            response = await self.client.put(
+            response = await self._request(
+                "PUT",
                 f"{self.base_url}/api/user/{username}",
                 headers=headers,
                 json=update_data
@@ -210,7 +342,8 @@ class MarzbanClient:
         headers = await self._get_headers()
         
         try:
-            response = await self.client.delete(
+            response = await self._request(
+                "DELETE",
                 f"{self.base_url}/api/user/{username}",
                 headers=headers
             )
@@ -229,7 +362,8 @@ class MarzbanClient:
         headers = await self._get_headers()
         
         try:
-            response = await self.client.post(
+            response = await self._request(
+                "POST",
                 f"{self.base_url}/api/user/{username}/reset",
                 headers=headers
             )
@@ -248,7 +382,8 @@ class MarzbanClient:
         headers = await self._get_headers()
         
         try:
-            response = await self.client.get(
+            response = await self._request(
+                "GET",
                 f"{self.base_url}/api/user/{username}/usage",
                 headers=headers
             )
@@ -270,7 +405,8 @@ class MarzbanClient:
         headers = await self._get_headers()
         
         try:
-            response = await self.client.get(
+            response = await self._request(
+                "GET",
                 f"{self.base_url}/api/system",
                 headers=headers
             )
@@ -283,15 +419,28 @@ class MarzbanClient:
             logger.error(f"Failed to get system stats: {str(e)}")
             raise
     
-    @retry_on_failure(max_retries=3)
     async def get_users_list(
         self,
         offset: int = 0,
         limit: int = 50,
         username: Optional[str] = None,
-        status: Optional[UserStatus] = None
+        status: Optional[UserStatus] = None,
+        sort: Optional[str] = None
     ) -> List[MarzbanUser]:
         """Get list of users from Marzban"""
+        users, _ = await self.get_users_page(offset, limit, username, status, sort)
+        return users
+    
+    @retry_on_failure(max_retries=3)
+    async def get_users_page(
+        self,
+        offset: int = 0,
+        limit: int = 50,
+        username: Optional[str] = None,
+        status: Optional[UserStatus] = None,
+        sort: Optional[str] = None
+    ) -> Tuple[List[MarzbanUser], Optional[int]]:
+        """Get a page of users and the total number of users the panel reports"""
         headers = await self._get_headers()
         
         params = {
@@ -303,9 +452,12 @@ class MarzbanClient:
             params["username"] = username
         if status:
             params["status"] = status
+        if sort:
+            params["sort"] = sort
         
         try:
-            response = await self.client.get(
+            response = await self._request(
+                "GET",
                 f"{self.base_url}/api/users",
                 headers=headers,
                 params=params
@@ -313,7 +465,8 @@ class MarzbanClient:
             response.raise_for_status()
             
             users_data = response.json()
-            return [MarzbanUser(**user) for user in users_data.get("users", [])]
+            users = [MarzbanUser(**user) for user in users_data.get("users", [])]
+            return users, users_data.get("total")
             
         except httpx.HTTPError as e:
             logger.error(f"Failed to get users list: {str(e)}")
@@ -324,7 +477,8 @@ class MarzbanClient:
         headers = await self._get_headers()
         
         try:
-            response = await self.client.put(
+            response = await self._request(
+                "PUT",
                 f"{self.base_url}/api/user/{username}/revoke_sub",
                 headers=headers
             )
@@ -0,0 +1,323 @@
+from typing import Collection, Dict, List, Optional, Any, Set, Tuple
+from datetime import datetime, timezone
+import asyncio
+import logging
+
+from sqlalchemy import select, update, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import User, Subscription, VPNConfig, SubscriptionStatus
+from .client import MarzbanClient, marzban_client
+from .models import MarzbanUser, UserStatus
+
+logger = logging.getLogger(__name__)
+
+# Oldest first, so users created during a scan land after the pages already read
+USERS_SORT = "created_at"
+
+
+class MarzbanUsersMap(dict):
+    """Marzban users by username, with the user count the panel reported"""
+
+    def __init__(self, users=(), total: Optional[int] = None):
+        super().__init__(users)
+        self.total = total
+
+    @property
+    def complete(self) -> bool:
+        """False if the scan fetched fewer users than the panel has"""
+        return self.total is None or len(self) >= self.total
+
+
+def _utcnow() -> datetime:
+    """Naive UTC now (PostgreSQL TIMESTAMP WITHOUT TIME ZONE)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _expire_to_datetime(expire: Optional[int]) -> Optional[datetime]:
+    """Convert Marzban unix expire timestamp to naive UTC datetime"""
+    if not expire:
+        return None
+    return datetime.fromtimestamp(expire, timezone.utc).replace(tzinfo=None)
+
+
+def diff_subscriptions(
+    snapshot: List[Any],
+    users_map: Dict[str, MarzbanUser]
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[int], int]:
+    """Diff a subscription snapshot against Marzban users.
+
+    Each snapshot row must expose vpn_config_id, marzban_user_id, vpn_is_active,
+    traffic_used, subscription_id, subscription_status and end_date.
+    Returns (subscription_updates, vpn_config_updates, synced_vpn_config_ids, missing_count).
+    """
+    subscription_updates: Dict[int, Dict[str, Any]] = {}
+    vpn_updates: Dict[int, Dict[str, Any]] = {}
+    synced_ids: List[int] = []
+    missing = 0
+
+    for row in snapshot:
+        marzban_user = users_map.get(row.marzban_user_id)
+        if not marzban_user:
+            missing += 1
+            continue
+
+        sub_changes: Dict[str, Any] = {}
+        vpn_changes: Dict[str, Any] = {}
+
+        # Marzban user is expired or disabled - expire local subscription
+        if marzban_user.status in (UserStatus.EXPIRED, UserStatus.DISABLED):
+            if row.subscription_status != SubscriptionStatus.EXPIRED:
+                sub_changes["status"] = SubscriptionStatus.EXPIRED
+                if row.vpn_is_active:
+                    vpn_changes["is_active"] = False
+
+        # Marzban is the source of truth for the expiration date
+        marzban_expire_date = _expire_to_datetime(marzban_user.expire)
+        if marzban_expire_date and row.end_date != marzban_expire_date:
+            sub_changes["end_date"] = marzban_expire_date
+
+        if marzban_user.used_traffic and row.traffic_used != marzban_user.used_traffic:
+            vpn_changes["traffic_used"] = marzban_user.used_traffic
+
+        if sub_changes:
+            subscription_updates.setdefault(row.subscription_id, {"id": row.subscription_id}).update(sub_changes)
+        if vpn_changes:
+            vpn_updates.setdefault(row.vpn_config_id, {"id": row.vpn_config_id}).update(vpn_changes)
+
+        synced_ids.append(row.vpn_config_id)
+
+    return list(subscription_updates.values()), list(vpn_updates.values()), synced_ids, missing
+
+
+def changed_user_ids(snapshot: List[Any], updates: List[Dict[str, Any]], id_field: str) -> List[int]:
+    """User ids whose cached context is stale after applying the updates.
+
+    Traffic counters move on every sync and are not part of the user context,
+    so traffic-only updates are ignored.
+    """
+    user_by_id = {getattr(row, id_field): row.user_id for row in snapshot}
+    return sorted({
+        user_by_id[changes["id"]]
+        for changes in updates
+        if set(changes) - {"id", "traffic_used"} and changes["id"] in user_by_id
+    })
+
+
+def diff_user_status(
+    snapshot: List[Any],
+    users_map: Dict[str, MarzbanUser],
+    unconfirmed: Collection[str] = ()
+) -> List[Dict[str, Any]]:
+    """Diff a VPN config snapshot against Marzban user status.
+
+    Each snapshot row must expose vpn_config_id, marzban_user_id, vpn_is_active
+    and traffic_used. Rows of `unconfirmed` usernames, absent from the map but
+    not known to be gone from Marzban, are left alone. Returns the VPN config
+    updates to apply.
+    """
+    vpn_updates: List[Dict[str, Any]] = []
+
+    for row in snapshot:
+        marzban_user = users_map.get(row.marzban_user_id)
+
+        if not marzban_user and row.marzban_user_id in unconfirmed:
+            continue
+
+        if not marzban_user:
+            # User not found in Marzban - mark as inactive
+            if row.vpn_is_active:
+                vpn_updates.append({"id": row.vpn_config_id, "is_active": False})
+            continue
+
+        changes: Dict[str, Any] = {}
+        should_be_active = marzban_user.status == UserStatus.ACTIVE
+        if row.vpn_is_active != should_be_active:
+            changes["is_active"] = should_be_active
+
+        used_traffic = marzban_user.used_traffic or 0
+        if row.traffic_used != used_traffic:
+            changes["traffic_used"] = used_traffic
+
+        if changes:
+            vpn_updates.append({"id": row.vpn_config_id, **changes})
+
+    return vpn_updates
+
+
+class MarzbanReconciler:
+    """Bulk reconciliation of local subscriptions and VPN configs with Marzban.
+
+    A full pass pages through /api/users once, builds an in-memory map keyed by
+    username, diffs it against a single DB snapshot and applies all changes with
+    bulk UPDATEs, so a run costs O(pages) HTTP calls instead of O(users). A
+    config is only deactivated once its user is confirmed gone with a direct
+    lookup, since a scan racing with user changes can miss users.
+    """
+
+    def __init__(self, client: Optional[MarzbanClient] = None, page_size: int = 1000):
+        self.client = client or marzban_client
+        self.page_size = page_size
+
+    async def fetch_users_map(self) -> MarzbanUsersMap:
+        """Page through all Marzban users and index them by username"""
+        users_map = MarzbanUsersMap()
+        offset = 0
+        pages = 0
+
+        while True:
+            page, total = await self.client.get_users_page(offset=offset, limit=self.page_size, sort=USERS_SORT)
+            for marzban_user in page:
+                users_map[marzban_user.username] = marzban_user
+            users_map.total = total
+            pages += 1
+            offset += len(page)
+
+            # The panel may cap the page size, so a short page only ends the scan without a total
+            if not page or (total is not None and offset >= total):
+                break
+            if total is None and len(page) < self.page_size:
+                break
+
+        logger.info(f"Fetched {len(users_map)} of {users_map.total} Marzban users in {pages} pages")
+        return users_map
+
+    async def confirm_missing(
+        self,
+        snapshot: List[Any],
+        users_map: Dict[str, MarzbanUser]
+    ) -> Tuple[Dict[str, MarzbanUser], Set[str]]:
+        """Look up active configs' users that the scan did not return.
+
+        Returns the map with users found individually added, and the
+        usernames whose absence could not be confirmed. A map known to be
+        incomplete confirms nothing.
+        """
+        missing = sorted({
+            row.marzban_user_id for row in snapshot
+            if row.vpn_is_active and row.marzban_user_id not in users_map
+        })
+        if not missing:
+            return users_map, set()
+
+        if not getattr(users_map, "complete", True):
+            logger.warning(
+                f"Marzban scan returned {len(users_map)} of {users_map.total} users, "
+                f"not deactivating {len(missing)} configs"
+            )
+            return users_map, set(missing)
+
+        results = await asyncio.gather(*(self.client.get_user(name) for name in missing), return_exceptions=True)
+        found = dict(users_map)
+        unconfirmed = set()
+        for name, result in zip(missing, results):
+            if isinstance(result, Exception):
+                logger.error(f"Could not confirm Marzban user {name}: {result}")
+                unconfirmed.add(name)
+            elif result is not None:
+                found[name] = result
+        return found, unconfirmed
+
+    async def sync_subscriptions(
+        self,
+        session: AsyncSession,
+        users_map: Optional[Dict[str, MarzbanUser]] = None
+    ) -> Dict[str, int]:
+        """Sync subscription status, expiration dates and traffic from Marzban"""
+        result = await session.execute(
+            select(
+                VPNConfig.id.label("vpn_config_id"),
+                VPNConfig.marzban_user_id,
+                VPNConfig.is_active.label("vpn_is_active"),
+                VPNConfig.traffic_used,
+                VPNConfig.user_id,
+                Subscription.id.label("subscription_id"),
+                Subscription.status.label("subscription_status"),
+                Subscription.end_date
+            )
+            .join(User, VPNConfig.user_id == User.id)
+            .join(Subscription, User.id == Subscription.user_id)
+            .where(
+                and_(
+                    VPNConfig.is_active == True,
+                    VPNConfig.marzban_user_id.isnot(None),
+                    Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL])
+                )
+            )
+        )
+        snapshot = result.all()
+
+        if users_map is None:
+            users_map = await self.fetch_users_map()
+
+        subscription_updates, vpn_updates, synced_ids, missing = diff_subscriptions(snapshot, users_map)
+
+        if subscription_updates:
+            await session.execute(update(Subscription), subscription_updates)
+        if vpn_updates:
+            await session.execute(update(VPNConfig), vpn_updates)
+        if synced_ids:
+            await session.execute(
+                update(VPNConfig)
+                .where(VPNConfig.id.in_(synced_ids))
+                .values(last_connected_at=_utcnow())
+                .execution_options(synchronize_session=False)
+            )
+
+        if missing:
+            logger.warning(f"{missing} VPN configs not found in Marzban")
+
+        changed = set(changed_user_ids(snapshot, subscription_updates, "subscription_id"))
+        changed.update(changed_user_ids(snapshot, vpn_updates, "vpn_config_id"))
+
+        return {
+            'synced': len(synced_ids),
+            'missing': missing,
+            'subscriptions_updated': len(subscription_updates),
+            'configs_updated': len(vpn_updates),
+            'total': len(snapshot),
+            'changed_user_ids': sorted(changed)
+        }
+
+    async def sync_user_status(
+        self,
+        session: AsyncSession,
+        users_map: Optional[Dict[str, MarzbanUser]] = None
+    ) -> Dict[str, int]:
+        """Sync VPN config active flags and traffic from Marzban user status"""
+        result = await session.execute(
+            select(
+                VPNConfig.id.label("vpn_config_id"),
+                VPNConfig.marzban_user_id,
+                VPNConfig.is_active.label("vpn_is_active"),
+                VPNConfig.traffic_used,
+                VPNConfig.user_id
+            )
+            .join(User, VPNConfig.user_id == User.id)
+            .where(VPNConfig.marzban_user_id.isnot(None))
+        )
+        snapshot = result.all()
+
+        if users_map is None:
+            users_map = await self.fetch_users_map()
+
+        if snapshot and not users_map:
+            # An empty panel is far more likely an API problem than real data,
+            # never mass-deactivate configs because of it
+            logger.warning("Marzban returned no users, skipping user status sync")
+            return {'updated': 0, 'total': len(snapshot), 'changed_user_ids': []}
+
+        users_map, unconfirmed = await self.confirm_missing(snapshot, users_map)
+        vpn_updates = diff_user_status(snapshot, users_map, unconfirmed)
+        if vpn_updates:
+            await session.execute(update(VPNConfig), vpn_updates)
+
+        return {
+            'updated': len(vpn_updates),
+            'total': len(snapshot),
+            'changed_user_ids': changed_user_ids(snapshot, vpn_updates, "vpn_config_id")
+        }
+
+
+# Singleton instance
+marzban_reconciler = MarzbanReconciler()
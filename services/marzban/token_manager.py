@@ -0,0 +1,143 @@
+from typing import Optional, Callable, Awaitable
+import asyncio
+import base64
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def get_token_expiry(token: str) -> Optional[float]:
+    """Read the `exp` claim (unix time) from a JWT without verifying it"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    """Access token lifecycle: single-flight refresh and proactive renewal.
+
+    Concurrent callers share one in-flight refresh. The token is renewed in
+    the background `refresh_margin` seconds before its JWT expiry, so callers
+    normally never wait on authentication.
+    """
+
+    def __init__(
+        self,
+        fetch_token: Callable[[], Awaitable[str]],
+        refresh_margin: float = 300.0,
+        default_ttl: float = 3600.0
+    ):
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.default_ttl = default_ttl
+        self.token: Optional[str] = None
+        self.expires_at: float = 0.0
+        self.refresh_at: float = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        """Get lock bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+            self._cancel_foreign_refresh(loop)
+        return self._lock
+
+    def _cancel_foreign_refresh(self, loop: asyncio.AbstractEventLoop):
+        """Stop a renewal task left on a previous event loop.
+
+        Left running, it would keep refreshing and take the lock back to its
+        own loop. Tasks of a closed loop never resume and are just dropped.
+        """
+        task = self._refresh_task
+        self._refresh_task = None
+        if task is None or task.done() or task.get_loop() is loop:
+            return
+        old_loop = task.get_loop()
+        if not old_loop.is_closed():
+            # Task.cancel is not thread-safe, the old loop may run in another thread
+            old_loop.call_soon_threadsafe(task.cancel)
+
+    def is_valid(self) -> bool:
+        """Token is present and not yet due for renewal"""
+        return self.token is not None and time.time() < self.refresh_at
+
+    async def get_token(self) -> str:
+        """Get a valid access token, refreshing it at most once concurrently"""
+        if self.is_valid():
+            return self.token
+
+        async with self._get_lock():
+            # Another caller may have refreshed while we were waiting
+            if self.is_valid():
+                return self.token
+            return await self._refresh()
+
+    async def invalidate(self, token: str) -> str:
+        """Drop a token rejected by the server and get a fresh one.
+
+        Only the first caller holding the rejected token triggers a refresh,
+        the rest receive the token it obtained.
+        """
+        async with self._get_lock():
+            if self.token is not None and self.token != token:
+                return self.token
+            self.token = None
+            return await self._refresh()
+
+    async def _refresh(self) -> str:
+        """Fetch a new token and schedule its proactive renewal (lock held)"""
+        token = await self.fetch_token()
+        now = time.time()
+        expires_at = get_token_expiry(token) or now + self.default_ttl
+
+        self.token = token
+        self.expires_at = expires_at
+        # Short-lived tokens are renewed halfway through their lifetime
+        self.refresh_at = expires_at - min(self.refresh_margin, (expires_at - now) / 2)
+        self._schedule_refresh()
+
+        logger.info(f"Marzban token refreshed, expires in {int(self.expires_at - time.time())}s")
+        return token
+
+    def _schedule_refresh(self):
+        """Start background renewal task on the running loop if needed"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        """Renew the token shortly before it expires"""
+        while True:
+            await asyncio.sleep(max(self.refresh_at - time.time(), 1.0))
+
+            if self.is_valid():
+                continue
+
+            try:
+                async with self._get_lock():
+                    if not self.is_valid():
+                        await self._refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Background Marzban token renewal failed: {e}")
+                await asyncio.sleep(min(60.0, self.refresh_margin))
+
+    async def close(self):
+        """Stop background renewal"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except (asyncio.CancelledError, RuntimeError):
+                pass
+        self._refresh_task = None
@@ -0,0 +1,17 @@
+from .metrics import (
+    HANDLER_DURATION, TELEGRAM_REQUEST_DURATION, TELEGRAM_MESSAGES_SENT, TELEGRAM_SEND_FAILURES,
+    TELEGRAM_RETRY_AFTER, TELEGRAM_RETRY_AFTER_SECONDS, DB_QUERY_DURATION, EXTERNAL_REQUEST_DURATION,
+    HTTP_POOL_CONNECTIONS, HTTP_REQUESTS_IN_FLIGHT, CELERY_TASK_DURATION, CELERY_QUEUE_LAG,
+    render_metrics, start_metrics_server, mark_process_dead
+)
+from .instrumentation import (
+    statement_label, endpoint_label, instrument_engine, InstrumentedTransport
+)
+
+__all__ = [
+    "HANDLER_DURATION", "TELEGRAM_REQUEST_DURATION", "TELEGRAM_MESSAGES_SENT", "TELEGRAM_SEND_FAILURES",
+    "TELEGRAM_RETRY_AFTER", "TELEGRAM_RETRY_AFTER_SECONDS", "DB_QUERY_DURATION", "EXTERNAL_REQUEST_DURATION",
+    "HTTP_POOL_CONNECTIONS", "HTTP_REQUESTS_IN_FLIGHT", "CELERY_TASK_DURATION", "CELERY_QUEUE_LAG",
+    "render_metrics", "start_metrics_server", "mark_process_dead",
+    "statement_label", "endpoint_label", "instrument_engine", "InstrumentedTransport"
+]
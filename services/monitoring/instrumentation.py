@@ -0,0 +1,131 @@
+import logging
+import re
+import time
+from typing import Dict, Optional
+
+import httpx
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .metrics import (
+    DB_QUERY_DURATION, EXTERNAL_REQUEST_DURATION, HTTP_POOL_CONNECTIONS, HTTP_REQUESTS_IN_FLIGHT,
+    CELERY_TASK_DURATION, CELERY_QUEUE_LAG
+)
+
+logger = logging.getLogger(__name__)
+
+_STATEMENT_TABLE = {
+    "select": re.compile(r"\bFROM\s+\"?(\w+)", re.IGNORECASE),
+    "insert": re.compile(r"\bINTO\s+\"?(\w+)", re.IGNORECASE),
+    "update": re.compile(r"^\s*UPDATE\s+\"?(\w+)", re.IGNORECASE),
+    "delete": re.compile(r"\bFROM\s+\"?(\w+)", re.IGNORECASE),
+}
+_ID_SEGMENT = re.compile(r"^(?!v\d+$).*\d|^[0-9a-f-]{32,}$", re.IGNORECASE)
+
+
+def statement_label(statement: str) -> str:
+    """Low-cardinality label for a SQL statement, e.g. `select:users`"""
+    words = statement.split(None, 1)
+    if not words:
+        return "other"
+
+    operation = words[0].lower()
+    pattern = _STATEMENT_TABLE.get(operation)
+    if pattern is None:
+        return operation if operation.isalpha() else "other"
+
+    match = pattern.search(statement)
+    return f"{operation}:{match.group(1).lower()}" if match else operation
+
+
+def endpoint_label(path: str) -> str:
+    """URL path with identifiers (usernames, payment ids) replaced"""
+    segments = [
+        "{id}" if _ID_SEGMENT.search(segment) else segment
+        for segment in path.split("/")
+    ]
+    return "/".join(segments) or "/"
+
+
+def instrument_engine(engine: AsyncEngine):
+    """Record execution time of every statement run through the engine"""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start_time"].pop()
+        DB_QUERY_DURATION.labels(statement_label(statement), "ok").observe(time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        starts = conn.info.get("query_start_time") if conn is not None else None
+        if starts:
+            DB_QUERY_DURATION.labels(
+                statement_label(exception_context.statement or ""), "error"
+            ).observe(time.perf_counter() - starts.pop())
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """httpx transport recording latency of external API calls and pool occupancy"""
+
+    def __init__(self, service: str, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.service = service
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        status = "error"
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(self.service)
+        in_flight.inc()
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            in_flight.dec()
+            EXTERNAL_REQUEST_DURATION.labels(
+                self.service, request.method, endpoint_label(request.url.path), status
+            ).observe(time.perf_counter() - started)
+            self._observe_pool()
+
+    def _observe_pool(self):
+        pool = getattr(self.transport, "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return
+        idle = sum(1 for connection in connections if connection.is_idle())
+        HTTP_POOL_CONNECTIONS.labels(self.service, "idle").set(idle)
+        HTTP_POOL_CONNECTIONS.labels(self.service, "active").set(len(connections) - idle)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+# Celery signal handlers, connected in tasks/celery_app.py
+_task_started: Dict[str, float] = {}
+
+
+def on_before_task_publish(headers=None, **kwargs):
+    """Stamp tasks with their publish time to measure queue lag"""
+    if headers is not None:
+        headers.setdefault("published_at", time.time())
+
+
+def on_task_prerun(task_id=None, task=None, **kwargs):
+    _task_started[task_id] = time.monotonic()
+
+    published_at = getattr(task.request, "published_at", None)
+    if published_at:
+        queue = (task.request.delivery_info or {}).get("routing_key") or "celery"
+        CELERY_QUEUE_LAG.labels(queue, task.name).observe(max(time.time() - float(published_at), 0.0))
+
+
+def on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        CELERY_TASK_DURATION.labels(task.name, state or "UNKNOWN").observe(time.monotonic() - started)
@@ -0,0 +1,135 @@
+import logging
+import os
+import shutil
+from typing import Optional, Tuple
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+    generate_latest, start_http_server
+)
+from prometheus_client import multiprocess
+
+logger = logging.getLogger(__name__)
+
+# Set for processes forking workers (Celery prefork), see start_metrics_server
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+REQUEST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TASK_BUCKETS = (0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 1800.0)
+
+# Bot
+HANDLER_DURATION = Histogram(
+    "bot_handler_duration_seconds",
+    "Time spent in bot handlers",
+    ["router", "handler", "event", "status"],
+    buckets=REQUEST_BUCKETS
+)
+TELEGRAM_REQUEST_DURATION = Histogram(
+    "telegram_request_duration_seconds",
+    "Telegram Bot API call latency",
+    ["method", "status"],
+    buckets=REQUEST_BUCKETS
+)
+TELEGRAM_MESSAGES_SENT = Counter(
+    "telegram_messages_sent_total",
+    "Messages successfully sent to Telegram",
+    ["method"]
+)
+TELEGRAM_SEND_FAILURES = Counter(
+    "telegram_send_failures_total",
+    "Failed Telegram Bot API calls",
+    ["method", "error"]
+)
+TELEGRAM_RETRY_AFTER = Counter(
+    "telegram_retry_after_total",
+    "RetryAfter responses from Telegram flood control",
+    ["method"]
+)
+TELEGRAM_RETRY_AFTER_SECONDS = Counter(
+    "telegram_retry_after_seconds_total",
+    "Time Telegram asked us to wait before retrying",
+    ["method"]
+)
+
+# Database
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Database statement execution time",
+    ["statement", "status"],
+    buckets=FAST_BUCKETS
+)
+
+# External APIs (Marzban, YooKassa, Wata)
+EXTERNAL_REQUEST_DURATION = Histogram(
+    "external_request_duration_seconds",
+    "External API call latency",
+    ["service", "method", "endpoint", "status"],
+    buckets=REQUEST_BUCKETS
+)
+
+HTTP_POOL_CONNECTIONS = Gauge(
+    "http_pool_connections",
+    "Connections in outbound HTTP pools",
+    ["service", "state"],
+    multiprocess_mode="livesum"
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Outbound HTTP requests waiting for or holding a pooled connection",
+    ["service"],
+    multiprocess_mode="livesum"
+)
+
+# Celery
+CELERY_TASK_DURATION = Histogram(
+    "celery_task_duration_seconds",
+    "Celery task run time",
+    ["task", "state"],
+    buckets=TASK_BUCKETS
+)
+CELERY_QUEUE_LAG = Histogram(
+    "celery_queue_lag_seconds",
+    "Time between publishing a task and a worker starting it",
+    ["queue", "task"],
+    buckets=TASK_BUCKETS
+)
+
+
+def get_registry() -> CollectorRegistry:
+    """Registry to expose: aggregated over processes in multiprocess mode"""
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Metrics in the Prometheus text format and their content type"""
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int, addr: str = "0.0.0.0") -> bool:
+    """Serve /metrics on a separate port (bot and Celery worker).
+
+    In multiprocess mode the values directory is cleared first, so this must
+    run in the parent process before any worker is forked.
+    """
+    multiproc_dir = os.environ.get(MULTIPROC_DIR_ENV)
+    try:
+        if multiproc_dir:
+            shutil.rmtree(multiproc_dir, ignore_errors=True)
+            os.makedirs(multiproc_dir, exist_ok=True)
+        start_http_server(port, addr=addr, registry=get_registry())
+        logger.info(f"Metrics server listening on {addr}:{port}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to start metrics server on port {port}: {e}")
+        return False
+
+
+def mark_process_dead(pid: Optional[int] = None):
+    """Drop live values of an exited worker process (multiprocess mode)"""
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -1,9 +1,19 @@
 from .telegram_notifier import TelegramNotifier
 from .email_notifier import EmailNotifier
 from .notification_service import NotificationService
+from .rate_limiter import TelegramRateLimiter, SendResult, send_limited_message, send_bulk_messages
+from .ledger import NotificationLedger
+from .broadcast import BroadcastEngine, BroadcastProgress
 
 __all__ = [
     "TelegramNotifier",
     "EmailNotifier", 
-    "NotificationService"
-]
\ No newline at end of file
+    "NotificationService",
+    "TelegramRateLimiter",
+    "SendResult",
+    "send_limited_message",
+    "send_bulk_messages",
+    "NotificationLedger",
+    "BroadcastEngine",
+    "BroadcastProgress"
+]
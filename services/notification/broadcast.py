@@ -0,0 +1,279 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from aiogram import Bot
+from sqlalchemy import select, update, func, exists
+
+from bot.config import settings
+from database.connection import async_session_maker, redis_client
+from database.models import User, Subscription, SubscriptionStatus, BroadcastMessage
+from .rate_limiter import SendResult, TelegramRateLimiter, send_limited_message
+
+logger = logging.getLogger(__name__)
+
+# Subscription statuses a recipient must have, per target audience
+AUDIENCE_STATUSES = {
+    "active": [SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL],
+    "expired": [SubscriptionStatus.EXPIRED],
+    "trial": [SubscriptionStatus.TRIAL],
+}
+
+CHECKPOINT_TTL = 7 * 24 * 3600
+
+
+def recipient_query(target_audience: Optional[str], after_user_id: int = 0):
+    """Recipients of a broadcast as (user_id, telegram_id), ordered by user id"""
+    query = select(User.id, User.telegram_id).where(
+        User.status == 'active',
+        User.id > after_user_id
+    )
+
+    statuses = AUDIENCE_STATUSES.get(target_audience)
+    if statuses:
+        # EXISTS instead of a join, so users with several subscriptions get one message
+        query = query.where(
+            exists().where(
+                Subscription.user_id == User.id,
+                Subscription.status.in_(statuses)
+            )
+        )
+
+    return query.order_by(User.id)
+
+
+class BroadcastProgress:
+    """Progress of recipients completed out of order by concurrent senders.
+
+    Only the contiguous prefix of completed recipients is counted, so a
+    checkpoint never skips a recipient whose message was not sent yet.
+    """
+
+    def __init__(self, last_user_id: int = 0, sent: int = 0, failed: int = 0):
+        self.last_user_id = last_user_id
+        self.sent = sent
+        self.failed = failed
+        self._next_seq = 0
+        self._done: Dict[int, tuple] = {}
+
+    def complete(self, seq: int, user_id: int, success: bool):
+        self._done[seq] = (user_id, success)
+        while self._next_seq in self._done:
+            self.last_user_id, success = self._done.pop(self._next_seq)
+            if success:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._next_seq += 1
+
+    def as_dict(self) -> Dict[str, int]:
+        return {'last_user_id': self.last_user_id, 'sent': self.sent, 'failed': self.failed}
+
+
+class BroadcastEngine:
+    """Streaming broadcast sender.
+
+    Recipients are streamed from a server-side cursor into a bounded queue
+    drained by concurrent senders sharing one Telegram rate limiter. Progress
+    is checkpointed to Redis, so an interrupted broadcast resumes after the
+    last delivered recipient, and counters are flushed to the database in
+    batches.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        session_factory=None,
+        concurrency: Optional[int] = None,
+        rate_limit: Optional[float] = None,
+        checkpoint_interval: float = 1.0,
+        flush_interval: float = 5.0,
+        batch_size: int = 1000
+    ):
+        self.bot = bot
+        self.session_factory = session_factory or async_session_maker
+        self.concurrency = concurrency or settings.broadcast_concurrency
+        self.limiter = TelegramRateLimiter(rate=rate_limit or settings.broadcast_rate_limit)
+        self.checkpoint_interval = checkpoint_interval
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+    @staticmethod
+    def _checkpoint_key(message_id: int) -> str:
+        return f"broadcast:{message_id}:checkpoint"
+
+    async def run(self, message_id: int, max_duration: Optional[float] = None) -> Dict[str, Any]:
+        """Send a broadcast, resuming from its checkpoint if one exists.
+
+        With `max_duration` set, sending stops once it is exceeded and the
+        result status is "paused"; running again continues the broadcast.
+        """
+        async with self.session_factory() as session:
+            broadcast = await session.get(BroadcastMessage, message_id)
+            if not broadcast:
+                logger.error(f"Broadcast message {message_id} not found")
+                return {'status': 'not_found'}
+
+            if broadcast.status == "completed":
+                logger.info(f"Broadcast {message_id} already completed")
+                return {'status': 'completed', 'sent': broadcast.sent_count, 'failed': broadcast.failed_count}
+
+            checkpoint = await self._load_checkpoint(message_id)
+            if checkpoint:
+                logger.info(f"Resuming broadcast {message_id} after user {checkpoint['last_user_id']}")
+            else:
+                result = await session.execute(
+                    select(func.count()).select_from(recipient_query(broadcast.target_audience).subquery())
+                )
+                broadcast.total_recipients = result.scalar() or 0
+
+            broadcast.status = "in_progress"
+            await session.commit()
+
+            content = broadcast.content
+            target_audience = broadcast.target_audience
+
+        progress = BroadcastProgress(**(checkpoint or {}))
+        deadline = asyncio.get_running_loop().time() + max_duration if max_duration else None
+        reporter = asyncio.create_task(self._report(message_id, progress))
+        try:
+            finished = await self._send_all(content, target_audience, progress, deadline)
+        finally:
+            reporter.cancel()
+            try:
+                await reporter
+            except asyncio.CancelledError:
+                pass
+            # Leave a checkpoint behind whatever happened
+            await self._save_checkpoint(message_id, progress)
+
+        if not finished:
+            await self._flush_counters(message_id, progress.sent, progress.failed)
+            logger.info(f"Broadcast {message_id} paused after user {progress.last_user_id}")
+            return {'status': 'paused', 'sent': progress.sent, 'failed': progress.failed}
+
+        async with self.session_factory() as session:
+            await session.execute(
+                update(BroadcastMessage)
+                .where(BroadcastMessage.id == message_id)
+                .values(
+                    sent_count=progress.sent,
+                    failed_count=progress.failed,
+                    status="completed",
+                    completed_at=datetime.now()
+                )
+            )
+            await session.commit()
+
+        await self._delete_checkpoint(message_id)
+        logger.info(f"Broadcast {message_id} completed: {progress.sent} sent, {progress.failed} failed")
+        return {'status': 'completed', 'sent': progress.sent, 'failed': progress.failed}
+
+    async def _send_all(
+        self,
+        content: str,
+        target_audience: Optional[str],
+        progress: BroadcastProgress,
+        deadline: Optional[float] = None
+    ) -> bool:
+        """Stream recipients into the queue and wait for senders to drain it.
+
+        Returns False if the deadline stopped the stream early.
+        """
+        loop = asyncio.get_running_loop()
+        finished = True
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        senders = [
+            asyncio.create_task(self._sender(queue, content, progress))
+            for _ in range(self.concurrency)
+        ]
+
+        try:
+            async with self.session_factory() as session:
+                stream = await session.stream(
+                    recipient_query(target_audience, progress.last_user_id)
+                    .execution_options(yield_per=self.batch_size)
+                )
+                seq = 0
+                async for user_id, telegram_id in stream:
+                    if deadline is not None and loop.time() >= deadline:
+                        finished = False
+                        break
+                    await queue.put((seq, user_id, telegram_id))
+                    seq += 1
+
+            for _ in senders:
+                await queue.put(None)
+            await asyncio.gather(*senders)
+        finally:
+            for sender in senders:
+                sender.cancel()
+
+        return finished
+
+    async def _sender(self, queue: asyncio.Queue, content: str, progress: BroadcastProgress):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+
+            seq, user_id, telegram_id = item
+            result = await send_limited_message(
+                self.bot, self.limiter, telegram_id, content, parse_mode="Markdown"
+            )
+            progress.complete(seq, user_id, result is SendResult.SENT)
+
+    async def _report(self, message_id: int, progress: BroadcastProgress):
+        """Periodically checkpoint to Redis and flush counters to the database"""
+        loop = asyncio.get_running_loop()
+        flushed_at = loop.time()
+        flushed = (progress.sent, progress.failed)
+
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            await self._save_checkpoint(message_id, progress)
+
+            counters = (progress.sent, progress.failed)
+            if counters != flushed and loop.time() - flushed_at >= self.flush_interval:
+                try:
+                    await self._flush_counters(message_id, *counters)
+                    flushed, flushed_at = counters, loop.time()
+                except Exception as e:
+                    logger.warning(f"Failed to flush broadcast {message_id} counters: {e}")
+
+    async def _flush_counters(self, message_id: int, sent: int, failed: int):
+        async with self.session_factory() as session:
+            await session.execute(
+                update(BroadcastMessage)
+                .where(BroadcastMessage.id == message_id)
+                .values(sent_count=sent, failed_count=failed)
+            )
+            await session.commit()
+
+    async def _load_checkpoint(self, message_id: int) -> Optional[Dict[str, int]]:
+        try:
+            data = await redis_client.hgetall(self._checkpoint_key(message_id))
+        except Exception as e:
+            logger.warning(f"Failed to read broadcast {message_id} checkpoint: {e}")
+            return None
+
+        if not data:
+            return None
+        return {key: int(value) for key, value in data.items()}
+
+    async def _save_checkpoint(self, message_id: int, progress: BroadcastProgress):
+        key = self._checkpoint_key(message_id)
+        try:
+            pipe = redis_client.pipeline()
+            pipe.hset(key, mapping=progress.as_dict())
+            pipe.expire(key, CHECKPOINT_TTL)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to save broadcast {message_id} checkpoint: {e}")
+
+    async def _delete_checkpoint(self, message_id: int):
+        try:
+            await redis_client.delete(self._checkpoint_key(message_id))
+        except Exception as e:
+            logger.warning(f"Failed to delete broadcast {message_id} checkpoint: {e}")
@@ -0,0 +1,41 @@
+import logging
+from typing import List, Sequence
+
+from database.connection import redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationLedger:
+    """Redis ledger of notifications that were already sent.
+
+    Keys are claimed with SET NX before sending, so concurrent or repeated
+    runs send each notification once. A send that failed transiently
+    releases its key to be retried by the next run.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+
+    def key(self, *parts) -> str:
+        return ":".join([self.prefix, *(str(part) for part in parts)])
+
+    async def claim(self, keys: Sequence[str], ttl: int) -> List[bool]:
+        """Claim keys in one round-trip, True for keys not claimed before"""
+        if not keys:
+            return []
+
+        pipe = redis_client.pipeline()
+        for key in keys:
+            pipe.set(key, 1, nx=True, ex=ttl)
+        results = await pipe.execute()
+        return [bool(result) for result in results]
+
+    async def release(self, keys: Sequence[str]):
+        """Forget keys so their notifications are sent again"""
+        if not keys:
+            return
+        try:
+            await redis_client.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Failed to release notification ledger keys: {e}")
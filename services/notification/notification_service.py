@@ -4,7 +4,7 @@ from typing import Dict, List, Optional, Any
 from datetime import datetime
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.models import User
+from database.models import User, COMPLETED_PAYMENT_STATUSES
 from .telegram_notifier import TelegramNotifier
 from .email_notifier import EmailNotifier
 
@@ -213,7 +213,7 @@ class NotificationService:
         session: Optional[AsyncSession] = None
     ):
         """Send payment status notification"""
-        notification_type = 'payment_success' if payment_status == 'completed' else 'payment_failed'
+        notification_type = 'payment_success' if payment_status in COMPLETED_PAYMENT_STATUSES else 'payment_failed'
         
         await self.send_notification(
             user_id=user_id,
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from enum import Enum
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+from services.marzban.client import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class SendResult(str, Enum):
+    """Outcome of a message send"""
+    SENT = "sent"
+    BLOCKED = "blocked"    # user blocked the bot, permanent
+    REJECTED = "rejected"  # Telegram refused the request (bad chat, bad markup), permanent
+    FAILED = "failed"      # network error or retries exhausted, worth retrying later
+
+
+class TelegramRateLimiter:
+    """Rate limiter following Telegram Bot API limits.
+
+    Messages are limited globally (about 30 per second for bulk sending) and
+    per chat (one message per second). A `RetryAfter` from Telegram pauses
+    every sender sharing the limiter, not just the one that hit it.
+    """
+
+    def __init__(self, rate: float = 25.0, burst: int = 5, per_chat_interval: float = 1.0):
+        self.bucket = TokenBucket(rate=rate, capacity=burst)
+        self.per_chat_interval = per_chat_interval
+        self.paused_until = 0.0
+        self._chat_sent_at: Dict[int, float] = {}
+
+    def pause(self, seconds: float):
+        """Stop all sending for the given time"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id: Optional[int] = None):
+        """Wait until a message may be sent to the chat"""
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if chat_id is not None:
+                sent_at = self._chat_sent_at.get(chat_id)
+                if sent_at is not None:
+                    delay = max(delay, sent_at + self.per_chat_interval - time.monotonic())
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+        await self.bucket.acquire()
+
+        if chat_id is not None:
+            now = time.monotonic()
+            self._chat_sent_at[chat_id] = now
+            # Keep per-chat history bounded to chats that are still limited
+            if len(self._chat_sent_at) > 10000:
+                self._chat_sent_at = {
+                    chat: sent_at for chat, sent_at in self._chat_sent_at.items()
+                    if sent_at + self.per_chat_interval > now
+                }
+
+
+async def send_limited_message(
+    bot: Bot,
+    limiter: TelegramRateLimiter,
+    chat_id: int,
+    text: str,
+    max_retries: int = 3,
+    **kwargs
+) -> SendResult:
+    """Send a message through the limiter, honoring RetryAfter"""
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(chat_id)
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            return SendResult.SENT
+        except TelegramRetryAfter as e:
+            logger.warning(f"Telegram flood control, retry after {e.retry_after}s (chat {chat_id})")
+            limiter.pause(e.retry_after)
+        except TelegramForbiddenError:
+            # User blocked the bot
+            logger.info(f"User {chat_id} has blocked the bot")
+            return SendResult.BLOCKED
+        except TelegramBadRequest as e:
+            logger.warning(f"Telegram rejected message to {chat_id}: {e}")
+            return SendResult.REJECTED
+        except Exception as e:
+            logger.error(f"Failed to send message to {chat_id}: {e}")
+            return SendResult.FAILED
+
+    logger.error(f"Giving up on message to {chat_id} after {max_retries} retries")
+    return SendResult.FAILED
+
+
+async def send_bulk_messages(
+    bot: Bot,
+    messages: Sequence[Tuple[int, str]],
+    limiter: Optional[TelegramRateLimiter] = None,
+    concurrency: int = 8,
+    **kwargs
+) -> List[SendResult]:
+    """Send (chat_id, text) messages concurrently, results in input order"""
+    limiter = limiter or TelegramRateLimiter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(chat_id: int, text: str) -> SendResult:
+        async with semaphore:
+            return await send_limited_message(bot, limiter, chat_id, text, **kwargs)
+
+    return await asyncio.gather(*(send(chat_id, text) for chat_id, text in messages))
@@ -2,11 +2,13 @@ from .base import BasePaymentProvider, PaymentRequest, PaymentResponse, PaymentC
 from .yookassa import YooKassaProvider, yookassa_provider
 from .wata import WataProvider, wata_provider
 from .manager import PaymentManager, payment_manager
+from .webhooks import WebhookIngestor, WebhookRejected, PaymentWebhookConsumer, webhook_ingestor
 
 __all__ = [
     "BasePaymentProvider", "PaymentRequest", "PaymentResponse", "PaymentCallback",
     "PaymentStatus", "PaymentMethod",
     "YooKassaProvider", "yookassa_provider",
     "WataProvider", "wata_provider",
-    "PaymentManager", "payment_manager"
+    "PaymentManager", "payment_manager",
+    "WebhookIngestor", "WebhookRejected", "PaymentWebhookConsumer", "webhook_ingestor"
 ]
\ No newline at end of file
@@ -3,6 +3,8 @@ from typing import Optional, Dict, Any
 from enum import Enum
 from pydantic import BaseModel
 from decimal import Decimal
+import hashlib
+import json
 
 
 class PaymentStatus(str, Enum):
@@ -85,6 +87,11 @@ class BasePaymentProvider(ABC):
         """Parse webhook data"""
         pass
     
+    def get_webhook_event_id(self, data: Dict[str, Any]) -> str:
+        """Identifier of a webhook event, the same for provider retries"""
+        canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+    
     @abstractmethod
     def get_supported_methods(self) -> list[PaymentMethod]:
         """Get list of supported payment methods"""
@@ -132,6 +132,14 @@ class PaymentManager:
         
         return provider.parse_webhook(data)
     
+    def get_webhook_event_id(self, provider_name: str, data: Dict) -> str:
+        """Get webhook event id for deduplication"""
+        provider = self.providers.get(provider_name)
+        if not provider:
+            raise Exception(f"Provider not found: {provider_name}")
+        
+        return provider.get_webhook_event_id(data)
+    
     async def close(self):
         """Close all provider connections"""
         for provider in self.providers.values():
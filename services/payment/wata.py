@@ -8,6 +8,7 @@ from datetime import datetime
 from .base import BasePaymentProvider, PaymentRequest, PaymentResponse, PaymentCallback, PaymentStatus, PaymentMethod
 import logging
 from bot.config import settings
+from services.http import http_clients
 
 logger = logging.getLogger(__name__)
 
@@ -19,11 +20,16 @@ class WataProvider(BasePaymentProvider):
         self.api_key = api_key
         self.secret_key = secret_key
         self.base_url = "https://api.wata.pro/v1"
-        self.client = httpx.AsyncClient(timeout=30.0)
+        http_clients.configure("wata")
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Pooled HTTP client for the running event loop"""
+        return http_clients.get("wata")
     
     async def close(self):
         """Close HTTP client"""
-        await self.client.aclose()
+        await http_clients.close("wata")
     
     def _generate_signature(self, data: Dict[str, Any]) -> str:
         """Generate signature for request"""
@@ -142,7 +148,8 @@ class WataProvider(BasePaymentProvider):
         if not self.secret_key:
             return True
         
-        signature = headers.get("X-Signature", "")
+        # Header names may arrive lower-cased (HTTP/2, ASGI)
+        signature = headers.get("X-Signature") or headers.get("x-signature", "")
         expected_signature = hmac.new(
             self.secret_key.encode(),
             body,
@@ -163,6 +170,10 @@ class WataProvider(BasePaymentProvider):
             raw_data=data
         )
     
+    def get_webhook_event_id(self, data: Dict[str, Any]) -> str:
+        """Event (or payment) id and status: every status change of a payment is its own event"""
+        return f"{data.get('event_id') or data.get('payment_id')}:{data.get('status')}"
+    
     def get_supported_methods(self) -> list[PaymentMethod]:
         """Get supported payment methods"""
         return [PaymentMethod.CARD, PaymentMethod.SBP, PaymentMethod.QIWI]
@@ -0,0 +1,213 @@
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+
+from redis.exceptions import ResponseError
+
+from database.connection import redis_client
+from .manager import payment_manager
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_STREAM = "payments:webhooks"
+WEBHOOK_DEAD_LETTER_STREAM = "payments:webhooks:dead"
+WEBHOOK_GROUP = "payment-webhooks"
+WEBHOOK_DEDUP_TTL = 7 * 24 * 3600  # Providers retry for up to a day
+WEBHOOK_STREAM_MAXLEN = 100000
+
+# Mark the event as seen and append it in one step, so a retry is either a
+# duplicate of a queued event or queued itself
+INGEST_SCRIPT = """
+if redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[1]) then
+    return redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', unpack(ARGV, 3))
+end
+return false
+"""
+
+
+class WebhookRejected(Exception):
+    """Webhook failed verification or could not be parsed"""
+
+
+class WebhookIngestor:
+    """Fast path for payment webhooks.
+
+    The request handler only verifies the signature, deduplicates the event
+    on its provider id and appends it to a Redis Stream. All database and
+    Marzban work happens in `PaymentWebhookConsumer`.
+    """
+
+    def __init__(self, stream: str = WEBHOOK_STREAM, dedup_ttl: int = WEBHOOK_DEDUP_TTL,
+                 maxlen: int = WEBHOOK_STREAM_MAXLEN):
+        self.stream = stream
+        self.dedup_ttl = dedup_ttl
+        self.maxlen = maxlen
+        self._script = None
+
+    async def ingest(self, provider: str, headers: Mapping[str, str], body: bytes) -> Tuple[bool, str]:
+        """Queue a webhook; returns (queued, event_id), queued is False for duplicates"""
+        if not payment_manager.verify_webhook(provider, headers, body):
+            raise WebhookRejected(f"Invalid {provider} webhook signature")
+
+        try:
+            data = json.loads(body)
+            callback = payment_manager.parse_webhook(provider, data)
+            event_id = payment_manager.get_webhook_event_id(provider, data)
+        except Exception as e:
+            raise WebhookRejected(f"Malformed {provider} webhook: {e}")
+
+        if self._script is None:
+            self._script = redis_client.register_script(INGEST_SCRIPT)
+
+        fields = [
+            "provider", provider,
+            "event_id", event_id,
+            "payment_id", callback.payment_id,
+            "body", body.decode(),
+            "received_at", str(time.time()),
+        ]
+        message_id = await self._script(
+            keys=[f"webhook:seen:{provider}:{event_id}", self.stream],
+            args=[self.dedup_ttl, self.maxlen, *fields]
+        )
+
+        if message_id is None:
+            logger.info(f"Duplicate {provider} webhook {event_id} ignored")
+            return False, event_id
+
+        logger.info(f"Queued {provider} webhook {event_id} for payment {callback.payment_id}")
+        return True, event_id
+
+
+class PaymentWebhookConsumer:
+    """Consumer group worker for queued payment webhooks.
+
+    Events are acknowledged only after they were processed (at-least-once).
+    Events of the same payment are handled one after another in stream
+    order, different payments concurrently. Events left pending by a failed
+    or crashed consumer are claimed again after `min_idle` seconds and moved
+    to a dead-letter stream after `max_deliveries` attempts.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, Dict[str, Any]], Awaitable[Any]],
+        stream: str = WEBHOOK_STREAM,
+        group: str = WEBHOOK_GROUP,
+        consumer: Optional[str] = None,
+        batch_size: int = 100,
+        concurrency: int = 10,
+        block_ms: int = 5000,
+        min_idle: float = 60.0,
+        max_deliveries: int = 10
+    ):
+        self.handler = handler
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.block_ms = block_ms
+        self.min_idle = min_idle
+        self.max_deliveries = max_deliveries
+
+    async def ensure_group(self):
+        """Create the consumer group (and stream) if missing"""
+        try:
+            await redis_client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def run(self, max_duration: float) -> Dict[str, int]:
+        """Consume events until the time budget runs out"""
+        await self.ensure_group()
+        deadline = time.monotonic() + max_duration
+        stats = {"processed": 0, "failed": 0, "dead_lettered": 0}
+        next_reclaim = 0.0
+
+        while time.monotonic() < deadline:
+            if time.monotonic() >= next_reclaim:
+                entries = await self._reclaim(stats)
+                next_reclaim = time.monotonic() + self.min_idle / 2
+                if entries:
+                    await self._process(entries, stats)
+
+            block = int(min(self.block_ms, max(deadline - time.monotonic(), 0) * 1000))
+            if block <= 0:
+                break
+            response = await redis_client.xreadgroup(
+                self.group, self.consumer, {self.stream: ">"},
+                count=self.batch_size, block=block
+            )
+            for _, entries in response or []:
+                await self._process(entries, stats)
+
+        return stats
+
+    async def _reclaim(self, stats: Dict[str, int]) -> List[Tuple[str, Dict[str, str]]]:
+        """Take over events other consumers left pending for too long"""
+        pending = await redis_client.xpending_range(
+            self.stream, self.group, min="-", max="+",
+            count=self.batch_size, idle=int(self.min_idle * 1000)
+        )
+        if not pending:
+            return []
+
+        retry_ids = []
+        for item in pending:
+            if item["times_delivered"] >= self.max_deliveries:
+                await self._dead_letter(item["message_id"], item["times_delivered"])
+                stats["dead_lettered"] += 1
+            else:
+                retry_ids.append(item["message_id"])
+
+        if not retry_ids:
+            return []
+        claimed = await redis_client.xclaim(
+            self.stream, self.group, self.consumer, int(self.min_idle * 1000), retry_ids
+        )
+        # Entries trimmed from the stream come back without fields
+        return sorted(
+            [(message_id, fields) for message_id, fields in claimed if fields],
+            key=lambda entry: tuple(int(part) for part in entry[0].split("-"))
+        )
+
+    async def _dead_letter(self, message_id: str, deliveries: int):
+        entries = await redis_client.xrange(self.stream, min=message_id, max=message_id)
+        if entries:
+            fields = dict(entries[0][1], deliveries=str(deliveries), source_id=message_id)
+            await redis_client.xadd(WEBHOOK_DEAD_LETTER_STREAM, fields, maxlen=WEBHOOK_STREAM_MAXLEN, approximate=True)
+            logger.error(f"Payment webhook {fields.get('event_id')} moved to dead letters after {deliveries} attempts")
+        await redis_client.xack(self.stream, self.group, message_id)
+
+    async def _process(self, entries: List[Tuple[str, Dict[str, str]]], stats: Dict[str, int]):
+        """Process a batch: per-payment lanes in stream order, lanes concurrently"""
+        lanes: Dict[str, List[Tuple[str, Dict[str, str]]]] = {}
+        for message_id, fields in entries:
+            lanes.setdefault(fields.get("payment_id", message_id), []).append((message_id, fields))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_lane(lane: List[Tuple[str, Dict[str, str]]]):
+            async with semaphore:
+                for message_id, fields in lane:
+                    try:
+                        await self.handler(fields["provider"], json.loads(fields["body"]))
+                    except Exception as e:
+                        # Later events of this payment wait for the failed one
+                        logger.error(f"Error processing payment webhook {fields.get('event_id')}: {e}")
+                        stats["failed"] += 1
+                        return
+                    await redis_client.xack(self.stream, self.group, message_id)
+                    stats["processed"] += 1
+
+        await asyncio.gather(*(run_lane(lane) for lane in lanes.values()))
+
+
+# Singleton instance
+webhook_ingestor = WebhookIngestor()
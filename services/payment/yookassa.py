@@ -9,6 +9,7 @@ from datetime import datetime
 from .base import BasePaymentProvider, PaymentRequest, PaymentResponse, PaymentCallback, PaymentStatus, PaymentMethod
 import logging
 from bot.config import settings
+from services.http import http_clients
 
 logger = logging.getLogger(__name__)
 
@@ -20,11 +21,16 @@ class YooKassaProvider(BasePaymentProvider):
         self.shop_id = shop_id
         self.secret_key = secret_key
         self.base_url = "https://api.yookassa.ru/v3"
-        self.client = httpx.AsyncClient(timeout=30.0)
+        http_clients.configure("yookassa")
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Pooled HTTP client for the running event loop"""
+        return http_clients.get("yookassa")
     
     async def close(self):
         """Close HTTP client"""
-        await self.client.aclose()
+        await http_clients.close("yookassa")
     
     def _get_headers(self) -> Dict[str, str]:
         """Get request headers with authentication"""
@@ -147,6 +153,18 @@ class YooKassaProvider(BasePaymentProvider):
         """Parse YooKassa webhook data"""
         event_data = data["object"]
         
+        # Refund notifications carry the refund object, linked to the payment
+        if data.get("event", "").startswith("refund."):
+            return PaymentCallback(
+                payment_id=event_data["payment_id"],
+                order_id="",
+                status=PaymentStatus.REFUNDED if event_data.get("status") == "succeeded" else PaymentStatus.PENDING,
+                amount=Decimal(event_data["amount"]["value"]),
+                currency=event_data["amount"]["currency"],
+                metadata=event_data.get("metadata", {}),
+                raw_data=data
+            )
+        
         return PaymentCallback(
             payment_id=event_data["id"],
             order_id=event_data.get("metadata", {}).get("order_id", ""),
@@ -157,6 +175,11 @@ class YooKassaProvider(BasePaymentProvider):
             raw_data=data
         )
     
+    def get_webhook_event_id(self, data: Dict[str, Any]) -> str:
+        """YooKassa notifications have no id: one event per object and type"""
+        event_data = data.get("object", {})
+        return f"{data.get('event')}:{event_data.get('id')}:{event_data.get('status')}"
+    
     def get_supported_methods(self) -> list[PaymentMethod]:
         """Get supported payment methods"""
         return [PaymentMethod.CARD, PaymentMethod.SBP, PaymentMethod.YOOMONEY, PaymentMethod.QIWI]
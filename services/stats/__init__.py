@@ -1,9 +1,17 @@
 from .stats_service import StatsService
-from .usage_tracker import UsageTracker
+from .usage_storage import UsageStorage, usage_storage
+from .usage_tracker import UsageTracker, usage_tracker, compute_usage_deltas
 from .analytics import AnalyticsService
+from .rollups import DailyMetricsRollup, daily_metrics_rollup
 
 __all__ = [
     "StatsService",
     "UsageTracker",
-    "AnalyticsService"
+    "usage_tracker",
+    "compute_usage_deltas",
+    "UsageStorage",
+    "usage_storage",
+    "AnalyticsService",
+    "DailyMetricsRollup",
+    "daily_metrics_rollup"
 ]
\ No newline at end of file
@@ -8,11 +8,59 @@ import json
 
 from database.models import (
     User, Subscription, Payment, VPNConfig, 
-    UsageStats, ReferralStats, ActionLog
+    UsageStats, ReferralStats, ActionLog, COMPLETED_PAYMENT_STATUSES
 )
+from database.connection import redis_client
+from .rollups import daily_metrics_rollup
 
 logger = logging.getLogger(__name__)
 
+COHORT_STEPS = {
+    'week': {'step_weeks': 1, 'step_months': 0},
+    'month': {'step_weeks': 0, 'step_months': 1}
+}
+
+# Subscriptions that actually gave the user access during their period
+COHORT_ACTIVE_STATUSES = ('active', 'expired', 'trial')
+
+COHORT_CACHE_TTL = 24 * 60 * 60
+
+# Cohort size and active users for every (cohort, period offset) pair:
+# a user is active in a period if any of their subscriptions overlaps it.
+COHORT_RETENTION_QUERY = text("""
+    WITH params AS (
+        SELECT make_interval(months => :step_months, weeks => :step_weeks) AS step
+    ),
+    cohorts AS (
+        SELECT id AS user_id, date_trunc(:granularity, created_at) AS cohort
+        FROM users, params
+        WHERE created_at >= date_trunc(:granularity, now())
+            - (CAST(:cohorts AS integer) - 1) * params.step
+    ),
+    sizes AS (
+        SELECT cohort, count(*) AS cohort_size
+        FROM cohorts
+        GROUP BY cohort
+    )
+    SELECT
+        c.cohort,
+        p.period,
+        sz.cohort_size,
+        count(DISTINCT s.user_id) AS active_users
+    FROM cohorts c
+    CROSS JOIN params
+    JOIN sizes sz ON sz.cohort = c.cohort
+    CROSS JOIN generate_series(0, CAST(:horizon AS integer) - 1) AS p(period)
+    LEFT JOIN subscriptions s
+        ON s.user_id = c.user_id
+        AND s.status = ANY(:statuses)
+        AND s.start_date < c.cohort + (p.period + 1) * params.step
+        AND s.end_date >= c.cohort + p.period * params.step
+    WHERE c.cohort + p.period * params.step <= now()
+    GROUP BY c.cohort, p.period, sz.cohort_size
+    ORDER BY c.cohort DESC, p.period
+""")
+
 
 class AnalyticsService:
     """Advanced analytics and reporting service"""
@@ -38,7 +86,7 @@ class AnalyticsService:
             paid_users_result = await session.execute(
                 select(func.count(User.id.distinct())).select_from(
                     User.__table__.join(Payment.__table__)
-                ).where(Payment.status == 'completed')
+                ).where(Payment.status.in_(COMPLETED_PAYMENT_STATUSES))
             )
             paid_users = paid_users_result.scalar()
             
@@ -82,72 +130,75 @@ class AnalyticsService:
     async def get_cohort_analysis(
         self, 
         session: AsyncSession,
-        months: int = 6
+        months: int = 6,
+        granularity: str = 'month',
+        horizon: int = 6
     ) -> Dict[str, Any]:
-        """Get user cohort analysis"""
+        """Get user cohort analysis
+        
+        `months` is the number of most recent cohorts, `granularity` the
+        cohort/period size ('week' or 'month') and `horizon` the number of
+        periods tracked after signup. The whole cohort × period matrix is
+        computed in one query and cached for the day.
+        """
         try:
-            cohort_data = {}
-            current_date = date.today()
-            
-            for i in range(months):
-                cohort_month = current_date.replace(day=1) - timedelta(days=32*i)
-                cohort_month = cohort_month.replace(day=1)
-                next_month = (cohort_month.replace(day=28) + timedelta(days=4)).replace(day=1)
-                
-                # Users registered in this cohort
-                cohort_users_result = await session.execute(
-                    select(func.count(User.id)).where(
-                        and_(
-                            User.created_at >= cohort_month,
-                            User.created_at < next_month
-                        )
-                    )
-                )
-                cohort_size = cohort_users_result.scalar()
-                
-                if cohort_size == 0:
-                    continue
-                
-                # Calculate retention for each month after
-                retention_data = []
-                for month_offset in range(6):  # Check 6 months of retention
-                    check_date = next_month + timedelta(days=32*month_offset)
-                    check_next_month = (check_date.replace(day=28) + timedelta(days=4)).replace(day=1)
-                    
-                    # Users from cohort still active in this month
-                    active_users_result = await session.execute(
-                        select(func.count(User.id.distinct())).select_from(
-                            User.__table__.join(Subscription.__table__)
-                        ).where(
-                            and_(
-                                User.created_at >= cohort_month,
-                                User.created_at < next_month,
-                                Subscription.status == 'active',
-                                Subscription.end_date >= check_date,
-                                Subscription.end_date < check_next_month
-                            )
-                        )
-                    )
-                    active_users = active_users_result.scalar()
-                    
-                    retention_rate = (active_users / cohort_size * 100) if cohort_size > 0 else 0
-                    retention_data.append({
-                        'month': month_offset,
-                        'active_users': active_users,
-                        'retention_rate': round(retention_rate, 2)
-                    })
-                
-                cohort_data[cohort_month.strftime('%Y-%m')] = {
-                    'cohort_size': cohort_size,
-                    'retention': retention_data
+            if granularity not in COHORT_STEPS:
+                raise ValueError(f"Unsupported cohort granularity: {granularity}")
+            
+            cache_key = f"analytics:cohorts:{granularity}:{months}:{horizon}:{date.today().isoformat()}"
+            cached = await self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+            
+            result = await session.execute(
+                COHORT_RETENTION_QUERY,
+                {
+                    'granularity': granularity,
+                    **COHORT_STEPS[granularity],
+                    'cohorts': months,
+                    'horizon': horizon,
+                    'statuses': list(COHORT_ACTIVE_STATUSES)
                 }
+            )
+            
+            label_format = '%Y-%m' if granularity == 'month' else '%Y-%m-%d'
+            period_key = 'month' if granularity == 'month' else 'week'
+            cohort_data = {}
             
+            for row in result:
+                cohort = cohort_data.setdefault(row.cohort.strftime(label_format), {
+                    'cohort_size': row.cohort_size,
+                    'retention': []
+                })
+                cohort['retention'].append({
+                    period_key: row.period,
+                    'active_users': row.active_users,
+                    'retention_rate': round(row.active_users / row.cohort_size * 100, 2)
+                })
+            
+            await self._cache_set(cache_key, cohort_data, ttl=COHORT_CACHE_TTL)
             return cohort_data
             
         except Exception as e:
             logger.error(f"Error calculating cohort analysis: {e}")
             return {}
     
+    async def _cache_get(self, key: str) -> Optional[Any]:
+        """Get cached analytics result"""
+        try:
+            value = await redis_client.get(key)
+            return json.loads(value) if value else None
+        except Exception as e:
+            logger.warning(f"Analytics cache read failed for {key}: {e}")
+            return None
+    
+    async def _cache_set(self, key: str, value: Any, ttl: int):
+        """Cache analytics result"""
+        try:
+            await redis_client.set(key, json.dumps(value), ex=ttl)
+        except Exception as e:
+            logger.warning(f"Analytics cache write failed for {key}: {e}")
+    
     async def get_revenue_analytics(
         self, 
         session: AsyncSession,
@@ -157,55 +208,33 @@ class AnalyticsService:
         try:
             start_date = date.today() - timedelta(days=days)
             
-            # Daily revenue
-            daily_revenue_result = await session.execute(
-                select(
-                    func.date(Payment.created_at).label('date'),
-                    func.sum(Payment.amount).label('revenue'),
-                    func.count(Payment.id).label('transactions')
-                ).where(
-                    and_(
-                        Payment.status == 'completed',
-                        Payment.created_at >= start_date
-                    )
-                ).group_by(
-                    func.date(Payment.created_at)
-                ).order_by('date')
-            )
+            # Daily revenue from rollups
+            metrics = await daily_metrics_rollup.get_daily_metrics(session, start_date)
             
             daily_data = []
             total_revenue = Decimal('0')
             total_transactions = 0
             
-            for row in daily_revenue_result:
+            for metric in metrics:
+                if not metric.transactions:
+                    continue
                 daily_data.append({
-                    'date': row.date.strftime('%Y-%m-%d'),
-                    'revenue': float(row.revenue),
-                    'transactions': row.transactions
+                    'date': metric.date.strftime('%Y-%m-%d'),
+                    'revenue': float(metric.revenue),
+                    'transactions': metric.transactions
                 })
-                total_revenue += row.revenue
-                total_transactions += row.transactions
+                total_revenue += metric.revenue
+                total_transactions += metric.transactions
             
-            # Revenue by payment method
-            payment_method_result = await session.execute(
-                select(
-                    Payment.payment_method,
-                    func.sum(Payment.amount).label('revenue'),
-                    func.count(Payment.id).label('count')
-                ).where(
-                    and_(
-                        Payment.status == 'completed',
-                        Payment.created_at >= start_date
-                    )
-                ).group_by(Payment.payment_method)
-            )
+            # Revenue by payment system
+            payment_systems = await daily_metrics_rollup.get_revenue_by_payment_system(session, start_date)
             
             payment_methods = []
-            for row in payment_method_result:
+            for row in payment_systems:
                 payment_methods.append({
-                    'method': row.payment_method or 'Unknown',
+                    'method': row.payment_system or 'Unknown',
                     'revenue': float(row.revenue),
-                    'transactions': row.count,
+                    'transactions': row.transactions,
                     'percentage': float(row.revenue / total_revenue * 100) if total_revenue > 0 else 0
                 })
             
@@ -217,7 +246,7 @@ class AnalyticsService:
                     Payment.__table__
                 ).where(
                     and_(
-                        Payment.status == 'completed',
+                        Payment.status.in_(COMPLETED_PAYMENT_STATUSES),
                         Payment.created_at >= start_date
                     )
                 ).group_by(Payment.user_id)
@@ -0,0 +1,268 @@
+import json
+import logging
+from typing import Dict, List, Optional, Any, Set
+from datetime import datetime, date, time, timedelta
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, and_, or_, union, delete, exists
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import insert
+
+from database.models import (
+    User, Subscription, Payment, PricingPlan, SubscriptionStatus,
+    SystemSetting, DailyMetric, DailyPaymentMetric, COMPLETED_PAYMENT_STATUSES
+)
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_KEY = 'daily_metrics_watermark'
+# Rows stamped before the watermark but committed after it (long transactions,
+# clock skew between app and database) are still picked up by the next refresh
+WATERMARK_MARGIN = timedelta(minutes=5)
+
+
+class DailyMetricsRollup:
+    """Incrementally maintained daily rollups for charts and reports.
+
+    Each refresh recomputes only the days touched since the previous
+    refresh (its watermark), so readers cost O(days) instead of scanning
+    payments, users and subscriptions on every request.
+    """
+
+    def __init__(self, backfill_days: int = 365):
+        self.backfill_days = backfill_days
+
+    async def refresh(self, session: AsyncSession) -> Dict[str, Any]:
+        """Recompute rollups for days touched since the last watermark"""
+        started_at = datetime.now()
+        watermark = await self._get_watermark(session)
+
+        if watermark is None:
+            first_day = started_at.date() - timedelta(days=self.backfill_days)
+            days = self._days_between(first_day, started_at.date())
+        else:
+            days = await self._touched_days(session, watermark, started_at.date())
+
+        days = sorted(days)
+        if days:
+            await self._recompute(session, days, started_at)
+
+        # Rows written while we were running are picked up by the next refresh
+        await self._set_watermark(session, started_at)
+        await session.commit()
+
+        logger.info(f"Daily metrics refreshed for {len(days)} days")
+        return {
+            'days_refreshed': len(days),
+            'watermark': started_at.isoformat()
+        }
+
+    async def get_daily_metrics(
+        self,
+        session: AsyncSession,
+        start_date: date,
+        end_date: Optional[date] = None
+    ) -> List[DailyMetric]:
+        """Get daily rollups for a date range"""
+        query = select(DailyMetric).where(DailyMetric.date >= start_date)
+        if end_date:
+            query = query.where(DailyMetric.date <= end_date)
+
+        result = await session.execute(query.order_by(DailyMetric.date))
+        return result.scalars().all()
+
+    async def get_revenue_by_payment_system(
+        self,
+        session: AsyncSession,
+        start_date: date,
+        end_date: Optional[date] = None
+    ) -> List[Any]:
+        """Get revenue and transactions per payment system for a date range"""
+        conditions = [DailyPaymentMetric.date >= start_date]
+        if end_date:
+            conditions.append(DailyPaymentMetric.date <= end_date)
+
+        result = await session.execute(
+            select(
+                DailyPaymentMetric.payment_system,
+                func.sum(DailyPaymentMetric.revenue).label('revenue'),
+                func.sum(DailyPaymentMetric.transactions).label('transactions')
+            ).where(
+                and_(*conditions)
+            ).group_by(
+                DailyPaymentMetric.payment_system
+            ).order_by(
+                func.sum(DailyPaymentMetric.revenue).desc()
+            )
+        )
+        return result.all()
+
+    @staticmethod
+    def _days_between(first_day: date, last_day: date) -> Set[date]:
+        return {first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)}
+
+    async def _get_watermark(self, session: AsyncSession) -> Optional[datetime]:
+        setting = await session.get(SystemSetting, WATERMARK_KEY)
+        if not setting:
+            return None
+        return datetime.fromisoformat(json.loads(setting.value))
+
+    async def _set_watermark(self, session: AsyncSession, watermark: datetime):
+        await session.execute(
+            insert(SystemSetting).values(
+                key=WATERMARK_KEY,
+                value=json.dumps(watermark.isoformat()),
+                description="Daily metrics rollup watermark"
+            ).on_conflict_do_update(
+                index_elements=[SystemSetting.key],
+                set_={'value': json.dumps(watermark.isoformat()), 'updated_at': func.now()}
+            )
+        )
+
+    async def _touched_days(self, session: AsyncSession, since: datetime, today: date) -> Set[date]:
+        """Days whose rollups may have changed since the watermark"""
+        since -= WATERMARK_MARGIN
+        result = await session.execute(
+            union(
+                select(func.date(Payment.created_at)).where(
+                    or_(Payment.created_at >= since, Payment.updated_at >= since)
+                ),
+                select(func.date(User.created_at)).where(User.created_at >= since),
+                select(func.date(Subscription.created_at)).where(
+                    or_(Subscription.created_at >= since, Subscription.updated_at >= since)
+                ),
+                select(func.date(Subscription.end_date)).where(Subscription.updated_at >= since)
+            )
+        )
+        days = {row[0] for row in result if row[0] is not None}
+
+        # Subscriptions expire as time passes, without any row being written
+        days |= self._days_between(since.date(), today)
+        return days
+
+    async def _recompute(self, session: AsyncSession, days: List[date], now: datetime):
+        """Rebuild rollup rows for the given days"""
+        start = datetime.combine(days[0], time.min)
+        end = datetime.combine(days[-1] + timedelta(days=1), time.min)
+
+        def in_days(column):
+            return and_(column >= start, column < end, func.date(column).in_(days))
+
+        is_completed = Payment.status.in_(COMPLETED_PAYMENT_STATUSES)
+        metrics = {day: {'revenue': 0, 'transactions': 0, 'new_users': 0, 'trials_started': 0,
+                         'conversions': 0, 'expirations': 0} for day in days}
+        payment_rows = []
+
+        # Revenue and transactions per payment system
+        result = await session.execute(
+            select(
+                func.date(Payment.created_at).label('date'),
+                Payment.system,
+                func.sum(Payment.amount).label('revenue'),
+                func.count().label('transactions')
+            ).where(
+                and_(is_completed, in_days(Payment.created_at))
+            ).group_by(
+                func.date(Payment.created_at), Payment.system
+            )
+        )
+        for row in result:
+            metrics[row.date]['revenue'] += row.revenue or 0
+            metrics[row.date]['transactions'] += row.transactions
+            payment_rows.append({
+                'date': row.date,
+                'payment_system': row.system or 'unknown',
+                'revenue': row.revenue or 0,
+                'transactions': row.transactions
+            })
+
+        # New users
+        result = await session.execute(
+            select(
+                func.date(User.created_at).label('date'),
+                func.count().label('count')
+            ).where(in_days(User.created_at)).group_by(func.date(User.created_at))
+        )
+        for row in result:
+            metrics[row.date]['new_users'] = row.count
+
+        # Trials started
+        result = await session.execute(
+            select(
+                func.date(Subscription.created_at).label('date'),
+                func.count().label('count')
+            ).select_from(
+                Subscription
+            ).outerjoin(
+                PricingPlan, PricingPlan.id == Subscription.plan_id
+            ).where(
+                and_(
+                    in_days(Subscription.created_at),
+                    or_(PricingPlan.plan_type == 'trial', Subscription.status == SubscriptionStatus.TRIAL)
+                )
+            ).group_by(func.date(Subscription.created_at))
+        )
+        for row in result:
+            metrics[row.date]['trials_started'] = row.count
+
+        # Conversions: user's first successful payment
+        earlier = aliased(Payment)
+        result = await session.execute(
+            select(
+                func.date(Payment.created_at).label('date'),
+                func.count(Payment.user_id.distinct()).label('count')
+            ).where(
+                and_(
+                    is_completed,
+                    in_days(Payment.created_at),
+                    ~exists().where(
+                        and_(
+                            earlier.user_id == Payment.user_id,
+                            earlier.status.in_(COMPLETED_PAYMENT_STATUSES),
+                            earlier.created_at < Payment.created_at
+                        )
+                    )
+                )
+            ).group_by(func.date(Payment.created_at))
+        )
+        for row in result:
+            metrics[row.date]['conversions'] = row.count
+
+        # Expirations
+        result = await session.execute(
+            select(
+                func.date(Subscription.end_date).label('date'),
+                func.count().label('count')
+            ).where(
+                and_(
+                    in_days(Subscription.end_date),
+                    Subscription.end_date < now,
+                    Subscription.status != SubscriptionStatus.PENDING
+                )
+            ).group_by(func.date(Subscription.end_date))
+        )
+        for row in result:
+            metrics[row.date]['expirations'] = row.count
+
+        rows = [{'date': day, **values} for day, values in metrics.items()]
+        stmt = insert(DailyMetric).values(rows)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[DailyMetric.date],
+                set_={
+                    'revenue': stmt.excluded.revenue,
+                    'transactions': stmt.excluded.transactions,
+                    'new_users': stmt.excluded.new_users,
+                    'trials_started': stmt.excluded.trials_started,
+                    'conversions': stmt.excluded.conversions,
+                    'expirations': stmt.excluded.expirations,
+                    'updated_at': func.now()
+                }
+            )
+        )
+
+        await session.execute(delete(DailyPaymentMetric).where(DailyPaymentMetric.date.in_(days)))
+        if payment_rows:
+            await session.execute(insert(DailyPaymentMetric).values(payment_rows))
+
+
+daily_metrics_rollup = DailyMetricsRollup()
@@ -1,14 +1,17 @@
+import asyncio
 import logging
 from typing import Dict, List, Optional, Any
 from datetime import datetime, timedelta, date
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_, or_, text
+from sqlalchemy import select, func, and_, or_
 from decimal import Decimal
 
+from database.connection import async_session_maker
 from database.models import (
     User, Subscription, Payment, VPNConfig, 
-    UsageStats, ReferralStats, ActionLog
+    UsageStats, ReferralStats, ActionLog, SubscriptionStatus, COMPLETED_PAYMENT_STATUSES
 )
+from .rollups import daily_metrics_rollup
 
 logger = logging.getLogger(__name__)
 
@@ -16,30 +19,51 @@ logger = logging.getLogger(__name__)
 class StatsService:
     """Service for collecting and analyzing statistics"""
     
-    async def get_dashboard_stats(self, session: AsyncSession) -> Dict[str, Any]:
-        """Get main dashboard statistics"""
+    def __init__(self, session_factory=None):
+        self.session_factory = session_factory or async_session_maker
+    
+    async def get_dashboard_stats(self, session: Optional[AsyncSession] = None) -> Dict[str, Any]:
+        """Get main dashboard statistics
+        
+        Each table is aggregated in a single query with conditional
+        aggregates. Given a session, the queries run one after another in
+        it (and its transaction); otherwise they run concurrently on
+        separate pooled connections.
+        """
         today = date.today()
         week_ago = today - timedelta(days=7)
         month_ago = today - timedelta(days=30)
         
-        stats = {}
-        
-        # User statistics
-        stats['users'] = await self._get_user_stats(session, today, week_ago, month_ago)
-        
-        # Subscription statistics
-        stats['subscriptions'] = await self._get_subscription_stats(session, today, week_ago, month_ago)
-        
-        # Payment statistics
-        stats['payments'] = await self._get_payment_stats(session, today, week_ago, month_ago)
-        
-        # VPN usage statistics
-        stats['vpn_usage'] = await self._get_vpn_usage_stats(session, today, week_ago, month_ago)
-        
-        # System statistics
-        stats['system'] = await self._get_system_stats(session)
+        queries = [
+            (self._get_user_stats, today, week_ago, month_ago),
+            (self._get_subscription_stats, today, week_ago, month_ago),
+            (self._get_payment_stats, today, week_ago, month_ago),
+            (self._get_vpn_config_stats, today),
+            (self._get_data_usage_stats, month_ago),
+            (self._get_system_stats,)
+        ]
+        if session is None:
+            results = await asyncio.gather(*(self._in_session(query, *args) for query, *args in queries))
+        else:
+            # An AsyncSession runs one statement at a time
+            results = [await query(session, *args) for query, *args in queries]
+        users, subscriptions, payments, vpn_configs, usage, system = results
+        
+        # Active users are counted over subscriptions
+        users['active_users'] = subscriptions.pop('active_users')
         
-        return stats
+        return {
+            'users': users,
+            'subscriptions': subscriptions,
+            'payments': payments,
+            'vpn_usage': {**vpn_configs, **usage},
+            'system': system
+        }
+    
+    async def _in_session(self, query, *args) -> Dict[str, Any]:
+        """Run a stats query on its own pooled connection"""
+        async with self.session_factory() as session:
+            return await query(session, *args)
     
     async def _get_user_stats(
         self, 
@@ -49,61 +73,23 @@ class StatsService:
         month_ago: date
     ) -> Dict[str, Any]:
         """Get user statistics"""
-        
-        # Total users
-        total_result = await session.execute(select(func.count(User.id)))
-        total_users = total_result.scalar()
-        
-        # Active users (have active subscription)
-        active_result = await session.execute(
-            select(func.count(User.id.distinct())).select_from(
-                User.__table__.join(Subscription.__table__)
-            ).where(
-                and_(
-                    Subscription.status == 'active',
-                    Subscription.end_date > datetime.utcnow()
-                )
-            )
-        )
-        active_users = active_result.scalar()
-        
-        # Blocked users
-        blocked_result = await session.execute(
-            select(func.count(User.id)).where(User.is_blocked == True)
-        )
-        blocked_users = blocked_result.scalar()
-        
-        # New users today
-        today_result = await session.execute(
-            select(func.count(User.id)).where(
-                func.date(User.created_at) == today
-            )
-        )
-        new_users_today = today_result.scalar()
-        
-        # New users this week
-        week_result = await session.execute(
-            select(func.count(User.id)).where(
-                User.created_at >= week_ago
-            )
-        )
-        new_users_week = week_result.scalar()
-        
-        # New users this month
-        month_result = await session.execute(
-            select(func.count(User.id)).where(
-                User.created_at >= month_ago
-            )
+        result = await session.execute(
+            select(
+                func.count().label('total_users'),
+                func.count().filter(User.status == 'blocked').label('blocked_users'),
+                func.count().filter(func.date(User.created_at) == today).label('new_users_today'),
+                func.count().filter(User.created_at >= week_ago).label('new_users_week'),
+                func.count().filter(User.created_at >= month_ago).label('new_users_month')
+            ).select_from(User)
         )
-        new_users_month = month_result.scalar()
+        row = result.one()
         
         return {
-            'total_users': total_users,
-            'active_users': active_users,
-            'blocked_users': blocked_users,
-            'new_users_today': new_users_today,
-            'new_users_week': new_users_week,
-            'new_users_month': new_users_month
+            'total_users': row.total_users,
+            'blocked_users': row.blocked_users,
+            'new_users_today': row.new_users_today,
+            'new_users_week': row.new_users_week,
+            'new_users_month': row.new_users_month
         }
     
     async def _get_subscription_stats(
@@ -114,57 +100,37 @@ class StatsService:
         month_ago: date
     ) -> Dict[str, Any]:
         """Get subscription statistics"""
-        
-        # Total subscriptions
-        total_result = await session.execute(select(func.count(Subscription.id)))
-        total_subscriptions = total_result.scalar()
-        
-        # Active subscriptions
-        active_result = await session.execute(
-            select(func.count(Subscription.id)).where(
-                and_(
-                    Subscription.status == 'active',
-                    Subscription.end_date > datetime.utcnow()
-                )
-            )
-        )
-        active_subscriptions = active_result.scalar()
-        
-        # Expired subscriptions
-        expired_result = await session.execute(
-            select(func.count(Subscription.id)).where(
-                or_(
-                    Subscription.status == 'expired',
-                    and_(
-                        Subscription.status == 'active',
-                        Subscription.end_date <= datetime.utcnow()
-                    )
-                )
-            )
+        now = datetime.utcnow()
+        is_active = and_(Subscription.status == 'active', Subscription.end_date > now)
+        is_expired = or_(
+            Subscription.status == 'expired',
+            and_(Subscription.status == 'active', Subscription.end_date <= now)
         )
-        expired_subscriptions = expired_result.scalar()
         
-        # Trial subscriptions
-        trial_result = await session.execute(
-            select(func.count(Subscription.id)).where(Subscription.is_trial == True)
-        )
-        trial_subscriptions = trial_result.scalar()
-        
-        # New subscriptions today
-        new_today_result = await session.execute(
-            select(func.count(Subscription.id)).where(
-                func.date(Subscription.created_at) == today
-            )
+        result = await session.execute(
+            select(
+                func.count().label('total_subscriptions'),
+                func.count().filter(is_active).label('active_subscriptions'),
+                func.count(Subscription.user_id.distinct()).filter(is_active).label('active_users'),
+                func.count().filter(is_expired).label('expired_subscriptions'),
+                func.count().filter(
+                    Subscription.status == SubscriptionStatus.TRIAL
+                ).label('trial_subscriptions'),
+                func.count().filter(
+                    func.date(Subscription.created_at) == today
+                ).label('new_subscriptions_today')
+            ).select_from(Subscription)
         )
-        new_subscriptions_today = new_today_result.scalar()
+        row = result.one()
         
         return {
-            'total_subscriptions': total_subscriptions,
-            'active_subscriptions': active_subscriptions,
-            'expired_subscriptions': expired_subscriptions,
-            'trial_subscriptions': trial_subscriptions,
-            'paid_subscriptions': total_subscriptions - trial_subscriptions,
-            'new_subscriptions_today': new_subscriptions_today
+            'total_subscriptions': row.total_subscriptions,
+            'active_subscriptions': row.active_subscriptions,
+            'active_users': row.active_users,
+            'expired_subscriptions': row.expired_subscriptions,
+            'trial_subscriptions': row.trial_subscriptions,
+            'paid_subscriptions': row.total_subscriptions - row.trial_subscriptions,
+            'new_subscriptions_today': row.new_subscriptions_today
         }
     
     async def _get_payment_stats(
@@ -175,132 +141,94 @@ class StatsService:
         month_ago: date
     ) -> Dict[str, Any]:
         """Get payment statistics"""
+        is_completed = Payment.status.in_(COMPLETED_PAYMENT_STATUSES)
         
-        # Total payments
-        total_result = await session.execute(select(func.count(Payment.id)))
-        total_payments = total_result.scalar()
-        
-        # Successful payments
-        successful_result = await session.execute(
-            select(func.count(Payment.id)).where(Payment.status == 'completed')
-        )
-        successful_payments = successful_result.scalar()
-        
-        # Failed payments
-        failed_result = await session.execute(
-            select(func.count(Payment.id)).where(Payment.status == 'failed')
-        )
-        failed_payments = failed_result.scalar()
-        
-        # Total revenue
-        total_revenue_result = await session.execute(
-            select(func.sum(Payment.amount)).where(Payment.status == 'completed')
-        )
-        total_revenue = total_revenue_result.scalar() or Decimal('0')
-        
-        # Revenue today
-        revenue_today_result = await session.execute(
-            select(func.sum(Payment.amount)).where(
-                and_(
-                    Payment.status == 'completed',
-                    func.date(Payment.created_at) == today
-                )
-            )
-        )
-        revenue_today = revenue_today_result.scalar() or Decimal('0')
-        
-        # Revenue this month
-        revenue_month_result = await session.execute(
-            select(func.sum(Payment.amount)).where(
-                and_(
-                    Payment.status == 'completed',
-                    Payment.created_at >= month_ago
-                )
-            )
+        result = await session.execute(
+            select(
+                func.count().label('total_payments'),
+                func.count().filter(is_completed).label('successful_payments'),
+                func.count().filter(Payment.status == 'failed').label('failed_payments'),
+                func.sum(Payment.amount).filter(is_completed).label('total_revenue'),
+                func.sum(Payment.amount).filter(
+                    and_(is_completed, func.date(Payment.created_at) == today)
+                ).label('revenue_today'),
+                func.sum(Payment.amount).filter(
+                    and_(is_completed, Payment.created_at >= month_ago)
+                ).label('revenue_month'),
+                func.avg(Payment.amount).filter(is_completed).label('average_payment')
+            ).select_from(Payment)
         )
-        revenue_month = revenue_month_result.scalar() or Decimal('0')
+        row = result.one()
         
-        # Average payment amount
-        avg_payment_result = await session.execute(
-            select(func.avg(Payment.amount)).where(Payment.status == 'completed')
-        )
-        avg_payment = avg_payment_result.scalar() or Decimal('0')
+        total_payments = row.total_payments
+        successful_payments = row.successful_payments
+        failed_payments = row.failed_payments
         
         return {
             'total_payments': total_payments,
             'successful_payments': successful_payments,
             'failed_payments': failed_payments,
             'pending_payments': total_payments - successful_payments - failed_payments,
-            'total_revenue': float(total_revenue),
-            'revenue_today': float(revenue_today),
-            'revenue_month': float(revenue_month),
-            'average_payment': float(avg_payment),
+            'total_revenue': float(row.total_revenue or Decimal('0')),
+            'revenue_today': float(row.revenue_today or Decimal('0')),
+            'revenue_month': float(row.revenue_month or Decimal('0')),
+            'average_payment': float(row.average_payment or Decimal('0')),
             'success_rate': (successful_payments / total_payments * 100) if total_payments > 0 else 0
         }
     
-    async def _get_vpn_usage_stats(
-        self, 
-        session: AsyncSession, 
-        today: date, 
-        week_ago: date, 
-        month_ago: date
-    ) -> Dict[str, Any]:
-        """Get VPN usage statistics"""
-        
-        # Active VPN configs
-        active_configs_result = await session.execute(
-            select(func.count(VPNConfig.id)).where(VPNConfig.is_active == True)
+    async def _get_vpn_config_stats(self, session: AsyncSession, today: date) -> Dict[str, Any]:
+        """Get VPN config statistics"""
+        result = await session.execute(
+            select(
+                func.count().filter(VPNConfig.is_active == True).label('active_vpn_configs'),
+                func.count().filter(
+                    func.date(VPNConfig.last_connected_at) == today
+                ).label('active_users_today')
+            ).select_from(VPNConfig)
         )
-        active_configs = active_configs_result.scalar()
+        row = result.one()
         
-        # Total data usage this month
-        data_usage_result = await session.execute(
+        return {
+            'active_vpn_configs': row.active_vpn_configs,
+            'active_users_today': row.active_users_today
+        }
+    
+    async def _get_data_usage_stats(self, session: AsyncSession, month_ago: date) -> Dict[str, Any]:
+        """Get VPN data usage statistics"""
+        result = await session.execute(
             select(
                 func.sum(UsageStats.bytes_uploaded + UsageStats.bytes_downloaded)
             ).where(
                 UsageStats.date >= month_ago.replace(day=1)
             )
         )
-        total_data_usage = data_usage_result.scalar() or 0
-        
-        # Active users today (who used VPN)
-        active_today_result = await session.execute(
-            select(func.count(VPNConfig.id.distinct())).where(
-                func.date(VPNConfig.last_used_at) == today
-            )
-        )
-        active_today = active_today_result.scalar()
+        total_data_usage = result.scalar() or 0
         
         return {
-            'active_vpn_configs': active_configs,
-            'total_data_usage_gb': round(total_data_usage / (1024**3), 2),
-            'active_users_today': active_today
+            'total_data_usage_gb': round(total_data_usage / (1024**3), 2)
         }
     
     async def _get_system_stats(self, session: AsyncSession) -> Dict[str, Any]:
         """Get system statistics"""
-        
-        # Database size (approximate)
-        db_size_result = await session.execute(
-            text("SELECT pg_database_size(current_database())")
-        )
-        db_size = db_size_result.scalar() or 0
-        
-        # Recent errors count
         week_ago = datetime.utcnow() - timedelta(days=7)
-        errors_result = await session.execute(
-            select(func.count(ActionLog.id)).where(
-                and_(
-                    ActionLog.action_type.like('%error%'),
-                    ActionLog.created_at >= week_ago
-                )
+        
+        # Database size (approximate) and recent errors count
+        result = await session.execute(
+            select(
+                func.pg_database_size(func.current_database()).label('db_size'),
+                select(func.count(ActionLog.id)).where(
+                    and_(
+                        ActionLog.action_type.like('%error%'),
+                        ActionLog.created_at >= week_ago
+                    )
+                ).scalar_subquery().label('recent_errors')
             )
         )
-        recent_errors = errors_result.scalar()
+        row = result.one()
         
         return {
-            'database_size_mb': round(db_size / (1024**2), 2),
-            'recent_errors': recent_errors
+            'database_size_mb': round((row.db_size or 0) / (1024**2), 2),
+            'recent_errors': row.recent_errors
         }
     
     async def get_user_growth_chart(
@@ -311,25 +239,15 @@ class StatsService:
         """Get user growth data for chart"""
         start_date = date.today() - timedelta(days=days)
         
-        result = await session.execute(
-            select(
-                func.date(User.created_at).label('date'),
-                func.count(User.id).label('count')
-            ).where(
-                User.created_at >= start_date
-            ).group_by(
-                func.date(User.created_at)
-            ).order_by('date')
-        )
-        
-        growth_data = []
-        for row in result:
-            growth_data.append({
-                'date': row.date.strftime('%Y-%m-%d'),
-                'count': row.count
-            })
+        metrics = await daily_metrics_rollup.get_daily_metrics(session, start_date)
         
-        return growth_data
+        return [
+            {
+                'date': metric.date.strftime('%Y-%m-%d'),
+                'count': metric.new_users
+            }
+            for metric in metrics
+        ]
     
     async def get_revenue_chart(
         self, 
@@ -339,28 +257,15 @@ class StatsService:
         """Get revenue data for chart"""
         start_date = date.today() - timedelta(days=days)
         
-        result = await session.execute(
-            select(
-                func.date(Payment.created_at).label('date'),
-                func.sum(Payment.amount).label('revenue')
-            ).where(
-                and_(
-                    Payment.status == 'completed',
-                    Payment.created_at >= start_date
-                )
-            ).group_by(
-                func.date(Payment.created_at)
-            ).order_by('date')
-        )
-        
-        revenue_data = []
-        for row in result:
-            revenue_data.append({
-                'date': row.date.strftime('%Y-%m-%d'),
-                'revenue': float(row.revenue or 0)
-            })
+        metrics = await daily_metrics_rollup.get_daily_metrics(session, start_date)
         
-        return revenue_data
+        return [
+            {
+                'date': metric.date.strftime('%Y-%m-%d'),
+                'revenue': float(metric.revenue or 0)
+            }
+            for metric in metrics
+        ]
     
     async def get_referral_stats(self, session: AsyncSession) -> Dict[str, Any]:
         """Get referral system statistics"""
@@ -453,7 +358,7 @@ class StatsService:
             },
             'subscription_count': len(subscriptions),
             'payment_count': len(payments),
-            'total_spent': sum(p.amount for p in payments if p.status == 'completed'),
+            'total_spent': sum(p.amount for p in payments if p.status in COMPLETED_PAYMENT_STATUSES),
             'total_data_usage_gb': round(total_data_usage / (1024**3), 2),
             'last_activity': max(
                 [s.created_at for s in subscriptions] + 
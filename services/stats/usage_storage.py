@@ -0,0 +1,238 @@
+import json
+import logging
+import re
+from typing import Dict, Optional, Any, Tuple
+from datetime import date, timedelta
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, and_, delete, text, union_all, cast, literal_column, Date
+from sqlalchemy.dialects.postgresql import insert
+
+from bot.config import settings
+from database.models import UsageStat as UsageStats, UsageStatMonthly, SystemSetting
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_KEY = 'usage_rollup_watermark'
+PARTITION_PREFIX = 'usage_stats_'
+PARTITION_NAME_RE = re.compile(rf'^{PARTITION_PREFIX}(\d{{4}})_(\d{{2}})$')
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITION_PREFIX}{month.year:04d}_{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[date]:
+    """First day of the month a partition covers, None for other tables"""
+    match = PARTITION_NAME_RE.match(name)
+    if not match:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def partition_ddl(month: date) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF usage_stats "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+class UsageStorage:
+    """Time-series storage of usage statistics.
+
+    Daily rows live in `usage_stats`, range-partitioned by month. Once a
+    month is older than `downsample_after_days` it is rolled up into
+    `usage_stats_monthly` and its partition is detached and dropped, which
+    is a metadata operation instead of a large DELETE. The watermark is the
+    first month still kept at daily resolution; readers take older months
+    from the monthly table.
+    """
+
+    def __init__(self, downsample_after_days: int = 90, monthly_keep_days: int = 730, months_ahead: int = 2):
+        self.downsample_after_days = downsample_after_days
+        self.monthly_keep_days = monthly_keep_days
+        self.months_ahead = months_ahead
+
+    async def maintain(self, session: AsyncSession, today: Optional[date] = None) -> Dict[str, Any]:
+        """Create upcoming partitions, downsample old months and drop their partitions"""
+        today = today or date.today()
+
+        created = await self.ensure_partitions(session, today)
+        watermark = await self.downsample(session, today)
+        dropped = await self.drop_downsampled_partitions(session, watermark)
+        expired = await self.expire_monthly(session, today)
+        await session.commit()
+
+        results = {
+            'partitions_created': created,
+            'partitions_dropped': dropped,
+            'monthly_rows_expired': expired,
+            'watermark': watermark.isoformat() if watermark else None
+        }
+        logger.info(f"Usage storage maintained: {results}")
+        return results
+
+    async def ensure_partitions(self, session: AsyncSession, today: Optional[date] = None) -> int:
+        """Create partitions from the current month up to `months_ahead`"""
+        current = month_start(today or date.today())
+        existing = set(await self._partitions(session))
+
+        created = 0
+        for offset in range(self.months_ahead + 1):
+            month = add_months(current, offset)
+            if month not in existing:
+                await session.execute(text(partition_ddl(month)))
+                created += 1
+        return created
+
+    async def downsample(self, session: AsyncSession, today: Optional[date] = None) -> Optional[date]:
+        """Roll daily rows of months past the retention boundary into monthly rows"""
+        boundary = month_start((today or date.today()) - timedelta(days=self.downsample_after_days))
+        watermark = await self.get_watermark(session)
+        if watermark is not None and watermark >= boundary:
+            return watermark
+
+        # Literal unit, so the SELECT and GROUP BY expressions are identical
+        month = cast(func.date_trunc(literal_column("'month'"), UsageStats.date), Date)
+        conditions = [UsageStats.date < boundary]
+        if watermark is not None:
+            conditions.append(UsageStats.date >= watermark)
+
+        stmt = insert(UsageStatMonthly).from_select(
+            ['user_id', 'month', 'bytes_uploaded', 'bytes_downloaded', 'connections_count', 'days_active'],
+            select(
+                UsageStats.user_id,
+                month,
+                func.coalesce(func.sum(UsageStats.bytes_uploaded), 0),
+                func.coalesce(func.sum(UsageStats.bytes_downloaded), 0),
+                func.coalesce(func.sum(UsageStats.connections_count), 0),
+                func.count()
+            ).where(and_(*conditions)).group_by(UsageStats.user_id, month)
+        )
+        # Rerunning a month after a failed drop rewrites the same totals
+        result = await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[UsageStatMonthly.user_id, UsageStatMonthly.month],
+                set_={
+                    'bytes_uploaded': stmt.excluded.bytes_uploaded,
+                    'bytes_downloaded': stmt.excluded.bytes_downloaded,
+                    'connections_count': stmt.excluded.connections_count,
+                    'days_active': stmt.excluded.days_active
+                }
+            )
+        )
+        logger.info(f"Downsampled {result.rowcount} monthly usage rows before {boundary}")
+
+        await self._set_watermark(session, boundary)
+        return boundary
+
+    async def drop_downsampled_partitions(self, session: AsyncSession, watermark: Optional[date]) -> int:
+        """Detach and drop daily partitions that lie entirely before the watermark"""
+        if watermark is None:
+            return 0
+
+        dropped = 0
+        for month, name in sorted((await self._partitions(session)).items()):
+            if add_months(month, 1) > watermark:
+                continue
+            await session.execute(text(f"ALTER TABLE usage_stats DETACH PARTITION {name}"))
+            await session.execute(text(f"DROP TABLE {name}"))
+            logger.info(f"Dropped usage partition {name}")
+            dropped += 1
+        return dropped
+
+    async def expire_monthly(self, session: AsyncSession, today: Optional[date] = None) -> int:
+        """Delete monthly rows older than the monthly retention"""
+        cutoff = month_start((today or date.today()) - timedelta(days=self.monthly_keep_days))
+        result = await session.execute(
+            delete(UsageStatMonthly).where(UsageStatMonthly.month < cutoff)
+        )
+        return result.rowcount
+
+    async def usage_rows(self, session: AsyncSession, start_date: date) -> Tuple[str, Any]:
+        """Usage since `start_date` at the finest resolution still stored.
+
+        Returns (resolution, subquery) where resolution is 'day' or 'month'
+        and the subquery has user_id, period, bytes_uploaded,
+        bytes_downloaded and connections_count columns. Monthly periods
+        cover whole months, so a range starting mid-month includes that
+        month entirely.
+        """
+        watermark = await self.get_watermark(session)
+
+        daily_columns = [
+            UsageStats.bytes_uploaded.label('bytes_uploaded'),
+            UsageStats.bytes_downloaded.label('bytes_downloaded'),
+            UsageStats.connections_count.label('connections_count')
+        ]
+        if watermark is None or start_date >= watermark:
+            query = select(
+                UsageStats.user_id, UsageStats.date.label('period'), *daily_columns
+            ).where(UsageStats.date >= start_date)
+            return 'day', query.subquery()
+
+        query = union_all(
+            select(
+                UsageStatMonthly.user_id,
+                UsageStatMonthly.month.label('period'),
+                UsageStatMonthly.bytes_uploaded,
+                UsageStatMonthly.bytes_downloaded,
+                UsageStatMonthly.connections_count
+            ).where(
+                and_(UsageStatMonthly.month >= month_start(start_date), UsageStatMonthly.month < watermark)
+            ),
+            select(
+                UsageStats.user_id,
+                cast(func.date_trunc('month', UsageStats.date), Date).label('period'),
+                *daily_columns
+            ).where(UsageStats.date >= watermark)
+        )
+        return 'month', query.subquery()
+
+    async def get_watermark(self, session: AsyncSession) -> Optional[date]:
+        setting = await session.get(SystemSetting, WATERMARK_KEY)
+        if not setting:
+            return None
+        return date.fromisoformat(json.loads(setting.value))
+
+    async def _set_watermark(self, session: AsyncSession, watermark: date):
+        await session.execute(
+            insert(SystemSetting).values(
+                key=WATERMARK_KEY,
+                value=json.dumps(watermark.isoformat()),
+                description="First month of usage stats kept at daily resolution"
+            ).on_conflict_do_update(
+                index_elements=[SystemSetting.key],
+                set_={'value': json.dumps(watermark.isoformat()), 'updated_at': func.now()}
+            )
+        )
+
+    async def _partitions(self, session: AsyncSession) -> Dict[date, str]:
+        """Monthly partitions currently attached to usage_stats"""
+        result = await session.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = 'usage_stats'::regclass"
+            )
+        )
+        partitions = {}
+        for (name,) in result:
+            month = partition_month(name)
+            if month is not None:
+                partitions[month] = name
+        return partitions
+
+
+usage_storage = UsageStorage(
+    downsample_after_days=settings.usage_downsample_after_days,
+    monthly_keep_days=settings.usage_monthly_keep_days
+)
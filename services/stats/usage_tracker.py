@@ -1,156 +1,147 @@
 import logging
-import asyncio
-from typing import Dict, List, Optional, Any
-from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional, Any, Tuple
+from datetime import date, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, insert, and_, text, func
+from sqlalchemy import select, and_, func
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 
-from database.models import UsageStat as UsageStats, VPNConfig, User
-from services.marzban.client import MarzbanClient
+from database.models import UsageStat as UsageStats, UsageSnapshot, VPNConfig, User
+from services.marzban.models import MarzbanUser
+from services.marzban.reconciler import MarzbanReconciler, marzban_reconciler
+from .usage_storage import UsageStorage, usage_storage
 
 logger = logging.getLogger(__name__)
 
 
+def compute_usage_deltas(
+    snapshot: List[Any],
+    users_map: Dict[str, MarzbanUser]
+) -> Tuple[List[Dict[str, Any]], Dict[int, int]]:
+    """Traffic used since the previous snapshot, per user.
+
+    Each snapshot row must expose user_id, marzban_user_id and the previous
+    used_traffic / lifetime_used_traffic (None for users seen the first time).
+    Returns (new snapshots, {user_id: bytes used in the interval}).
+
+    Marzban counters are cumulative; `used_traffic` drops back to zero when
+    the user's usage is reset, `lifetime_used_traffic` (newer panels) never
+    does. A counter lower than the previous snapshot means a reset, and all
+    of the current value was used since then. The first snapshot of a user
+    only establishes the baseline.
+    """
+    snapshots: Dict[int, Dict[str, Any]] = {}
+    deltas: Dict[int, int] = {}
+
+    for row in snapshot:
+        marzban_user = users_map.get(row.marzban_user_id)
+        if not marzban_user or row.user_id in snapshots:
+            continue
+
+        used = marzban_user.used_traffic or 0
+        lifetime = marzban_user.lifetime_used_traffic or 0
+        snapshots[row.user_id] = {
+            'user_id': row.user_id,
+            'used_traffic': used,
+            'lifetime_used_traffic': lifetime
+        }
+
+        if row.used_traffic is None:
+            continue
+
+        previous_lifetime = row.lifetime_used_traffic or 0
+        if lifetime and previous_lifetime and lifetime >= previous_lifetime:
+            delta = lifetime - previous_lifetime
+        elif used >= row.used_traffic:
+            delta = used - row.used_traffic
+        else:
+            delta = used
+
+        if delta > 0:
+            deltas[row.user_id] = delta
+
+    return list(snapshots.values()), deltas
+
+
 class UsageTracker:
     """Service for tracking VPN usage statistics"""
     
-    def __init__(self):
-        self.marzban_client = MarzbanClient()
-    
-    async def update_user_usage(
-        self, 
-        session: AsyncSession,
-        user_id: int,
-        date: date = None
-    ) -> bool:
-        """Update usage statistics for a specific user"""
-        try:
-            if date is None:
-                date = date.today()
-            
-            # Get user's VPN config
-            vpn_config_result = await session.execute(
-                select(VPNConfig).where(
-                    and_(
-                        VPNConfig.user_id == user_id,
-                        VPNConfig.is_active == True
-                    )
-                )
-            )
-            vpn_config = vpn_config_result.scalar_one_or_none()
-            
-            if not vpn_config or not vpn_config.marzban_user_id:
-                logger.debug(f"No active VPN config for user {user_id}")
-                return False
-            
-            # Get usage data from Marzban
-            async with self.marzban_client as client:
-                usage_data = await client.get_user_usage(vpn_config.marzban_user_id)
-            
-            if not usage_data:
-                logger.warning(f"No usage data from Marzban for user {user_id}")
-                return False
-            
-            # Update or create usage statistics
-            await self._upsert_usage_stats(
-                session=session,
-                user_id=user_id,
-                date=date,
-                usage_data=usage_data
-            )
-            
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error updating usage for user {user_id}: {e}")
-            return False
+    def __init__(
+        self,
+        reconciler: Optional[MarzbanReconciler] = None,
+        storage: Optional[UsageStorage] = None,
+        chunk_size: int = 1000
+    ):
+        self.reconciler = reconciler or marzban_reconciler
+        self.storage = storage or usage_storage
+        self.chunk_size = chunk_size
     
-    async def update_all_users_usage(
-        self, 
+    async def ingest_usage(
+        self,
         session: AsyncSession,
-        batch_size: int = 50
+        users_map: Optional[Dict[str, MarzbanUser]] = None,
+        day: Optional[date] = None
     ) -> Dict[str, int]:
-        """Update usage statistics for all active users"""
-        results = {'success': 0, 'failed': 0}
+        """Add traffic used since the last run to today's usage statistics.
         
-        try:
-            # Get all users with active VPN configs
-            active_users_result = await session.execute(
-                select(VPNConfig.user_id).where(VPNConfig.is_active == True)
+        Cumulative counters come from one paged /api/users scan; snapshots and
+        usage rows are written with multi-row upserts in the caller's
+        transaction, so a failed run leaves both untouched.
+        """
+        day = day or date.today()
+        
+        result = await session.execute(
+            select(
+                VPNConfig.user_id,
+                VPNConfig.marzban_user_id,
+                UsageSnapshot.used_traffic,
+                UsageSnapshot.lifetime_used_traffic
             )
-            active_user_ids = [row[0] for row in active_users_result]
-            
-            # Process users in batches
-            for i in range(0, len(active_user_ids), batch_size):
-                batch = active_user_ids[i:i + batch_size]
-                tasks = []
-                
-                for user_id in batch:
-                    task = self.update_user_usage(session, user_id)
-                    tasks.append(task)
-                
-                # Execute batch
-                batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-                
-                for result in batch_results:
-                    if isinstance(result, Exception):
-                        results['failed'] += 1
-                    elif result:
-                        results['success'] += 1
-                    else:
-                        results['failed'] += 1
-                
-                # Small delay between batches
-                await asyncio.sleep(0.1)
-            
-            await session.commit()
-            logger.info(f"Usage update results: {results}")
-            
-        except Exception as e:
-            logger.error(f"Error in bulk usage update: {e}")
-            await session.rollback()
+            .outerjoin(UsageSnapshot, UsageSnapshot.user_id == VPNConfig.user_id)
+            .where(VPNConfig.marzban_user_id.isnot(None))
+            # Active configs first: they own the snapshot of users with several
+            .order_by(VPNConfig.user_id, VPNConfig.is_active.desc())
+        )
+        snapshot = result.all()
         
-        return results
-    
-    async def _upsert_usage_stats(
-        self,
-        session: AsyncSession,
-        user_id: int,
-        date: date,
-        usage_data: Dict[str, Any]
-    ):
-        """Insert or update usage statistics"""
-        try:
-            # Prepare data
-            usage_record = {
-                'user_id': user_id,
-                'date': date,
-                'bytes_uploaded': usage_data.get('uploaded', 0),
-                'bytes_downloaded': usage_data.get('downloaded', 0),
-                'connections_count': usage_data.get('connections', 0),
-                'unique_ips': usage_data.get('unique_ips', []),
-                'created_at': datetime.utcnow()
-            }
-            
-            # Use PostgreSQL UPSERT
-            stmt = pg_insert(UsageStats.__table__).values(**usage_record)
-            stmt = stmt.on_conflict_do_update(
-                index_elements=['user_id', 'date'],
-                set_=dict(
-                    bytes_uploaded=stmt.excluded.bytes_uploaded,
-                    bytes_downloaded=stmt.excluded.bytes_downloaded,
-                    connections_count=stmt.excluded.connections_count,
-                    unique_ips=stmt.excluded.unique_ips,
-                    created_at=datetime.utcnow()
+        if users_map is None:
+            users_map = await self.reconciler.fetch_users_map()
+        
+        snapshots, deltas = compute_usage_deltas(snapshot, users_map)
+        
+        for i in range(0, len(snapshots), self.chunk_size):
+            stmt = pg_insert(UsageSnapshot).values(snapshots[i:i + self.chunk_size])
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[UsageSnapshot.user_id],
+                    set_={
+                        'used_traffic': stmt.excluded.used_traffic,
+                        'lifetime_used_traffic': stmt.excluded.lifetime_used_traffic,
+                        'captured_at': func.now()
+                    }
                 )
             )
-            
-            await session.execute(stmt)
-            
-        except Exception as e:
-            logger.error(f"Error upserting usage stats for user {user_id}: {e}")
-            raise
+        
+        # Marzban doesn't separate upload and download, totals go to bytes_uploaded
+        usage_rows = [
+            {'user_id': user_id, 'date': day, 'bytes_uploaded': delta, 'bytes_downloaded': 0}
+            for user_id, delta in deltas.items()
+        ]
+        for i in range(0, len(usage_rows), self.chunk_size):
+            stmt = pg_insert(UsageStats).values(usage_rows[i:i + self.chunk_size])
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[UsageStats.user_id, UsageStats.date],
+                    set_={'bytes_uploaded': UsageStats.bytes_uploaded + stmt.excluded.bytes_uploaded}
+                )
+            )
+        
+        results = {
+            'users': len(snapshots),
+            'with_traffic': len(deltas),
+            'bytes': sum(deltas.values())
+        }
+        logger.info(f"Usage ingested for {day}: {results}")
+        return results
     
     async def get_user_usage_summary(
         self,
@@ -212,29 +203,36 @@ class UsageTracker:
         user_id: int,
         days: int = 30
     ) -> List[Dict[str, Any]]:
-        """Get usage data for chart visualization"""
+        """Get usage data for chart visualization.
+        
+        Points are daily while the range is kept at daily resolution and
+        monthly once it reaches into downsampled months.
+        """
         try:
             start_date = date.today() - timedelta(days=days)
+            _, usage = await self.storage.usage_rows(session, start_date)
             
             result = await session.execute(
-                select(UsageStats).where(
-                    and_(
-                        UsageStats.user_id == user_id,
-                        UsageStats.date >= start_date
-                    )
-                ).order_by(UsageStats.date)
+                select(
+                    usage.c.period,
+                    func.coalesce(func.sum(usage.c.bytes_uploaded), 0).label('bytes_uploaded'),
+                    func.coalesce(func.sum(usage.c.bytes_downloaded), 0).label('bytes_downloaded'),
+                    func.coalesce(func.sum(usage.c.connections_count), 0).label('connections_count')
+                ).where(
+                    usage.c.user_id == user_id
+                ).group_by(
+                    usage.c.period
+                ).order_by(usage.c.period)
             )
             
-            usage_records = result.scalars().all()
-            
             chart_data = []
-            for record in usage_records:
+            for record in result:
                 chart_data.append({
-                    'date': record.date.strftime('%Y-%m-%d'),
-                    'uploaded_gb': round((record.bytes_uploaded or 0) / (1024**3), 2),
-                    'downloaded_gb': round((record.bytes_downloaded or 0) / (1024**3), 2),
-                    'total_gb': round(((record.bytes_uploaded or 0) + (record.bytes_downloaded or 0)) / (1024**3), 2),
-                    'connections': record.connections_count or 0
+                    'date': record.period.strftime('%Y-%m-%d'),
+                    'uploaded_gb': round(record.bytes_uploaded / (1024**3), 2),
+                    'downloaded_gb': round(record.bytes_downloaded / (1024**3), 2),
+                    'total_gb': round((record.bytes_uploaded + record.bytes_downloaded) / (1024**3), 2),
+                    'connections': record.connections_count
                 })
             
             return chart_data
@@ -252,71 +250,52 @@ class UsageTracker:
         """Get top users by data usage"""
         try:
             start_date = date.today() - timedelta(days=days)
+            _, usage = await self.storage.usage_rows(session, start_date)
             
+            total_usage = func.sum(
+                func.coalesce(usage.c.bytes_uploaded, 0) + func.coalesce(usage.c.bytes_downloaded, 0)
+            ).label('total_usage')
             result = await session.execute(
                 select(
-                    UsageStats.user_id,
-                    func.sum(UsageStats.bytes_uploaded + UsageStats.bytes_downloaded).label('total_usage')
-                ).where(
-                    UsageStats.date >= start_date
+                    usage.c.user_id,
+                    User.username,
+                    User.telegram_id,
+                    total_usage
+                ).join(
+                    User, User.id == usage.c.user_id
                 ).group_by(
-                    UsageStats.user_id
+                    usage.c.user_id, User.username, User.telegram_id
                 ).order_by(
-                    text('total_usage DESC')
+                    total_usage.desc()
                 ).limit(limit)
             )
             
-            usage_data = result.all()
-            
-            # Get user information
-            top_users = []
-            for row in usage_data:
-                user_result = await session.execute(
-                    select(User).where(User.id == row.user_id)
-                )
-                user = user_result.scalar_one_or_none()
-                
-                if user:
-                    top_users.append({
-                        'user_id': row.user_id,
-                        'username': user.username or f'User_{user.telegram_id}',
-                        'total_usage_gb': round(row.total_usage / (1024**3), 2)
-                    })
-            
-            return top_users
+            return [
+                {
+                    'user_id': row.user_id,
+                    'username': row.username or f'User_{row.telegram_id}',
+                    'total_usage_gb': round((row.total_usage or 0) / (1024**3), 2)
+                }
+                for row in result
+            ]
             
         except Exception as e:
             logger.error(f"Error getting top users by usage: {e}")
             return []
     
-    async def cleanup_old_usage_data(
-        self,
-        session: AsyncSession,
-        keep_days: int = 365
-    ) -> int:
-        """Clean up old usage data"""
+    async def cleanup_old_usage_data(self, session: AsyncSession) -> Dict[str, Any]:
+        """Drop daily partitions that were downsampled and expire monthly rows.
+        
+        Retention never deletes rows from live partitions: whole monthly
+        partitions are detached and dropped once rolled up.
+        """
         try:
-            cutoff_date = date.today() - timedelta(days=keep_days)
-            
-            result = await session.execute(
-                select(func.count(UsageStats.id)).where(
-                    UsageStats.date < cutoff_date
-                )
-            )
-            records_to_delete = result.scalar()
-            
-            if records_to_delete > 0:
-                await session.execute(
-                    UsageStats.__table__.delete().where(
-                        UsageStats.date < cutoff_date
-                    )
-                )
-                await session.commit()
-                logger.info(f"Cleaned up {records_to_delete} old usage records")
-            
-            return records_to_delete
+            return await self.storage.maintain(session)
             
         except Exception as e:
             logger.error(f"Error cleaning up old usage data: {e}")
             await session.rollback()
-            return 0
\ No newline at end of file
+            return {}
+
+
+usage_tracker = UsageTracker()
@@ -1,13 +1,15 @@
 from celery import shared_task
 from database.connection import async_session_maker
+from tasks.runtime import run_async
 from database.models import ActionLog, Payment, BroadcastMessage
-from sqlalchemy import select, delete, and_
 from datetime import datetime, timedelta
 from bot.config import settings
+from database.purge import PurgeTarget, chunked_purger
+from services.backup import database_backup
+from services.export import user_data_exporter
+from services.stats import usage_tracker
 import logging
-import subprocess
 import os
-import asyncio
 
 logger = logging.getLogger(__name__)
 
@@ -15,151 +17,67 @@ logger = logging.getLogger(__name__)
 @shared_task(bind=True)
 def backup_database(self):
     """Create database backup"""
-    return asyncio.run(_backup_database())
+    return run_async(_backup_database())
 
 
 async def _backup_database():
     """Async implementation of database backup"""
     try:
-        # Parse database URL
-        db_url = settings.database_url
-        # Remove asyncpg prefix for pg_dump
-        if db_url.startswith("postgresql+asyncpg://"):
-            db_url = db_url.replace("postgresql+asyncpg://", "postgresql://")
-        
-        # Create backup filename with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"vpn_bot_backup_{timestamp}.sql"
-        backup_path = f"/app/backups/{backup_filename}"
-        
-        # Create backups directory if it doesn't exist
-        os.makedirs("/app/backups", exist_ok=True)
-        
-        # Run pg_dump
-        cmd = [
-            "pg_dump",
-            db_url,
-            "--no-password",
-            "--verbose",
-            "--file", backup_path
-        ]
-        
-        process = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=600  # 10 minutes timeout
-        )
-        
-        if process.returncode == 0:
-            # Get file size
-            file_size = os.path.getsize(backup_path)
-            logger.info(f"Database backup created: {backup_filename} ({file_size} bytes)")
+        async with async_session_maker() as session:
+            record = await database_backup.create(session)
             
-            # Cleanup old backups (keep last 30)
-            await _cleanup_old_backups("/app/backups", 30)
+            if record.status == "success":
+                await _cleanup_old_backups(session, settings.backup_keep_count)
             
-            return {
-                "status": "success",
-                "filename": backup_filename,
-                "size": file_size
-            }
-        else:
-            logger.error(f"Database backup failed: {process.stderr}")
-            return {
-                "status": "failed",
-                "error": process.stderr
-            }
-    
-    except subprocess.TimeoutExpired:
-        logger.error("Database backup timed out")
-        return {"status": "failed", "error": "Timeout"}
+            return database_backup.describe(record)
     
     except Exception as e:
         logger.error(f"Error in backup_database: {e}")
         return {"status": "failed", "error": str(e)}
 
 
-async def _cleanup_old_backups(backup_dir: str, keep_count: int):
-    """Clean up old backup files"""
+async def _cleanup_old_backups(session, keep_count: int):
+    """Remove backups beyond the newest `keep_count` successful ones"""
     try:
-        if not os.path.exists(backup_dir):
-            return
-        
-        # Get all backup files
-        backup_files = []
-        for filename in os.listdir(backup_dir):
-            if filename.startswith("vpn_bot_backup_") and filename.endswith(".sql"):
-                filepath = os.path.join(backup_dir, filename)
-                mtime = os.path.getmtime(filepath)
-                backup_files.append((filepath, mtime))
-        
-        # Sort by modification time (newest first)
-        backup_files.sort(key=lambda x: x[1], reverse=True)
-        
-        # Remove old backups
-        files_to_remove = backup_files[keep_count:]
-        for filepath, _ in files_to_remove:
-            try:
-                os.remove(filepath)
-                logger.info(f"Removed old backup: {os.path.basename(filepath)}")
-            except Exception as e:
-                logger.error(f"Error removing backup {filepath}: {e}")
+        return await database_backup.apply_retention(session, keep_count)
     
     except Exception as e:
         logger.error(f"Error cleaning up backups: {e}")
+        return []
 
 
 @shared_task(bind=True)
 def cleanup_expired_data(self):
     """Clean up expired data from database"""
-    return asyncio.run(_cleanup_expired_data())
+    return run_async(_cleanup_expired_data())
 
 
 async def _cleanup_expired_data():
     """Async implementation of data cleanup"""
     try:
+        now = datetime.now()
+        targets = [
+            # Action logs older than 30 days
+            PurgeTarget(ActionLog, ActionLog.created_at, now - timedelta(days=30)),
+            # Failed payments older than 90 days
+            PurgeTarget(
+                Payment, Payment.created_at, now - timedelta(days=90),
+                conditions=(Payment.status.in_(["failed", "cancelled"]),)
+            ),
+            # Broadcast messages older than 60 days
+            PurgeTarget(BroadcastMessage, BroadcastMessage.created_at, now - timedelta(days=60)),
+        ]
+        
         async with async_session_maker() as session:
-            now = datetime.now()
-            cleanup_stats = {
-                "action_logs": 0,
-                "old_payments": 0,
-                "broadcast_messages": 0
-            }
-            
-            # Clean up action logs older than 30 days
-            thirty_days_ago = now - timedelta(days=30)
-            result = await session.execute(
-                delete(ActionLog)
-                .where(ActionLog.created_at < thirty_days_ago)
-            )
-            cleanup_stats["action_logs"] = result.rowcount
-            
-            # Clean up old failed payments (older than 90 days)
-            ninety_days_ago = now - timedelta(days=90)
-            result = await session.execute(
-                delete(Payment)
-                .where(
-                    and_(
-                        Payment.status.in_(["failed", "cancelled"]),
-                        Payment.created_at < ninety_days_ago
-                    )
-                )
-            )
-            cleanup_stats["old_payments"] = result.rowcount
-            
-            # Clean up old broadcast messages (older than 60 days)
-            sixty_days_ago = now - timedelta(days=60)
-            result = await session.execute(
-                delete(BroadcastMessage)
-                .where(BroadcastMessage.created_at < sixty_days_ago)
-            )
-            cleanup_stats["broadcast_messages"] = result.rowcount
-            
-            await session.commit()
+            results = await chunked_purger.purge_all(session, targets)
+            cleanup_stats = {table: result["rows"] for table, result in results.items()}
             
-            logger.info(f"Data cleanup completed: {cleanup_stats}")
-            return cleanup_stats
+            # Usage stats are dropped by partition once downsampled
+            usage = await usage_tracker.cleanup_old_usage_data(session)
+            cleanup_stats["usage_stats_partitions"] = usage.get("partitions_dropped", 0)
+        
+        logger.info(f"Data cleanup completed: {cleanup_stats}")
+        return cleanup_stats
     
     except Exception as e:
         logger.error(f"Error in cleanup_expired_data: {e}")
@@ -168,92 +86,21 @@ async def _cleanup_expired_data():
 
 @shared_task(bind=True)
 def export_user_data(self, format: str = "csv"):
-    """Export user data for admin"""
-    return asyncio.run(_export_user_data(format))
+    """Export user data for admin (csv, csv.gz or parquet)"""
+    # self.request is thread-local, progress is reported from another thread
+    task_id = self.request.id
+    
+    def report_progress(records: int):
+        self.update_state(task_id=task_id, state="PROGRESS", meta={"records": records})
+    
+    return run_async(_export_user_data(format, report_progress))
 
 
-async def _export_user_data(format: str):
+async def _export_user_data(format: str, progress=None):
     """Async implementation of user data export"""
     try:
-        async with async_session_maker() as session:
-            from database.models import User, Subscription, VPNConfig
-            
-            # Get all users with their latest subscription
-            result = await session.execute(
-                select(User, Subscription, VPNConfig)
-                .outerjoin(
-                    Subscription,
-                    and_(
-                        User.id == Subscription.user_id,
-                        Subscription.id == (
-                            select(Subscription.id)
-                            .where(Subscription.user_id == User.id)
-                            .order_by(Subscription.created_at.desc())
-                            .limit(1)
-                            .scalar_subquery()
-                        )
-                    )
-                )
-                .outerjoin(VPNConfig, User.id == VPNConfig.user_id)
-            )
-            
-            users_data = result.all()
-            
-            if format.lower() == "csv":
-                import csv
-                import io
-                
-                output = io.StringIO()
-                writer = csv.writer(output)
-                
-                # Headers
-                writer.writerow([
-                    "telegram_id", "username", "first_name", "last_name",
-                    "registration_date", "is_blocked", "subscription_status",
-                    "subscription_end", "has_vpn_config", "last_used"
-                ])
-                
-                # Data
-                for user, subscription, vpn_config in users_data:
-                    writer.writerow([
-                        user.telegram_id,
-                        user.username or "",
-                        user.first_name or "",
-                        user.last_name or "",
-                        user.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-                        "Yes" if user.is_blocked else "No",
-                        subscription.status if subscription else "None",
-                        subscription.end_date.strftime("%Y-%m-%d") if subscription and subscription.end_date else "",
-                        "Yes" if vpn_config and vpn_config.is_active else "No",
-                        vpn_config.last_used_at.strftime("%Y-%m-%d %H:%M:%S") if vpn_config and vpn_config.last_used_at else ""
-                    ])
-                
-                # Save to file
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"users_export_{timestamp}.csv"
-                filepath = f"/app/exports/{filename}"
-                
-                os.makedirs("/app/exports", exist_ok=True)
-                
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    f.write(output.getvalue())
-                
-                file_size = os.path.getsize(filepath)
-                
-                logger.info(f"User data exported: {filename} ({len(users_data)} records, {file_size} bytes)")
-                
-                return {
-                    "status": "success",
-                    "filename": filename,
-                    "records": len(users_data),
-                    "size": file_size
-                }
-            
-            else:
-                return {
-                    "status": "failed",
-                    "error": f"Unsupported format: {format}"
-                }
+        result = await user_data_exporter.export_to_file(format, progress=progress)
+        return {"status": "success", **result}
     
     except Exception as e:
         logger.error(f"Error exporting user data: {e}")
@@ -1,6 +1,11 @@
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import (
+    worker_init, worker_process_init, worker_process_shutdown, worker_shutdown,
+    before_task_publish, task_prerun, task_postrun
+)
 from bot.config import settings
+from services.monitoring import instrumentation
 import logging
 
 logger = logging.getLogger(__name__)
@@ -53,16 +58,34 @@ app.conf.beat_schedule = {
         'schedule': crontab(minute=30),  # Every hour at 30 minutes
     },
     
+    # Consume queued payment webhooks; each run lasts just under a minute
+    'consume-payment-webhooks': {
+        'task': 'tasks.payments.consume_payment_webhooks',
+        'schedule': 60.0,
+    },
+    
+    # Reconcile stale pending payments with providers every 15 minutes
+    'cleanup-pending-payments': {
+        'task': 'tasks.payments.cleanup_pending_payments',
+        'schedule': crontab(minute='*/15'),  # Every 15 minutes
+    },
+    
     # Process failed payments every 6 hours
     'retry-failed-payments': {
         'task': 'tasks.payments.retry_failed_payments',
         'schedule': crontab(minute=0, hour='*/6'),  # Every 6 hours
     },
     
-    # Collect usage stats daily at 3 AM
+    # Ingest usage deltas every 30 minutes, so traffic lands on the right day
     'collect-daily-stats': {
         'task': 'tasks.stats.collect_daily_stats',
-        'schedule': crontab(minute=0, hour=3),  # Daily at 3 AM
+        'schedule': crontab(minute='5,35'),  # Every 30 minutes
+    },
+    
+    # Usage partitions, downsampling and retention daily
+    'maintain-usage-storage': {
+        'task': 'tasks.stats.maintain_usage_storage',
+        'schedule': crontab(minute=15, hour=3),  # Daily at 3:15 AM
     },
     
     # Cleanup expired Marzban users weekly
@@ -83,6 +106,12 @@ app.conf.beat_schedule = {
         'schedule': crontab(minute=0, hour=2, day_of_week=0),  # Weekly on Sunday at 2 AM
     },
     
+    # Refresh daily metrics rollups every 15 minutes
+    'refresh-daily-metrics': {
+        'task': 'tasks.stats.refresh_daily_metrics',
+        'schedule': crontab(minute='*/15'),  # Every 15 minutes
+    },
+    
     # Update VPN usage stats every 30 minutes
     'sync-vpn-usage': {
         'task': 'tasks.stats.sync_vpn_usage',
@@ -111,5 +140,40 @@ app.autodiscover_tasks([
     'tasks.marzban_sync'
 ])
 
+
+
+# Async runtime: one event loop per worker process, shared by all tasks
+@worker_process_init.connect
+def init_worker_runtime(**kwargs):
+    from tasks.runtime import start_runtime
+    start_runtime()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def shutdown_worker_runtime(**kwargs):
+    from tasks.runtime import shutdown_runtime
+    shutdown_runtime()
+
+
+# Prometheus metrics: served by the main worker process, recorded by the pool
+# processes (PROMETHEUS_MULTIPROC_DIR lets the server aggregate them)
+@worker_init.connect
+def start_worker_metrics(**kwargs):
+    from services.monitoring import start_metrics_server
+    start_metrics_server(settings.celery_metrics_port)
+
+
+@worker_process_shutdown.connect
+def mark_worker_process_dead(**kwargs):
+    from services.monitoring import mark_process_dead
+    mark_process_dead()
+
+
+before_task_publish.connect(instrumentation.on_before_task_publish, weak=False)
+task_prerun.connect(instrumentation.on_task_prerun, weak=False)
+task_postrun.connect(instrumentation.on_task_postrun, weak=False)
+
+
 if __name__ == '__main__':
     app.start()
\ No newline at end of file
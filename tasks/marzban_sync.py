@@ -1,11 +1,12 @@
 from celery import shared_task
 from database.connection import async_session_maker
+from tasks.runtime import run_async
 from database.models import User, Subscription, VPNConfig, SubscriptionStatus
-from services.marzban import marzban_client, UserStatus
+from services.marzban import marzban_client, marzban_reconciler
+from services.cache import user_context_cache
 from sqlalchemy import select, and_
 from datetime import datetime, timezone, timedelta
 import logging
-import asyncio
 
 logger = logging.getLogger(__name__)
 
@@ -13,86 +14,26 @@ logger = logging.getLogger(__name__)
 @shared_task(bind=True)
 def sync_subscriptions_from_marzban(self):
     """Sync subscription data from Marzban server"""
-    return asyncio.run(_sync_subscriptions_from_marzban())
+    return run_async(_sync_subscriptions_from_marzban())
 
 
 async def _sync_subscriptions_from_marzban():
     """Sync subscription expiration dates and status from Marzban"""
     try:
         async with async_session_maker() as session:
-            # Get all VPN configs with active/trial subscriptions
-            result = await session.execute(
-                select(VPNConfig, User, Subscription)
-                .join(User, VPNConfig.user_id == User.id)
-                .join(Subscription, User.id == Subscription.user_id)
-                .where(
-                    and_(
-                        VPNConfig.is_active == True,
-                        VPNConfig.marzban_user_id.isnot(None),
-                        Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL])
-                    )
-                )
-            )
-            
-            configs_to_sync = result.all()
-            synced_count = 0
-            errors_count = 0
-            
-            async with marzban_client as client:
-                for vpn_config, user, subscription in configs_to_sync:
-                    try:
-                        # Get user data from Marzban
-                        marzban_user = await client.get_user(vpn_config.marzban_user_id)
-                        
-                        if not marzban_user:
-                            logger.warning(f"User {vpn_config.marzban_user_id} not found in Marzban")
-                            continue
-                        
-                        # Check if Marzban user is expired or disabled
-                        if marzban_user.status in [UserStatus.EXPIRED, UserStatus.DISABLED]:
-                            if subscription.status != SubscriptionStatus.EXPIRED:
-                                logger.info(f"Marking subscription as expired for user {user.telegram_id}")
-                                subscription.status = SubscriptionStatus.EXPIRED
-                                vpn_config.is_active = False
-                        
-                        # Sync expiration date from Marzban
-                        if marzban_user.expire:
-                            # Convert to naive datetime (PostgreSQL TIMESTAMP WITHOUT TIME ZONE)
-                            marzban_expire_date = datetime.fromtimestamp(marzban_user.expire, timezone.utc).replace(tzinfo=None)
-                            
-                            # Update subscription end_date if different
-                            if subscription.end_date != marzban_expire_date:
-                                logger.info(
-                                    f"Updating subscription end_date for user {user.telegram_id}: "
-                                    f"{subscription.end_date} -> {marzban_expire_date}"
-                                )
-                                subscription.end_date = marzban_expire_date
-                        
-                        # Sync traffic usage
-                        if hasattr(marzban_user, 'used_traffic') and marzban_user.used_traffic:
-                            vpn_config.traffic_used = marzban_user.used_traffic
-                        
-                        # Update last connected time (naive datetime for PostgreSQL)
-                        vpn_config.last_connected_at = datetime.now(timezone.utc).replace(tzinfo=None)
-                        
-                        synced_count += 1
-                        
-                        # Small delay to avoid overwhelming Marzban API
-                        await asyncio.sleep(0.1)
-                        
-                    except Exception as e:
-                        logger.error(f"Error syncing user {user.telegram_id}: {e}")
-                        errors_count += 1
-                        continue
+            async with marzban_client:
+                result = await marzban_reconciler.sync_subscriptions(session)
             
+            changed_user_ids = result.pop('changed_user_ids')
             await session.commit()
-            logger.info(f"Marzban sync completed: {synced_count} synced, {errors_count} errors")
+            await user_context_cache.invalidate_users(changed_user_ids)
+            logger.info(
+                f"Marzban sync completed: {result['synced']} synced, "
+                f"{result['subscriptions_updated']} subscriptions and "
+                f"{result['configs_updated']} configs updated, {result['missing']} missing"
+            )
             
-            return {
-                'synced': synced_count,
-                'errors': errors_count,
-                'total': len(configs_to_sync)
-            }
+            return result
             
     except Exception as e:
         logger.error(f"Error in sync_subscriptions_from_marzban: {e}")
@@ -102,59 +43,22 @@ async def _sync_subscriptions_from_marzban():
 @shared_task(bind=True)  
 def sync_user_status_from_marzban(self):
     """Sync user status from Marzban server"""
-    return asyncio.run(_sync_user_status_from_marzban())
+    return run_async(_sync_user_status_from_marzban())
 
 
 async def _sync_user_status_from_marzban():
     """Check and update user status based on Marzban data"""
     try:
         async with async_session_maker() as session:
-            # Get all users with VPN configs
-            result = await session.execute(
-                select(VPNConfig, User)
-                .join(User, VPNConfig.user_id == User.id)
-                .where(VPNConfig.marzban_user_id.isnot(None))
-            )
-            
-            configs = result.all()
-            updated_count = 0
-            
-            async with marzban_client as client:
-                for vpn_config, user in configs:
-                    try:
-                        # Get user data from Marzban
-                        marzban_user = await client.get_user(vpn_config.marzban_user_id)
-                        
-                        if not marzban_user:
-                            # User not found in Marzban - mark as inactive
-                            if vpn_config.is_active:
-                                vpn_config.is_active = False
-                                logger.info(f"Marked VPN config inactive for missing user {user.telegram_id}")
-                                updated_count += 1
-                            continue
-                        
-                        # Update VPN config based on Marzban status
-                        should_be_active = marzban_user.status == UserStatus.ACTIVE
-                        
-                        if vpn_config.is_active != should_be_active:
-                            vpn_config.is_active = should_be_active
-                            logger.info(f"Updated VPN status for user {user.telegram_id}: {should_be_active}")
-                            updated_count += 1
-                        
-                        # Update traffic data
-                        if hasattr(marzban_user, 'used_traffic'):
-                            vpn_config.traffic_used = marzban_user.used_traffic or 0
-                        
-                        await asyncio.sleep(0.05)  # Rate limiting
-                        
-                    except Exception as e:
-                        logger.error(f"Error checking status for user {user.telegram_id}: {e}")
-                        continue
+            async with marzban_client:
+                result = await marzban_reconciler.sync_user_status(session)
             
+            changed_user_ids = result.pop('changed_user_ids')
             await session.commit()
-            logger.info(f"User status sync completed: {updated_count} users updated")
+            await user_context_cache.invalidate_users(changed_user_ids)
+            logger.info(f"User status sync completed: {result['updated']} users updated")
             
-            return {'updated': updated_count, 'total': len(configs)}
+            return result
             
     except Exception as e:
         logger.error(f"Error in sync_user_status_from_marzban: {e}")
@@ -164,7 +68,7 @@ async def _sync_user_status_from_marzban():
 @shared_task(bind=True)
 def cleanup_expired_marzban_users(self):
     """Clean up expired users in Marzban"""
-    return asyncio.run(_cleanup_expired_marzban_users())
+    return run_async(_cleanup_expired_marzban_users())
 
 
 async def _cleanup_expired_marzban_users():
@@ -190,30 +94,35 @@ async def _cleanup_expired_marzban_users():
             expired_configs = result.all()
             cleaned_count = 0
             
+            # A user may have several expired subscriptions - delete each config once
+            configs_by_username = {}
+            for vpn_config, user, subscription in expired_configs:
+                configs_by_username[vpn_config.marzban_user_id] = (vpn_config, user)
+            
             async with marzban_client as client:
-                for vpn_config, user, subscription in expired_configs:
-                    try:
-                        # Delete user from Marzban
-                        success = await client.delete_user(vpn_config.marzban_user_id)
-                        
-                        if success:
-                            # Mark config as deleted
-                            vpn_config.marzban_user_id = None
-                            vpn_config.is_active = False
-                            cleaned_count += 1
-                            
-                            logger.info(f"Cleaned up expired Marzban user for {user.telegram_id}")
-                        
-                        await asyncio.sleep(0.1)  # Rate limiting
-                        
-                    except Exception as e:
-                        logger.error(f"Error cleaning up user {user.telegram_id}: {e}")
+                async for username, success in client.map_users(configs_by_username, client.delete_user):
+                    vpn_config, user = configs_by_username[username]
+                    
+                    if isinstance(success, Exception):
+                        logger.error(f"Error cleaning up user {user.telegram_id}: {success}")
                         continue
+                    
+                    if success:
+                        # Mark config as deleted
+                        vpn_config.marzban_user_id = None
+                        vpn_config.is_active = False
+                        cleaned_count += 1
+                        
+                        logger.info(f"Cleaned up expired Marzban user for {user.telegram_id}")
             
             await session.commit()
+            await user_context_cache.invalidate(*(
+                user.telegram_id for vpn_config, user in configs_by_username.values()
+                if not vpn_config.is_active
+            ))
             logger.info(f"Marzban cleanup completed: {cleaned_count} users cleaned")
             
-            return {'cleaned': cleaned_count, 'total': len(expired_configs)}
+            return {'cleaned': cleaned_count, 'total': len(configs_by_username)}
             
     except Exception as e:
         logger.error(f"Error in cleanup_expired_marzban_users: {e}")
@@ -223,7 +132,7 @@ async def _cleanup_expired_marzban_users():
 @shared_task(bind=True)
 def get_marzban_system_stats(self):
     """Get system statistics from Marzban"""
-    return asyncio.run(_get_marzban_system_stats())
+    return run_async(_get_marzban_system_stats())
 
 
 async def _get_marzban_system_stats():
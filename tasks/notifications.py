@@ -1,15 +1,24 @@
 from celery import shared_task
 from database.connection import async_session_maker
+from tasks.runtime import run_async, get_bot
 from database.models import User, Subscription, SubscriptionStatus
-from sqlalchemy import select, and_
+from sqlalchemy import select, update, and_, exists
 from datetime import datetime, timedelta
 from aiogram import Bot
 from bot.config import settings
+from services.cache import user_context_cache
+from services.notification import (
+    BroadcastEngine, NotificationLedger, SendResult, TelegramRateLimiter, send_bulk_messages
+)
+from typing import Dict, List
 import logging
-import asyncio
 
 logger = logging.getLogger(__name__)
 
+BROADCAST_RUN_SECONDS = 20 * 60
+
+expiry_warning_ledger = NotificationLedger("expiry_warning")
+
 
 async def send_notification_to_user(bot: Bot, user_id: int, message: str):
     """Send notification to specific user"""
@@ -25,245 +34,251 @@ async def send_notification_to_user(bot: Bot, user_id: int, message: str):
 @shared_task(bind=True)
 def check_expiring_subscriptions(self):
     """Check for expiring subscriptions and send notifications"""
-    return asyncio.run(_check_expiring_subscriptions())
+    return run_async(_check_expiring_subscriptions())
+
+
+def _expiry_warning_text(days_before: int, end_date: datetime) -> str:
+    """Expiry warning message for the given number of days left"""
+    if days_before == 1:
+        return (
+            f"⏰ **Подписка истекает завтра!**\n\n"
+            f"Ваша VPN подписка истекает завтра "
+            f"({end_date.strftime('%d.%m.%Y')}).\n\n"
+            f"💳 Продлите подписку, чтобы не потерять доступ к VPN.\n"
+            f"Используйте команду /pay или кнопку 'Оплатить/Продлить'"
+        )
+    elif days_before == 2:
+        return (
+            f"⏰ **Подписка истекает через 2 дня**\n\n"
+            f"Ваша VPN подписка истекает "
+            f"{end_date.strftime('%d.%m.%Y')}.\n\n"
+            f"Не забудьте продлить подписку заранее!"
+        )
+    return (
+        f"⏰ **Подписка истекает через {days_before} дня**\n\n"
+        f"Ваша VPN подписка истекает "
+        f"{end_date.strftime('%d.%m.%Y')}.\n\n"
+        f"Рекомендуем продлить подписку заранее."
+    )
+
+
+async def _send_expiry_warnings(session, bot: Bot, now: datetime) -> Dict[str, int]:
+    """Send each expiry warning once, for all warning windows at once"""
+    notification_days = set(settings.notification_days_before_expiry)  # [1, 2, 3]
+    if not notification_days:
+        return {'due': 0, 'sent': 0, 'failed': 0}
+    
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    range_start = today + timedelta(days=min(notification_days))
+    range_end = today + timedelta(days=max(notification_days) + 1)
+    
+    # One range query covers every warning window
+    result = await session.execute(
+        select(Subscription.id, Subscription.end_date, User.telegram_id)
+        .join(User, Subscription.user_id == User.id)
+        .where(
+            and_(
+                Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL]),
+                Subscription.end_date >= range_start,
+                Subscription.end_date < range_end,
+                User.status == 'active'
+            )
+        )
+    )
+    
+    warnings = []
+    for subscription_id, end_date, telegram_id in result.all():
+        days_before = (end_date.date() - today.date()).days
+        if days_before in notification_days:
+            # The end date is part of the key, so a renewed subscription is warned again
+            key = expiry_warning_ledger.key(subscription_id, end_date.strftime('%Y%m%d'), days_before)
+            warnings.append((key, telegram_id, _expiry_warning_text(days_before, end_date)))
+    
+    # Claim warnings before sending: the hourly job only touches new ones
+    claimed = await expiry_warning_ledger.claim(
+        [key for key, _, _ in warnings],
+        ttl=(max(notification_days) + 2) * 86400
+    )
+    due = [warning for warning, is_new in zip(warnings, claimed) if is_new]
+    
+    results = await send_bulk_messages(
+        bot,
+        [(telegram_id, text) for _, telegram_id, text in due],
+        limiter=TelegramRateLimiter(rate=settings.broadcast_rate_limit),
+        concurrency=settings.broadcast_concurrency,
+        parse_mode="Markdown"
+    )
+    
+    # Transient failures are retried on the next run; blocked users and
+    # rejected chats keep their key, retrying would fail the same way
+    retry_keys = [key for (key, _, _), result in zip(due, results) if result is SendResult.FAILED]
+    await expiry_warning_ledger.release(retry_keys)
+    
+    sent = sum(1 for result in results if result is SendResult.SENT)
+    return {'due': len(due), 'sent': sent, 'failed': len(due) - sent}
 
 
 async def _check_expiring_subscriptions():
     """Async implementation of subscription expiration check"""
-    bot = Bot(token=settings.bot_token)
+    bot = get_bot()
     
     try:
         async with async_session_maker() as session:
             now = datetime.now()
-            notification_days = settings.notification_days_before_expiry  # [1, 2, 3]
             
-            for days_before in notification_days:
-                # Calculate target date
-                target_date = now + timedelta(days=days_before)
-                start_of_day = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                end_of_day = target_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-                
-                # Get subscriptions expiring on target date
-                result = await session.execute(
-                    select(Subscription, User)
-                    .join(User, Subscription.user_id == User.id)
-                    .where(
-                        and_(
-                            Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL]),
-                            Subscription.end_date >= start_of_day,
-                            Subscription.end_date <= end_of_day,
-                            User.status == 'active'
-                        )
-                    )
-                )
-                
-                expiring_subs = result.all()
-                
-                for subscription, user in expiring_subs:
-                    # Prepare notification message
-                    if days_before == 1:
-                        message = (
-                            f"⏰ **Подписка истекает завтра!**\n\n"
-                            f"Ваша VPN подписка истекает завтра "
-                            f"({subscription.end_date.strftime('%d.%m.%Y')}).\n\n"
-                            f"💳 Продлите подписку, чтобы не потерять доступ к VPN.\n"
-                            f"Используйте команду /pay или кнопку 'Оплатить/Продлить'"
-                        )
-                    elif days_before == 2:
-                        message = (
-                            f"⏰ **Подписка истекает через 2 дня**\n\n"
-                            f"Ваша VPN подписка истекает "
-                            f"{subscription.end_date.strftime('%d.%m.%Y')}.\n\n"
-                            f"Не забудьте продлить подписку заранее!"
-                        )
-                    else:
-                        message = (
-                            f"⏰ **Подписка истекает через {days_before} дня**\n\n"
-                            f"Ваша VPN подписка истекает "
-                            f"{subscription.end_date.strftime('%d.%m.%Y')}.\n\n"
-                            f"Рекомендуем продлить подписку заранее."
-                        )
-                    
-                    # Send notification
-                    await send_notification_to_user(bot, user.telegram_id, message)
-                    
-                    # Small delay to avoid rate limits
-                    await asyncio.sleep(0.1)
-                
-                logger.info(f"Processed {len(expiring_subs)} subscriptions expiring in {days_before} days")
+            result = await _send_expiry_warnings(session, bot, now)
+            logger.info(
+                f"Expiry warnings: {result['due']} due, {result['sent']} sent, {result['failed']} failed"
+            )
             
             # Check and disable expired subscriptions
-            await _disable_expired_subscriptions(session, bot)
+            await _disable_expired_subscriptions(session)
             
     except Exception as e:
         logger.error(f"Error in check_expiring_subscriptions: {e}")
         raise
-    finally:
-        await bot.session.close()
 
 
-async def _disable_expired_subscriptions(session, bot: Bot):
-    """Disable expired subscriptions"""
+EXPIRED_NOTIFICATION_BATCH = 500
+
+SUBSCRIPTION_EXPIRED_MESSAGE = (
+    "❌ **Подписка истекла**\n\n"
+    "Ваша VPN подписка истекла.\n"
+    "Доступ к VPN временно приостановлен.\n\n"
+    "💳 Продлите подписку для восстановления доступа.\n"
+    "Используйте команду /pay"
+)
+
+
+async def _disable_expired_subscriptions(session) -> Dict[str, int]:
+    """Expire overdue subscriptions in bulk and disable their VPN users"""
+    from services.marzban import marzban_client, UserStatus
+    from database.models import VPNConfig
+    
     now = datetime.now()
     
-    # Get expired subscriptions
+    # Flip every overdue subscription in one statement
     result = await session.execute(
-        select(Subscription, User)
-        .join(User, Subscription.user_id == User.id)
+        update(Subscription)
         .where(
             and_(
+                Subscription.user_id == User.id,
                 Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL]),
                 Subscription.end_date < now,
                 User.status == 'active'
             )
         )
+        .values(status=SubscriptionStatus.EXPIRED, updated_at=now)
+        .returning(Subscription.user_id)
+        .execution_options(synchronize_session=False)
     )
+    user_ids = set(result.scalars().all())
+    if not user_ids:
+        return {'expired': 0, 'disabled': 0, 'failed': 0}
     
-    expired_subs = result.all()
-    
-    for subscription, user in expired_subs:
-        # Update subscription status
-        subscription.status = SubscriptionStatus.EXPIRED
-        
-        # Disable VPN config in Marzban
-        try:
-            from services.marzban import marzban_client, UserStatus
-            from database.models import VPNConfig
-            
-            # Get VPN config
-            vpn_result = await session.execute(
-                select(VPNConfig).where(VPNConfig.user_id == user.id)
+    # Telegram ids and Marzban users in one joined fetch. VPN users are left
+    # alone when another subscription of the user is still valid.
+    still_subscribed = exists().where(
+        and_(
+            Subscription.user_id == User.id,
+            Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL]),
+            Subscription.end_date >= now
+        )
+    )
+    result = await session.execute(
+        select(User.telegram_id, VPNConfig.id, VPNConfig.marzban_user_id)
+        .outerjoin(
+            VPNConfig,
+            and_(
+                VPNConfig.user_id == User.id,
+                VPNConfig.marzban_user_id.isnot(None),
+                ~still_subscribed
             )
-            vpn_config = vpn_result.scalar_one_or_none()
-            
-            if vpn_config and vpn_config.marzban_user_id:
-                async with marzban_client as client:
-                    await client.update_user(
-                        username=vpn_config.marzban_user_id,
-                        status=UserStatus.DISABLED
-                    )
-                vpn_config.is_active = False
-                logger.info(f"Disabled VPN for user {user.telegram_id}")
-        
-        except Exception as e:
-            logger.error(f"Failed to disable VPN for user {user.telegram_id}: {e}")
-        
-        # Send expiration notification
-        message = (
-            f"❌ **Подписка истекла**\n\n"
-            f"Ваша VPN подписка истекла.\n"
-            f"Доступ к VPN временно приостановлен.\n\n"
-            f"💳 Продлите подписку для восстановления доступа.\n"
-            f"Используйте команду /pay"
         )
+        .where(User.id.in_(user_ids))
+    )
+    rows = result.all()
+    telegram_ids = sorted({telegram_id for telegram_id, _, _ in rows})
+    vpn_config_ids = {
+        username: vpn_config_id
+        for _, vpn_config_id, username in rows
+        if vpn_config_id is not None
+    }
+    
+    # The status flip is durable even if Marzban is unavailable, _sync_vpn_usage disables leftovers
+    await session.commit()
+    
+    disabled_ids = []
+    failed = 0
+    if vpn_config_ids:
+        async with marzban_client as client:
+            # update_user retries each user on its own, map_users bounds concurrency
+            async for username, result in client.map_users(
+                vpn_config_ids,
+                lambda username: client.update_user(username=username, status=UserStatus.DISABLED)
+            ):
+                if isinstance(result, Exception):
+                    failed += 1
+                    logger.error(f"Failed to disable VPN {username}: {result}")
+                    continue
+                disabled_ids.append(vpn_config_ids[username])
         
-        await send_notification_to_user(bot, user.telegram_id, message)
+        if disabled_ids:
+            await session.execute(
+                update(VPNConfig)
+                .where(VPNConfig.id.in_(disabled_ids))
+                .values(is_active=False)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+    
+    await user_context_cache.invalidate(*telegram_ids)
     
-    if expired_subs:
-        await session.commit()
-        logger.info(f"Disabled {len(expired_subs)} expired subscriptions")
+    # Notifications are sent by the notification worker
+    for i in range(0, len(telegram_ids), EXPIRED_NOTIFICATION_BATCH):
+        send_subscription_expired_notifications.delay(telegram_ids[i:i + EXPIRED_NOTIFICATION_BATCH])
+    
+    logger.info(
+        f"Expired subscriptions of {len(user_ids)} users, disabled {len(disabled_ids)} VPN users, {failed} failed"
+    )
+    return {'expired': len(user_ids), 'disabled': len(disabled_ids), 'failed': failed}
+
+
+@shared_task(bind=True)
+def send_subscription_expired_notifications(self, telegram_ids: List[int]):
+    """Notify users that their subscription has expired"""
+    return run_async(_send_subscription_expired_notifications(telegram_ids))
+
+
+async def _send_subscription_expired_notifications(telegram_ids: List[int]):
+    """Async implementation of expiration notifications"""
+    results = await send_bulk_messages(
+        get_bot(),
+        [(telegram_id, SUBSCRIPTION_EXPIRED_MESSAGE) for telegram_id in telegram_ids],
+        limiter=TelegramRateLimiter(rate=settings.broadcast_rate_limit),
+        concurrency=settings.broadcast_concurrency,
+        parse_mode="Markdown"
+    )
+    sent = sum(1 for result in results if result is SendResult.SENT)
+    logger.info(f"Expiration notifications: {sent} sent, {len(results) - sent} failed")
+    return {'sent': sent, 'failed': len(results) - sent}
 
 
 @shared_task(bind=True)
 def send_broadcast_message(self, message_id: int):
     """Send broadcast message to users"""
-    return asyncio.run(_send_broadcast_message(message_id))
+    return run_async(_send_broadcast_message(message_id))
 
 
 async def _send_broadcast_message(message_id: int):
     """Async implementation of broadcast message sending"""
-    bot = Bot(token=settings.bot_token)
-    
     try:
-        async with async_session_maker() as session:
-            from database.models import BroadcastMessage
-            
-            # Get broadcast message
-            result = await session.execute(
-                select(BroadcastMessage).where(BroadcastMessage.id == message_id)
-            )
-            broadcast = result.scalar_one_or_none()
-            
-            if not broadcast:
-                logger.error(f"Broadcast message {message_id} not found")
-                return
-            
-            # Update status
-            broadcast.status = "in_progress"
-            await session.commit()
-            
-            # Get target users based on audience
-            if broadcast.target_audience == "all":
-                user_query = select(User).where(User.status == 'active')
-            elif broadcast.target_audience == "active":
-                user_query = (
-                    select(User)
-                    .join(Subscription, User.id == Subscription.user_id)
-                    .where(
-                        and_(
-                            User.status == 'active',
-                            Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL])
-                        )
-                    )
-                )
-            elif broadcast.target_audience == "expired":
-                user_query = (
-                    select(User)
-                    .join(Subscription, User.id == Subscription.user_id)
-                    .where(
-                        and_(
-                            User.status == 'active',
-                            Subscription.status == SubscriptionStatus.EXPIRED
-                        )
-                    )
-                )
-            else:
-                user_query = select(User).where(User.status == 'active')
-            
-            result = await session.execute(user_query)
-            users = result.scalars().all()
-            
-            broadcast.total_recipients = len(users)
-            await session.commit()
-            
-            # Send messages
-            sent_count = 0
-            failed_count = 0
-            
-            for user in users:
-                try:
-                    success = await send_notification_to_user(
-                        bot, user.telegram_id, broadcast.content
-                    )
-                    
-                    if success:
-                        sent_count += 1
-                    else:
-                        failed_count += 1
-                    
-                    # Update progress every 10 messages
-                    if (sent_count + failed_count) % 10 == 0:
-                        broadcast.sent_count = sent_count
-                        broadcast.failed_count = failed_count
-                        await session.commit()
-                    
-                    # Rate limiting
-                    await asyncio.sleep(0.05)  # 20 messages per second
-                
-                except Exception as e:
-                    failed_count += 1
-                    logger.error(f"Failed to send broadcast to user {user.telegram_id}: {e}")
-            
-            # Update final status
-            broadcast.sent_count = sent_count
-            broadcast.failed_count = failed_count
-            broadcast.status = "completed"
-            broadcast.completed_at = datetime.now()
-            
-            await session.commit()
-            
-            logger.info(f"Broadcast {message_id} completed: {sent_count} sent, {failed_count} failed")
-            
+        # Stay well inside the task time limit, the next run resumes from the checkpoint
+        result = await BroadcastEngine(get_bot()).run(message_id, max_duration=BROADCAST_RUN_SECONDS)
+        if result['status'] == 'paused':
+            send_broadcast_message.delay(message_id)
+        return result
+    
     except Exception as e:
         logger.error(f"Error in send_broadcast_message: {e}")
         # Mark as failed
@@ -277,19 +292,17 @@ async def _send_broadcast_message(message_id: int):
                 broadcast.status = "failed"
                 await session.commit()
         raise
-    finally:
-        await bot.session.close()
 
 
 @shared_task(bind=True)
 def send_payment_success_notification(self, user_id: int, subscription_data: dict):
     """Send payment success notification"""
-    return asyncio.run(_send_payment_success_notification(user_id, subscription_data))
+    return run_async(_send_payment_success_notification(user_id, subscription_data))
 
 
 async def _send_payment_success_notification(user_id: int, subscription_data: dict):
     """Send payment success notification to user"""
-    bot = Bot(token=settings.bot_token)
+    bot = get_bot()
     
     try:
         plan_name = subscription_data.get('plan_type', 'подписка')
@@ -309,6 +322,4 @@ async def _send_payment_success_notification(user_id: int, subscription_data: di
         
     except Exception as e:
         logger.error(f"Error sending payment success notification: {e}")
-        raise
-    finally:
-        await bot.session.close()
\ No newline at end of file
+        raise
\ No newline at end of file
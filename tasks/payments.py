@@ -1,60 +1,118 @@
 from celery import shared_task
 from database.connection import async_session_maker
+from tasks.runtime import run_async, get_bot
 from database.models import Payment, User, Subscription, VPNConfig, SubscriptionStatus
 from database.models.payment import PaymentStatus
-from services.payment import payment_manager
+from services.payment import payment_manager, PaymentWebhookConsumer
 from services.marzban import marzban_client, generate_unique_username
-from sqlalchemy import select, and_
+from services.cache import user_context_cache, catalog_cache
+from bot.config import settings
+from sqlalchemy import select, update, and_, func
 from datetime import datetime, timedelta
-import logging
+from typing import Dict, List, Optional
 import asyncio
+import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 
+# Status precedence: events may be redelivered or arrive out of order,
+# a payment never moves back to an earlier state
+PAYMENT_STATUS_RANK = {
+    PaymentStatus.PENDING.value: 0,
+    PaymentStatus.FAILED.value: 1,
+    PaymentStatus.CANCELLED.value: 1,
+    PaymentStatus.SUCCESS.value: 2,
+    'completed': 2,
+    PaymentStatus.REFUNDED.value: 3,
+}
+
+WEBHOOK_CONSUMER_RUN_SECONDS = 55
+
+PENDING_PAYMENT_STALE_AFTER = timedelta(hours=1)
+PENDING_PAYMENT_EXPIRES_AFTER = timedelta(days=1)
+PENDING_RECONCILE_BATCH_SIZE = 200
+PENDING_RECONCILE_MAX_SECONDS = 20 * 60
+
+
 @shared_task(bind=True)
 def process_payment_webhook(self, payment_data: dict, provider_name: str):
     """Process payment webhook from provider"""
-    return asyncio.run(_process_payment_webhook(payment_data, provider_name))
+    return run_async(_process_payment_webhook(payment_data, provider_name))
+
+
+@shared_task
+def consume_payment_webhooks():
+    """Process webhooks queued by the API (runs back to back from beat)"""
+    return run_async(_consume_payment_webhooks())
+
+
+async def _consume_payment_webhooks():
+    consumer = PaymentWebhookConsumer(
+        handler=lambda provider_name, payment_data: _process_payment_webhook(payment_data, provider_name)
+    )
+    stats = await consumer.run(max_duration=WEBHOOK_CONSUMER_RUN_SECONDS)
+    if stats['processed'] or stats['failed'] or stats['dead_lettered']:
+        logger.info(f"Payment webhooks consumed: {stats}")
+    return stats
 
 
 async def _process_payment_webhook(payment_data: dict, provider_name: str):
-    """Async implementation of payment webhook processing"""
+    """Apply a payment webhook event; safe to run more than once"""
     try:
         # Parse webhook data
         callback = payment_manager.parse_webhook(provider_name, payment_data)
+        return await _apply_payment_status(callback.payment_id, callback.status.value)
         
-        async with async_session_maker() as session:
-            # Find payment in database
-            result = await session.execute(
-                select(Payment).where(Payment.external_payment_id == callback.payment_id)
-            )
-            payment = result.scalar_one_or_none()
-            
-            if not payment:
-                logger.error(f"Payment {callback.payment_id} not found in database")
-                return False
-            
-            # Update payment status
-            old_status = payment.status
-            payment.status = callback.status.value
-            
-            # If payment successful and status changed
-            if (callback.status.value == PaymentStatus.SUCCESS and 
-                old_status != PaymentStatus.SUCCESS):
-                
-                await _activate_subscription_for_payment(payment, session)
-            
-            await session.commit()
-            logger.info(f"Payment {payment.id} status updated: {old_status} -> {payment.status}")
-            
-            return True
-            
     except Exception as e:
         logger.error(f"Error processing payment webhook: {e}")
         raise
 
 
+@shared_task(bind=True)
+def apply_payment_status(self, external_id: str, new_status: str):
+    """Move a payment to a provider-reported status, activating paid ones"""
+    return run_async(_apply_payment_status(external_id, new_status))
+
+
+async def _apply_payment_status(external_id: str, new_status: str) -> bool:
+    """Apply a provider status to a payment; safe to run more than once"""
+    async with async_session_maker() as session:
+        # Lock the payment so concurrent events for it apply one at a time
+        result = await session.execute(
+            select(Payment)
+            .where(Payment.external_id == external_id)
+            .with_for_update()
+        )
+        payment = result.scalar_one_or_none()
+        
+        if not payment:
+            logger.error(f"Payment {external_id} not found in database")
+            return False
+        
+        old_status = payment.status
+        if PAYMENT_STATUS_RANK.get(new_status, 0) <= PAYMENT_STATUS_RANK.get(old_status, 0):
+            logger.info(f"Payment {payment.id} status {new_status} ignored, status is {old_status}")
+            return True
+        
+        # Update payment status
+        payment.status = new_status
+        
+        # If payment successful and status changed
+        activated = new_status == PaymentStatus.SUCCESS
+        if activated:
+            payment.completed_at = datetime.now()
+            await _activate_subscription_for_payment(payment, session)
+        
+        await session.commit()
+        if activated:
+            await user_context_cache.invalidate_users([payment.user_id])
+        logger.info(f"Payment {payment.id} status updated: {old_status} -> {payment.status}")
+        
+        return True
+
+
 async def _activate_subscription_for_payment(payment: Payment, session):
     """Activate subscription after successful payment"""
     try:
@@ -68,8 +126,8 @@ async def _activate_subscription_for_payment(payment: Payment, session):
             logger.error(f"User {payment.user_id} not found")
             return
         
-        # Parse metadata from payment
-        metadata = payment.metadata or "{}"
+        # Parse metadata from payment (`Payment.metadata` is SQLAlchemy's MetaData, the column is `meta`)
+        metadata = payment.meta or "{}"
         if isinstance(metadata, str):
             import json
             try:
@@ -111,28 +169,32 @@ async def _activate_subscription_for_payment(payment: Payment, session):
             if current_subscription:
                 current_subscription.status = SubscriptionStatus.EXPIRED
             
+            # The bot stores the plan name as plan_type
+            plan_id = payment.plan_id
+            if plan_id is None:
+                plan = await catalog_cache.get_plan(plan_type, active_only=False)
+                if not plan:
+                    raise ValueError(f"No pricing plan {plan_type!r} for payment {payment.id}")
+                plan_id = plan.id
+            
             # Create new subscription
             new_subscription = Subscription(
                 user_id=user.id,
-                plan_type=plan_type,
+                plan_id=plan_id,
                 status=SubscriptionStatus.ACTIVE,
                 start_date=start_date,
                 end_date=end_date,
-                is_trial=False,
-                auto_renewal=True
+                auto_renew=user.auto_renew or False
             )
             session.add(new_subscription)
             logger.info(f"Created new subscription for user {user.telegram_id}")
         
-        # Link payment to subscription
-        payment.subscription_id = new_subscription.id
-        
         # Activate or create VPN config
         await _ensure_vpn_config_active(user, session)
         
         # Process referral bonus if applicable
-        if user.referrer_id:
-            await _process_referral_bonus(user.referrer_id, user.id, session)
+        if user.referred_by:
+            await _process_referral_bonus(user.referred_by, user.id, session)
         
         # Send success notification
         from tasks.notifications import send_payment_success_notification
@@ -186,7 +248,7 @@ async def _ensure_vpn_config_active(user: User, session):
                 vpn_config = VPNConfig(
                     user_id=user.id,
                     marzban_user_id=marzban_username,
-                    config_url=marzban_user.links[0] if marzban_user.links else None,
+                    config_data=marzban_user.links[0] if marzban_user.links else None,
                     is_active=True
                 )
                 session.add(vpn_config)
@@ -226,7 +288,7 @@ async def _process_referral_bonus(referrer_id: int, referral_id: int, session):
 @shared_task(bind=True)
 def retry_failed_payments(self):
     """Retry failed auto-renewal payments"""
-    return asyncio.run(_retry_failed_payments())
+    return run_async(_retry_failed_payments())
 
 
 async def _retry_failed_payments():
@@ -273,9 +335,8 @@ async def _retry_failed_payments():
                     
                     # For now, just send notification about renewal failure
                     from tasks.notifications import send_notification_to_user
-                    from aiogram import Bot
                     
-                    bot = Bot(token=settings.bot_token)
+                    bot = get_bot()
                     message = (
                         f"❌ **Не удалось продлить подписку**\n\n"
                         f"При автоматическом продлении подписки произошла ошибка.\n"
@@ -284,7 +345,6 @@ async def _retry_failed_payments():
                     )
                     
                     await send_notification_to_user(bot, user.telegram_id, message)
-                    await bot.session.close()
             
             logger.info(f"Processed {len(failed_renewals)} failed auto-renewals")
             
@@ -295,52 +355,110 @@ async def _retry_failed_payments():
 
 @shared_task(bind=True)
 def cleanup_pending_payments(self):
-    """Cleanup old pending payments"""
-    return asyncio.run(_cleanup_pending_payments())
+    """Reconcile stale pending payments with their providers"""
+    return run_async(_cleanup_pending_payments())
 
 
-async def _cleanup_pending_payments():
-    """Async implementation of pending payments cleanup"""
+async def _cleanup_pending_payments() -> Dict[str, int]:
+    """Async implementation of pending payments reconciliation.
+    
+    Stale payments are read in keyset batches, their provider status is polled
+    concurrently (bounded per provider) and every batch is committed on its
+    own. Paid payments are handed to `apply_payment_status`, so activation and
+    Marzban calls never run inside the reconciliation transaction.
+    """
+    now = datetime.now()
+    cutoff_time = now - PENDING_PAYMENT_STALE_AFTER
+    expiry_time = now - PENDING_PAYMENT_EXPIRES_AFTER
+    deadline = time.monotonic() + PENDING_RECONCILE_MAX_SECONDS
+    semaphores: Dict[str, asyncio.Semaphore] = {}
+    stats = {'checked': 0, 'activated': 0, 'updated': 0, 'errors': 0}
+    last_id = 0
+    
+    async def poll(row) -> Optional[str]:
+        semaphore = semaphores.setdefault(row.system, asyncio.Semaphore(settings.payment_reconcile_concurrency))
+        async with semaphore:
+            try:
+                actual_status = await payment_manager.get_payment_status(row.external_id, row.system)
+                return actual_status.value
+            except Exception as e:
+                logger.error(f"Error checking payment {row.id} status: {e}")
+                return None
+    
     try:
-        async with async_session_maker() as session:
-            # Cancel payments that are pending for more than 1 hour
-            cutoff_time = datetime.now() - timedelta(hours=1)
+        while time.monotonic() < deadline:
+            batch = await _stale_pending_payments(cutoff_time, last_id, PENDING_RECONCILE_BATCH_SIZE)
+            if not batch:
+                break
+            last_id = batch[-1].id
+            stats['checked'] += len(batch)
+            
+            # Payments that can't be checked with a provider are failed right away
+            pollable = [row for row in batch if row.system and row.external_id]
+            statuses = {row.id: PaymentStatus.FAILED.value for row in batch if not (row.system and row.external_id)}
+            polled = await asyncio.gather(*(poll(row) for row in pollable))
             
+            for row, status in zip(pollable, polled):
+                if status is None:
+                    stats['errors'] += 1
+                    # Give up on payments the provider can't tell us about for a day
+                    if row.created_at.replace(tzinfo=None) < expiry_time:
+                        statuses[row.id] = PaymentStatus.FAILED.value
+                elif status == PaymentStatus.SUCCESS:
+                    apply_payment_status.delay(row.external_id, status)
+                    stats['activated'] += 1
+                elif status != PaymentStatus.PENDING:
+                    statuses[row.id] = status
+            
+            if statuses:
+                stats['updated'] += await _update_pending_statuses(statuses)
+        
+        logger.info(f"Pending payments reconciled: {stats}")
+        return stats
+            
+    except Exception as e:
+        logger.error(f"Error in cleanup_pending_payments: {e}")
+        raise
+
+
+async def _stale_pending_payments(cutoff_time: datetime, after_id: int, limit: int) -> list:
+    """Next batch of pending payments created before the cutoff, in id order"""
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(Payment.id, Payment.system, Payment.external_id, Payment.created_at)
+            .where(
+                and_(
+                    Payment.status == PaymentStatus.PENDING,
+                    Payment.created_at < cutoff_time,
+                    Payment.id > after_id
+                )
+            )
+            .order_by(Payment.id)
+            .limit(limit)
+        )
+        return result.all()
+
+
+async def _update_pending_statuses(statuses: Dict[int, str]) -> int:
+    """Move still-pending payments to new statuses; returns the number updated"""
+    # One statement per new status, guarded against concurrent webhooks
+    by_status: Dict[str, List[int]] = {}
+    for payment_id, status in statuses.items():
+        by_status.setdefault(status, []).append(payment_id)
+    
+    updated = 0
+    async with async_session_maker() as session:
+        for status, payment_ids in by_status.items():
             result = await session.execute(
-                select(Payment)
+                update(Payment)
                 .where(
                     and_(
-                        Payment.status == PaymentStatus.PENDING,
-                        Payment.created_at < cutoff_time
+                        Payment.id.in_(payment_ids),
+                        Payment.status == PaymentStatus.PENDING
                     )
                 )
+                .values(status=status, updated_at=func.now())
             )
-            
-            old_payments = result.scalars().all()
-            
-            for payment in old_payments:
-                # Try to get actual status from payment provider
-                if payment.payment_system and payment.external_payment_id:
-                    try:
-                        actual_status = await payment_manager.get_payment_status(
-                            payment.external_payment_id,
-                            payment.payment_system
-                        )
-                        payment.status = actual_status.value
-                        
-                        if actual_status.value == PaymentStatus.SUCCESS:
-                            await _activate_subscription_for_payment(payment, session)
-                    
-                    except Exception as e:
-                        logger.error(f"Error checking payment {payment.id} status: {e}")
-                        payment.status = PaymentStatus.FAILED
-                else:
-                    payment.status = PaymentStatus.FAILED
-            
-            if old_payments:
-                await session.commit()
-                logger.info(f"Cleaned up {len(old_payments)} pending payments")
-            
-    except Exception as e:
-        logger.error(f"Error in cleanup_pending_payments: {e}")
-        raise
\ No newline at end of file
+            updated += result.rowcount
+        await session.commit()
+    return updated
@@ -0,0 +1,118 @@
+"""Long-lived asyncio runtime for Celery worker processes.
+
+Each worker process runs one event loop in a background thread. Tasks submit
+their coroutines to it with run_async(), so the DB engine pool, Redis, the
+Marzban httpx pool and the Telegram bot session stay bound to a single live
+loop and are reused across tasks instead of being rebuilt per task.
+"""
+from typing import Any, Awaitable, Optional
+from aiogram import Bot
+from bot.config import settings
+from bot.middleware.metrics import TelegramRequestMetricsMiddleware
+import asyncio
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_pid: Optional[int] = None
+_bot: Optional[Bot] = None
+
+
+def start_runtime() -> asyncio.AbstractEventLoop:
+    """Start the worker event loop if it is not running in this process"""
+    global _loop, _thread, _pid, _bot
+
+    with _lock:
+        if _loop is not None and _pid == os.getpid() and _thread.is_alive():
+            return _loop
+
+        # Loop and resources inherited through fork belong to the parent
+        if _pid is not None and _pid != os.getpid():
+            _bot = None
+            _reset_inherited_pools()
+
+        _loop = asyncio.new_event_loop()
+        _thread = threading.Thread(
+            target=_loop.run_forever,
+            name="celery-async-runtime",
+            daemon=True
+        )
+        _thread.start()
+        _pid = os.getpid()
+
+        logger.info(f"Started async runtime in worker process {_pid}")
+        return _loop
+
+
+def run_async(coro: Awaitable[Any]) -> Any:
+    """Run a coroutine on the worker event loop and wait for its result"""
+    loop = start_runtime()
+
+    if threading.current_thread() is _thread:
+        raise RuntimeError("run_async() cannot be called from the runtime loop itself")
+
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result()
+    except BaseException:
+        # Time limits and worker shutdown interrupt the waiting thread,
+        # make sure the coroutine does not keep running on the loop
+        future.cancel()
+        raise
+
+
+def get_bot() -> Bot:
+    """Get the Telegram bot shared by tasks of this worker process"""
+    global _bot
+
+    if _bot is None:
+        _bot = Bot(token=settings.bot_token)
+        _bot.session.middleware(TelegramRequestMetricsMiddleware())
+    return _bot
+
+
+async def _close_resources():
+    """Close pooled connections bound to the runtime loop"""
+    from database.connection import close_db
+    from services.marzban import marzban_client
+    from services.http import http_clients
+
+    if _bot is not None:
+        await _bot.session.close()
+    await marzban_client.close()
+    await http_clients.close()
+    await close_db()
+
+
+def _reset_inherited_pools():
+    """Drop pooled DB connections inherited from the parent process"""
+    from database.connection import engine
+
+    engine.sync_engine.dispose(close=False)
+
+
+def shutdown_runtime():
+    """Close pooled resources and stop the worker event loop"""
+    global _loop, _thread, _pid, _bot
+
+    with _lock:
+        if _loop is None or _pid != os.getpid():
+            return
+
+        loop, thread = _loop, _thread
+        try:
+            asyncio.run_coroutine_threadsafe(_close_resources(), loop).result(timeout=10)
+        except Exception as e:
+            logger.error(f"Error closing async runtime resources: {e}")
+
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=10)
+        loop.close()
+
+        _loop = _thread = _pid = _bot = None
+        logger.info("Stopped async runtime")
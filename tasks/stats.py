@@ -1,89 +1,56 @@
 from celery import shared_task
 from database.connection import async_session_maker
-from database.models import User, Subscription, Payment, UsageStat, VPNConfig, SubscriptionStatus
-from services.marzban import marzban_client
+from tasks.runtime import run_async
+from database.models import User, Subscription, VPNConfig, SubscriptionStatus
+from services.marzban import marzban_client, UserStatus
+from services.stats import daily_metrics_rollup, usage_tracker, usage_storage
 from sqlalchemy import select, func, and_
-from datetime import datetime, date, timedelta
+from datetime import datetime, timedelta
 import logging
-import asyncio
 
 logger = logging.getLogger(__name__)
 
 
 @shared_task(bind=True)
 def collect_daily_stats(self):
-    """Collect daily usage statistics"""
-    return asyncio.run(_collect_daily_stats())
+    """Collect usage statistics (traffic since the previous run)"""
+    return run_async(_collect_daily_stats())
 
 
 async def _collect_daily_stats():
-    """Async implementation of daily stats collection"""
+    """Async implementation of usage stats collection"""
     try:
         async with async_session_maker() as session:
-            today = date.today()
-            
-            # Collect stats for all active VPN users
-            result = await session.execute(
-                select(VPNConfig, User)
-                .join(User, VPNConfig.user_id == User.id)
-                .where(VPNConfig.is_active == True)
-            )
-            
-            vpn_configs = result.all()
-            
-            for vpn_config, user in vpn_configs:
-                try:
-                    # Get usage data from Marzban
-                    async with marzban_client as client:
-                        usage_data = await client.get_user_usage(vpn_config.marzban_user_id)
-                        
-                        if usage_data:
-                            # Check if stats for today already exist
-                            result = await session.execute(
-                                select(UsageStat)
-                                .where(
-                                    and_(
-                                        UsageStat.user_id == user.id,
-                                        UsageStat.date == today
-                                    )
-                                )
-                            )
-                            
-                            daily_stat = result.scalar_one_or_none()
-                            
-                            if not daily_stat:
-                                # Create new daily stat
-                                daily_stat = UsageStat(
-                                    user_id=user.id,
-                                    date=today,
-                                    bytes_uploaded=usage_data.used_traffic,
-                                    bytes_downloaded=0,  # Marzban doesn't separate up/down
-                                    connections_count=1 if usage_data.online_at else 0
-                                )
-                                session.add(daily_stat)
-                            else:
-                                # Update existing stat
-                                daily_stat.bytes_uploaded = usage_data.used_traffic
-                                daily_stat.connections_count = 1 if usage_data.online_at else 0
-                            
-                            logger.debug(f"Updated usage stats for user {user.telegram_id}")
-                
-                except Exception as e:
-                    logger.error(f"Error collecting stats for user {user.telegram_id}: {e}")
-                    continue
-            
+            results = await usage_tracker.ingest_usage(session)
             await session.commit()
-            logger.info(f"Collected daily stats for {len(vpn_configs)} users")
+            return results
             
     except Exception as e:
         logger.error(f"Error in collect_daily_stats: {e}")
         raise
 
 
+@shared_task(bind=True)
+def maintain_usage_storage(self):
+    """Create usage partitions, downsample old months and drop their partitions"""
+    return run_async(_maintain_usage_storage())
+
+
+async def _maintain_usage_storage():
+    """Async implementation of usage storage maintenance"""
+    try:
+        async with async_session_maker() as session:
+            return await usage_storage.maintain(session)
+            
+    except Exception as e:
+        logger.error(f"Error maintaining usage storage: {e}")
+        raise
+
+
 @shared_task(bind=True)
 def sync_vpn_usage(self):
     """Sync VPN usage data from Marzban"""
-    return asyncio.run(_sync_vpn_usage())
+    return run_async(_sync_vpn_usage())
 
 
 async def _sync_vpn_usage():
@@ -99,55 +66,69 @@ async def _sync_vpn_usage():
             
             vpn_configs = result.all()
             sync_count = 0
+            configs_by_username = {
+                vpn_config.marzban_user_id: (vpn_config, user)
+                for vpn_config, user in vpn_configs
+                if vpn_config.marzban_user_id
+            }
             
-            for vpn_config, user in vpn_configs:
-                try:
-                    async with marzban_client as client:
-                        # Get user data from Marzban
-                        marzban_user = await client.get_user(vpn_config.marzban_user_id)
-                        
-                        if marzban_user:
-                            # Update last used time if user is online
-                            if hasattr(marzban_user, 'online_at') and marzban_user.online_at:
-                                vpn_config.last_used_at = datetime.now()
-                            
-                            # Check if user status matches subscription
-                            result = await session.execute(
-                                select(Subscription)
-                                .where(
-                                    and_(
-                                        Subscription.user_id == user.id,
-                                        Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL])
-                                    )
-                                )
-                            )
-                            
-                            subscription = result.scalar_one_or_none()
-                            
-                            # Sync user status in Marzban with subscription status
-                            if subscription and subscription.end_date > datetime.now():
-                                if marzban_user.status.value != "active":
-                                    from services.marzban import UserStatus
-                                    await client.update_user(
-                                        username=vpn_config.marzban_user_id,
-                                        status=UserStatus.ACTIVE
-                                    )
-                                    logger.info(f"Activated Marzban user {vpn_config.marzban_user_id}")
-                            else:
-                                if marzban_user.status.value != "disabled":
-                                    from services.marzban import UserStatus
-                                    await client.update_user(
-                                        username=vpn_config.marzban_user_id,
-                                        status=UserStatus.DISABLED
-                                    )
-                                    vpn_config.is_active = False
-                                    logger.info(f"Disabled Marzban user {vpn_config.marzban_user_id}")
-                            
-                            sync_count += 1
+            # Users with a valid subscription should be active in Marzban
+            result = await session.execute(
+                select(Subscription.user_id)
+                .where(
+                    and_(
+                        Subscription.status.in_([SubscriptionStatus.ACTIVE, SubscriptionStatus.TRIAL]),
+                        Subscription.end_date > datetime.now()
+                    )
+                )
+            )
+            subscribed_user_ids = set(result.scalars().all())
+            
+            async with marzban_client as client:
+                to_activate = []
+                to_disable = []
                 
-                except Exception as e:
-                    logger.error(f"Error syncing VPN usage for user {user.telegram_id}: {e}")
-                    continue
+                async for username, marzban_user in client.map_users(configs_by_username, client.get_user):
+                    vpn_config, user = configs_by_username[username]
+                    
+                    if isinstance(marzban_user, Exception):
+                        logger.error(f"Error syncing VPN usage for user {user.telegram_id}: {marzban_user}")
+                        continue
+                    
+                    if not marzban_user:
+                        continue
+                    
+                    # Update last used time if user is online
+                    if hasattr(marzban_user, 'online_at') and marzban_user.online_at:
+                        vpn_config.last_used_at = datetime.now()
+                    
+                    # Sync user status in Marzban with subscription status
+                    if user.id in subscribed_user_ids:
+                        if marzban_user.status.value != "active":
+                            to_activate.append(username)
+                    elif marzban_user.status.value != "disabled":
+                        to_disable.append(username)
+                    
+                    sync_count += 1
+                
+                async for username, result in client.map_users(
+                    to_activate,
+                    lambda username: client.update_user(username=username, status=UserStatus.ACTIVE)
+                ):
+                    if isinstance(result, Exception):
+                        logger.error(f"Error activating Marzban user {username}: {result}")
+                    else:
+                        logger.info(f"Activated Marzban user {username}")
+                
+                async for username, result in client.map_users(
+                    to_disable,
+                    lambda username: client.update_user(username=username, status=UserStatus.DISABLED)
+                ):
+                    if isinstance(result, Exception):
+                        logger.error(f"Error disabling Marzban user {username}: {result}")
+                        continue
+                    configs_by_username[username][0].is_active = False
+                    logger.info(f"Disabled Marzban user {username}")
             
             if sync_count > 0:
                 await session.commit()
@@ -161,7 +142,7 @@ async def _sync_vpn_usage():
 @shared_task(bind=True)
 def check_server_health(self):
     """Check VPN server health"""
-    return asyncio.run(_check_server_health())
+    return run_async(_check_server_health())
 
 
 async def _check_server_health():
@@ -200,10 +181,27 @@ async def _check_server_health():
         }
 
 
+@shared_task(bind=True)
+def refresh_daily_metrics(self):
+    """Refresh daily metrics rollups for days touched since last run"""
+    return run_async(_refresh_daily_metrics())
+
+
+async def _refresh_daily_metrics():
+    """Async implementation of daily metrics refresh"""
+    try:
+        async with async_session_maker() as session:
+            return await daily_metrics_rollup.refresh(session)
+            
+    except Exception as e:
+        logger.error(f"Error refreshing daily metrics: {e}")
+        raise
+
+
 @shared_task(bind=True)
 def generate_revenue_report(self, start_date: str, end_date: str):
     """Generate revenue report for date range"""
-    return asyncio.run(_generate_revenue_report(start_date, end_date))
+    return run_async(_generate_revenue_report(start_date, end_date))
 
 
 async def _generate_revenue_report(start_date_str: str, end_date_str: str):
@@ -213,61 +211,17 @@ async def _generate_revenue_report(start_date_str: str, end_date_str: str):
         end_date = datetime.fromisoformat(end_date_str)
         
         async with async_session_maker() as session:
-            from database.models.payment import PaymentStatus
-            
-            # Get successful payments in date range
-            result = await session.execute(
-                select(
-                    func.sum(Payment.amount),
-                    func.count(Payment.id),
-                    Payment.payment_method
-                )
-                .where(
-                    and_(
-                        Payment.status == PaymentStatus.SUCCESS,
-                        Payment.created_at >= start_date,
-                        Payment.created_at <= end_date
-                    )
-                )
-                .group_by(Payment.payment_method)
+            # Daily totals and revenue by payment system from rollups
+            metrics = await daily_metrics_rollup.get_daily_metrics(
+                session, start_date.date(), end_date.date()
+            )
+            revenue_by_method = await daily_metrics_rollup.get_revenue_by_payment_system(
+                session, start_date.date(), end_date.date()
             )
             
-            revenue_by_method = result.all()
-            
-            # Total revenue
-            total_revenue = await session.scalar(
-                select(func.sum(Payment.amount))
-                .where(
-                    and_(
-                        Payment.status == PaymentStatus.SUCCESS,
-                        Payment.created_at >= start_date,
-                        Payment.created_at <= end_date
-                    )
-                )
-            ) or 0
-            
-            # Total transactions
-            total_transactions = await session.scalar(
-                select(func.count(Payment.id))
-                .where(
-                    and_(
-                        Payment.status == PaymentStatus.SUCCESS,
-                        Payment.created_at >= start_date,
-                        Payment.created_at <= end_date
-                    )
-                )
-            ) or 0
-            
-            # New users in period
-            new_users = await session.scalar(
-                select(func.count(User.id))
-                .where(
-                    and_(
-                        User.created_at >= start_date,
-                        User.created_at <= end_date
-                    )
-                )
-            ) or 0
+            total_revenue = sum(metric.revenue for metric in metrics)
+            total_transactions = sum(metric.transactions for metric in metrics)
+            new_users = sum(metric.new_users for metric in metrics)
             
             report = {
                 "period": {
@@ -279,11 +233,11 @@ async def _generate_revenue_report(start_date_str: str, end_date_str: str):
                 "new_users": new_users,
                 "revenue_by_method": [
                     {
-                        "method": method,
-                        "revenue": float(revenue),
-                        "transactions": count
+                        "method": row.payment_system,
+                        "revenue": float(row.revenue),
+                        "transactions": row.transactions
                     }
-                    for revenue, count, method in revenue_by_method
+                    for row in revenue_by_method
                 ],
                 "average_transaction": float(total_revenue / total_transactions) if total_transactions > 0 else 0
             }
@@ -299,7 +253,7 @@ async def _generate_revenue_report(start_date_str: str, end_date_str: str):
 @shared_task(bind=True)
 def calculate_user_metrics(self):
     """Calculate user engagement metrics"""
-    return asyncio.run(_calculate_user_metrics())
+    return run_async(_calculate_user_metrics())
 
 
 async def _calculate_user_metrics():
@@ -0,0 +1,210 @@
+"""In-memory stand-ins for Redis and SQLAlchemy sessions shared by unit tests"""
+import pytest
+
+
+class FakePipeline:
+    """Queues commands and runs them against the fake Redis on execute"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        commands, self.commands = self.commands, []
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+
+class FakeRedis:
+    """The subset of redis.asyncio used by the services.
+
+    Expirations are recorded, not applied. Lua scripts run the Python
+    implementation a test puts in `scripts` under the script's source.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.published = []
+        self.streams = {}
+        self.delivered = {}
+        self.acked = []
+        self.scripts = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value if isinstance(value, (str, bytes)) else str(value)
+        if ex is not None:
+            self.ttls[key] = ex
+        else:
+            self.ttls.pop(key, None)
+        return True
+
+    async def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            removed += self.data.pop(key, None) is not None
+            self.ttls.pop(key, None)
+        return removed
+
+    async def expire(self, key, ttl):
+        self.ttls[key] = ttl
+        return key in self.data
+
+    async def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    async def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update({field: str(value) for field, value in mapping.items()})
+        return len(mapping)
+
+    async def publish(self, channel, message):
+        self.published.append((channel, message))
+        return 0
+
+    async def xadd(self, stream, fields, **kwargs):
+        entries = self.streams.setdefault(stream, [])
+        message_id = f"{len(entries) + 1}-0"
+        entries.append((message_id, dict(fields)))
+        return message_id
+
+    async def xgroup_create(self, stream, group, id="0", mkstream=False):
+        self.streams.setdefault(stream, [])
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        """New entries only; one consumer group per stream"""
+        response = []
+        for stream in streams:
+            entries = self.streams.get(stream, [])
+            delivered = self.delivered.get(stream, 0)
+            new = entries[delivered:delivered + count if count else None]
+            self.delivered[stream] = delivered + len(new)
+            if new:
+                response.append((stream, new))
+        return response
+
+    async def xpending_range(self, stream, group, **kwargs):
+        return []
+
+    async def xack(self, stream, group, *ids):
+        self.acked.extend(ids)
+        return len(ids)
+
+    def register_script(self, script):
+        return self.scripts[script]
+
+    def pipeline(self, *args, **kwargs):
+        return FakePipeline(self)
+
+
+class FakeResult:
+    """Result of a fake statement; `rows` are tuples or, for scalar queries, plain values"""
+
+    def __init__(self, rows=(), rowcount=None):
+        self.rows = list(rows)
+        self.rowcount = len(self.rows) if rowcount is None else rowcount
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for row in self.rows:
+            yield row
+
+    def all(self):
+        return list(self.rows)
+
+    def scalars(self):
+        return FakeResult([row[0] if isinstance(row, tuple) else row for row in self.rows])
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+    def one(self):
+        assert len(self.rows) == 1, f"expected one row, got {len(self.rows)}"
+        return self.rows[0]
+
+    def scalar(self):
+        row = self.first()
+        return row[0] if isinstance(row, tuple) else row
+
+    def scalar_one_or_none(self):
+        return self.scalar()
+
+
+class FakeSession:
+    """AsyncSession stand-in.
+
+    Statements are recorded and answered by `respond(statement, params)`,
+    which returns the result rows. `objects` serves `session.get` by primary
+    key. Calling the session returns itself, so it doubles as a session
+    factory.
+    """
+
+    def __init__(self, respond=None, objects=None):
+        self.respond = respond or (lambda statement, params: ())
+        self.objects = dict(objects or {})
+        self.statements = []
+        self.params = []
+        self.added = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    def queries(self):
+        return len(self.statements)
+
+    async def execute(self, statement, params=None):
+        self.statements.append(statement)
+        self.params.append(params)
+        return FakeResult(self.respond(statement, params) or ())
+
+    async def stream(self, statement, params=None):
+        return await self.execute(statement, params)
+
+    async def get(self, model, key):
+        return self.objects.get(key)
+
+    def add(self, instance):
+        self.added.append(instance)
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis()
+
+
+@pytest.fixture
+def fake_session():
+    """Factory for FakeSession: fake_session(respond=None, objects=None)"""
+    return FakeSession
@@ -0,0 +1,91 @@
+import pytest
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+from aiogram.methods import SendMessage
+from sqlalchemy import Select
+
+from services.notification import broadcast as broadcast_module
+from services.notification.broadcast import BroadcastEngine, BroadcastProgress
+from services.notification.rate_limiter import SendResult, TelegramRateLimiter, send_limited_message
+
+
+class FakeBot:
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        error = self.errors.get(chat_id)
+        if error:
+            self.errors[chat_id] = None
+            raise error
+        self.sent.append(chat_id)
+
+
+def recipients_after(recipients):
+    """Answer the recipient stream with users after its keyset position"""
+    def respond(statement, params):
+        if isinstance(statement, Select):
+            after = statement.compile().params['id_1']
+            return [row for row in recipients if row[0] > after]
+    return respond
+
+
+def retry_after(seconds):
+    return TelegramRetryAfter(method=SendMessage(chat_id=1, text="x"), message="flood", retry_after=seconds)
+
+
+def test_progress_counts_contiguous_prefix_only():
+    progress = BroadcastProgress()
+
+    progress.complete(1, user_id=20, success=True)
+    assert progress.as_dict() == {'last_user_id': 0, 'sent': 0, 'failed': 0}
+
+    progress.complete(0, user_id=10, success=False)
+    assert progress.as_dict() == {'last_user_id': 20, 'sent': 1, 'failed': 1}
+
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_and_retries():
+    bot = FakeBot(errors={1: retry_after(0)})
+    limiter = TelegramRateLimiter(rate=1000, burst=10, per_chat_interval=0)
+
+    assert await send_limited_message(bot, limiter, 1, "hello") is SendResult.SENT
+    assert bot.sent == [1]
+    assert limiter.paused_until > 0
+
+
+@pytest.mark.asyncio
+async def test_blocked_user_is_not_retried():
+    bot = FakeBot(errors={1: TelegramForbiddenError(method=SendMessage(chat_id=1, text="x"), message="blocked")})
+    limiter = TelegramRateLimiter(rate=1000, burst=10, per_chat_interval=0)
+
+    assert await send_limited_message(bot, limiter, 1, "hello") is SendResult.BLOCKED
+    assert bot.sent == []
+
+
+@pytest.mark.asyncio
+async def test_broadcast_resumes_after_checkpoint(monkeypatch, fake_redis, fake_session):
+    redis = fake_redis
+    monkeypatch.setattr(broadcast_module, "redis_client", redis)
+    redis.data["broadcast:7:checkpoint"] = {'last_user_id': '2', 'sent': '2', 'failed': '0'}
+
+    broadcast = SimpleNamespace(
+        status="in_progress", content="hi", target_audience="all",
+        total_recipients=5, sent_count=2, failed_count=0
+    )
+    recipients = [(user_id, 1000 + user_id) for user_id in range(1, 6)]
+    bot = FakeBot()
+    engine = BroadcastEngine(
+        bot,
+        session_factory=fake_session(recipients_after(recipients), objects={7: broadcast}),
+        concurrency=3,
+        rate_limit=1000
+    )
+
+    result = await engine.run(7)
+
+    assert sorted(bot.sent) == [1003, 1004, 1005]
+    assert result == {'status': 'completed', 'sent': 5, 'failed': 0}
+    assert "broadcast:7:checkpoint" not in redis.data
@@ -0,0 +1,76 @@
+import pytest
+from decimal import Decimal
+from types import SimpleNamespace
+
+from services.cache import catalog
+from services.cache.catalog import CatalogCache
+
+
+def make_plan(plan_id, name, price, is_active=True):
+    return SimpleNamespace(
+        id=plan_id, name=name, description=None, price=Decimal(price),
+        currency="RUB", duration_days=30, plan_type="regular", is_active=is_active
+    )
+
+
+@pytest.fixture(autouse=True)
+def redis(monkeypatch, fake_redis):
+    monkeypatch.setattr(catalog, "redis_client", fake_redis)
+    return fake_redis
+
+
+@pytest.mark.asyncio
+async def test_plans_are_loaded_once(fake_session):
+    plans = [make_plan(1, "Месячная подписка", "200")]
+    sessions = fake_session(lambda statement, params: plans)
+    cache = CatalogCache(session_factory=sessions, max_age=3600)
+
+    assert (await cache.get_plan("Месячная подписка")).price == Decimal("200")
+    assert await cache.get_plan("Unknown") is None
+    assert sessions.queries == 1
+
+
+@pytest.mark.asyncio
+async def test_inactive_plans_are_hidden_but_found_by_name(fake_session):
+    plans = [make_plan(1, "Пробный период", "0", is_active=False), make_plan(2, "Месячная подписка", "200")]
+    cache = CatalogCache(session_factory=fake_session(lambda statement, params: plans), max_age=3600)
+
+    assert [plan.name for plan in await cache.get_plans()] == ["Месячная подписка"]
+    assert await cache.get_plan("Пробный период") is None
+    assert (await cache.get_plan("Пробный период", active_only=False)).id == 1
+
+
+@pytest.mark.asyncio
+async def test_derived_values_follow_their_section(redis, fake_session):
+    plans = [make_plan(1, "Месячная подписка", "200")]
+    sessions = fake_session(lambda statement, params: plans)
+    cache = CatalogCache(session_factory=sessions, max_age=3600)
+    renders = []
+
+    async def render():
+        plans = await cache.get_plans()
+        renders.append(len(plans))
+        return f"{len(plans)} plans"
+
+    assert await cache.cached("plans", "menu", render) == "1 plans"
+    assert await cache.cached("plans", "menu", render) == "1 plans"
+    assert renders == [1]
+
+    await cache.invalidate("plans")
+    plans.append(make_plan(2, "Годовая подписка", "2000"))
+
+    assert await cache.cached("plans", "menu", render) == "2 plans"
+    assert redis.published == [(catalog.CATALOG_CHANNEL, "plans")]
+    assert sessions.queries == 2
+
+
+@pytest.mark.asyncio
+async def test_setting_values_are_decoded(fake_session):
+    settings = [("testing_mode", '{"enabled": true}'), ("motd", "hello")]
+    sessions = fake_session(lambda statement, params: settings)
+    cache = CatalogCache(session_factory=sessions, max_age=3600)
+
+    assert await cache.get_setting("testing_mode") == {"enabled": True}
+    assert await cache.get_setting("motd") == "hello"
+    assert await cache.get_setting("missing", 5) == 5
+    assert sessions.queries == 1
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.dml import Delete, Insert
+
+from database.models import ActionLog, Payment, SystemSetting
+from database.purge import ChunkedPurger, PurgeTarget
+
+
+def purge_database(fake_session, batches, partitions=()):
+    """Session returning the queued id batches for deletes from the purged table"""
+    batches, partitions = list(batches), list(partitions)
+
+    def respond(statement, params):
+        table = getattr(getattr(statement, "table", None), "name", None)
+        if isinstance(statement, Delete) and table != SystemSetting.__tablename__:
+            return batches.pop(0) if batches else []
+        if params and "cutoff" in params:
+            names = list(partitions)
+            partitions.clear()
+            return names
+
+    return fake_session(respond)
+
+
+def checkpoints(session):
+    """Checkpoint values written, in order"""
+    return [
+        statement.compile(dialect=postgresql.dialect()).params["value"]
+        for statement in session.statements
+        if isinstance(statement, Insert) and statement.table.name == SystemSetting.__tablename__
+    ]
+
+
+TARGET = PurgeTarget(ActionLog, ActionLog.created_at, datetime(2026, 9, 17))
+
+
+@pytest.mark.asyncio
+async def test_deletes_in_batches_committing_each(fake_session):
+    session = purge_database(fake_session, [[1, 2], [3, 4], [5]])
+
+    result = await ChunkedPurger(batch_size=2, pause=0).purge(session, TARGET)
+
+    assert result == {"rows": 5, "partitions": 0, "complete": True}
+    assert checkpoints(session) == ["2", "4", "5"]
+    assert session.commits == 4
+
+
+@pytest.mark.asyncio
+async def test_deadline_stops_with_checkpoint_kept(fake_session):
+    session = purge_database(fake_session, [[1, 2], [3, 4]])
+
+    result = await ChunkedPurger(batch_size=2, pause=0).purge(session, TARGET, deadline=0)
+
+    assert result == {"rows": 2, "partitions": 0, "complete": False}
+    assert checkpoints(session) == ["2"]
+
+
+@pytest.mark.asyncio
+async def test_expired_partitions_are_dropped_first(fake_session):
+    session = purge_database(fake_session, [], partitions=["action_logs_2026_08"])
+
+    result = await ChunkedPurger(pause=0).purge(session, TARGET)
+
+    assert result["partitions"] == 1
+    assert any("DETACH PARTITION" in str(statement) for statement in session.statements)
+
+
+@pytest.mark.asyncio
+async def test_filtered_targets_never_drop_partitions(fake_session):
+    target = PurgeTarget(
+        Payment, Payment.created_at, datetime(2026, 7, 1), conditions=(Payment.status == "failed",)
+    )
+    session = purge_database(fake_session, [], partitions=["payments_2026_05"])
+
+    result = await ChunkedPurger(pause=0).purge(session, target)
+
+    assert result["partitions"] == 0
+    assert not any("DETACH" in str(statement) for statement in session.statements)
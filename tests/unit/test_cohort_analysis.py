@@ -0,0 +1,52 @@
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+
+from services.stats import analytics
+from services.stats.analytics import AnalyticsService
+
+
+@pytest.fixture(autouse=True)
+def redis(monkeypatch, fake_redis):
+    monkeypatch.setattr(analytics, "redis_client", fake_redis)
+    return fake_redis
+
+
+@pytest.mark.asyncio
+async def test_cohort_matrix_built_from_single_query(fake_session):
+    rows = [
+        SimpleNamespace(cohort=datetime(2024, 2, 1), period=0, cohort_size=4, active_users=4),
+        SimpleNamespace(cohort=datetime(2024, 2, 1), period=1, cohort_size=4, active_users=1),
+        SimpleNamespace(cohort=datetime(2024, 1, 1), period=0, cohort_size=2, active_users=1),
+    ]
+    session = fake_session(lambda statement, params: rows)
+
+    result = await AnalyticsService().get_cohort_analysis(session, months=2, horizon=2)
+
+    assert session.queries == 1
+    assert session.params[0]['step_months'] == 1
+    assert result['2024-02'] == {
+        'cohort_size': 4,
+        'retention': [
+            {'month': 0, 'active_users': 4, 'retention_rate': 100.0},
+            {'month': 1, 'active_users': 1, 'retention_rate': 25.0}
+        ]
+    }
+    assert result['2024-01']['retention'] == [{'month': 0, 'active_users': 1, 'retention_rate': 50.0}]
+
+
+@pytest.mark.asyncio
+async def test_cohort_analysis_is_cached_per_granularity(fake_session):
+    rows = [SimpleNamespace(cohort=datetime(2024, 2, 5), period=0, cohort_size=1, active_users=1)]
+    session = fake_session(lambda statement, params: rows)
+    service = AnalyticsService()
+
+    first = await service.get_cohort_analysis(session, granularity='week', horizon=4)
+    second = await service.get_cohort_analysis(session, granularity='week', horizon=4)
+
+    assert first == second == {'2024-02-05': {
+        'cohort_size': 1,
+        'retention': [{'week': 0, 'active_users': 1, 'retention_rate': 100.0}]
+    }}
+    assert session.queries == 1
+    assert session.params[0]['step_weeks'] == 1
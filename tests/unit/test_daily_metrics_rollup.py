@@ -0,0 +1,47 @@
+import pytest
+from datetime import date, datetime
+from sqlalchemy.dialects import postgresql
+
+from services.stats.rollups import DailyMetricsRollup, WATERMARK_MARGIN
+
+
+def compiled(session):
+    return [str(statement.compile(dialect=postgresql.dialect())) for statement in session.statements]
+
+
+@pytest.mark.asyncio
+async def test_touched_days_include_changed_rows_and_elapsed_days(fake_session):
+    session = fake_session(lambda statement, params: [(date(2024, 1, 3),), (None,)])
+    rollup = DailyMetricsRollup()
+
+    days = await rollup._touched_days(session, datetime(2024, 3, 1, 12, 0), date(2024, 3, 3))
+
+    assert days == {date(2024, 1, 3), date(2024, 3, 1), date(2024, 3, 2), date(2024, 3, 3)}
+    assert "UNION" in compiled(session)[0]
+
+
+@pytest.mark.asyncio
+async def test_touched_days_look_back_past_the_watermark(fake_session):
+    session = fake_session()
+    watermark = datetime(2024, 3, 1, 12, 0)
+
+    await DailyMetricsRollup()._touched_days(session, watermark, date(2024, 3, 1))
+
+    params = session.statements[0].compile(dialect=postgresql.dialect()).params
+    assert set(params.values()) == {watermark - WATERMARK_MARGIN}
+
+
+@pytest.mark.asyncio
+async def test_recompute_upserts_one_row_per_day(fake_session):
+    session = fake_session()
+    rollup = DailyMetricsRollup()
+    days = [date(2024, 3, 1), date(2024, 3, 2)]
+
+    await rollup._recompute(session, days, datetime(2024, 3, 3))
+    statements = compiled(session)
+
+    upsert = next(s for s in statements if s.startswith("INSERT INTO daily_metrics"))
+    assert "ON CONFLICT (date) DO UPDATE" in upsert
+    assert any(s.startswith("DELETE FROM daily_payment_metrics") for s in statements)
+    # No payment rows, so nothing is inserted per payment system
+    assert not any(s.startswith("INSERT INTO daily_payment_metrics") for s in statements)
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import sys
+
+import pytest
+
+from services.backup import dump
+from services.backup.dump import BackupError, DatabaseBackup, directory_checksum, pg_dsn, run_command
+
+
+def test_checksum_covers_all_dump_files(tmp_path):
+    (tmp_path / "toc.dat").write_bytes(b"toc")
+    (tmp_path / "3001.dat.gz").write_bytes(b"data")
+
+    checksum, size = directory_checksum(str(tmp_path))
+
+    expected = hashlib.sha256(b"3001.dat.gz\0data" + b"toc.dat\0toc").hexdigest()
+    assert (checksum, size) == (expected, 7)
+
+
+def test_checksum_changes_with_content(tmp_path):
+    (tmp_path / "toc.dat").write_bytes(b"toc")
+    before, _ = directory_checksum(str(tmp_path))
+    (tmp_path / "toc.dat").write_bytes(b"tOc")
+
+    assert directory_checksum(str(tmp_path))[0] != before
+
+
+def test_pg_dsn_drops_driver():
+    assert pg_dsn("postgresql+asyncpg://u:p@db/vpn") == "postgresql://u:p@db/vpn"
+
+
+class TestRunCommand:
+    @pytest.mark.asyncio
+    async def test_returns_stdout(self):
+        assert await run_command([sys.executable, "-c", "print('ok')"], timeout=10) == "ok\n"
+
+    @pytest.mark.asyncio
+    async def test_failure_carries_stderr(self):
+        with pytest.raises(BackupError, match="boom"):
+            await run_command([sys.executable, "-c", "import sys; sys.exit('boom')"], timeout=10)
+
+    @pytest.mark.asyncio
+    async def test_timeout_kills_process(self):
+        with pytest.raises(BackupError, match="timed out"):
+            await run_command([sys.executable, "-c", "import time; time.sleep(5)"], timeout=0.2)
+
+    @pytest.mark.asyncio
+    async def test_cancellation_kills_process(self, monkeypatch):
+        processes = []
+        spawn = asyncio.create_subprocess_exec
+
+        async def create_subprocess_exec(*args, **kwargs):
+            processes.append(await spawn(*args, **kwargs))
+            return processes[-1]
+
+        monkeypatch.setattr(asyncio, "create_subprocess_exec", create_subprocess_exec)
+        task = asyncio.create_task(run_command([sys.executable, "-c", "import time; time.sleep(30)"], timeout=60))
+        await asyncio.sleep(0.2)
+        task.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert processes[0].returncode is not None
+
+
+class TestCreate:
+    @pytest.mark.asyncio
+    async def test_one_deadline_covers_dump_and_verify(self, tmp_path, monkeypatch, fake_session):
+        timeouts = []
+
+        async def fake_run_command(args, timeout):
+            timeouts.append(timeout)
+            if args[0] == "pg_dump":
+                path = tmp_path / args[args.index("--file") + 1]
+                path.mkdir()
+                (path / "toc.dat").write_bytes(b"toc")
+                await asyncio.sleep(0.3)
+                return ""
+            return "; header\n1; TABLE users\n"
+
+        monkeypatch.setattr(dump, "run_command", fake_run_command)
+        backup = DatabaseBackup(backup_dir=str(tmp_path), timeout=10)
+
+        record = await backup.create(fake_session())
+
+        assert record.status == "success"
+        assert timeouts[0] <= 10
+        assert timeouts[1] <= 10 - 0.3
+
+    @pytest.mark.asyncio
+    async def test_cancelled_backup_is_failed_and_removed(self, tmp_path, monkeypatch, fake_session):
+        started = asyncio.Event()
+
+        async def hanging_pg_dump(args, timeout):
+            (tmp_path / args[args.index("--file") + 1]).mkdir()
+            started.set()
+            await asyncio.sleep(60)
+
+        monkeypatch.setattr(dump, "run_command", hanging_pg_dump)
+        session = fake_session()
+        task = asyncio.create_task(DatabaseBackup(backup_dir=str(tmp_path)).create(session))
+        await started.wait()
+        task.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        record = session.added[0]
+        assert record.status == "failed"
+        assert record.error == "CancelledError"
+        assert list(tmp_path.iterdir()) == []
+        assert session.commits == 2
+
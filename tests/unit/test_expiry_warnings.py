@@ -0,0 +1,78 @@
+import pytest
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+from services.notification import ledger
+from tasks import notifications
+
+
+class FakeBot:
+    def __init__(self, fail_chats=(), blocked_chats=()):
+        self.fail_chats = set(fail_chats)
+        self.blocked_chats = set(blocked_chats)
+        self.sent = []
+        self.attempts = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.attempts.append(chat_id)
+        if chat_id in self.blocked_chats:
+            raise TelegramForbiddenError(method=SendMessage(chat_id=chat_id, text=text), message="blocked")
+        if chat_id in self.fail_chats:
+            raise RuntimeError("network error")
+        self.sent.append(chat_id)
+
+
+@pytest.fixture(autouse=True)
+def redis(monkeypatch, fake_redis):
+    monkeypatch.setattr(ledger, "redis_client", fake_redis)
+    monkeypatch.setattr(notifications.settings, "notification_days_before_expiry", [1, 2, 3])
+    return fake_redis
+
+
+NOW = datetime(2024, 5, 10, 14, 0)
+ROWS = [
+    (1, NOW + timedelta(days=1), 101),
+    (2, NOW + timedelta(days=3, hours=5), 102),
+    (3, NOW + timedelta(days=5), 103),  # outside every window
+]
+
+
+@pytest.mark.asyncio
+async def test_each_warning_is_sent_once(fake_session):
+    session = fake_session(lambda statement, params: ROWS)
+    bot = FakeBot()
+
+    first = await notifications._send_expiry_warnings(session, bot, NOW)
+    second = await notifications._send_expiry_warnings(session, bot, NOW + timedelta(hours=1))
+
+    assert sorted(bot.sent) == [101, 102]
+    assert first == {'due': 2, 'sent': 2, 'failed': 0}
+    assert second == {'due': 0, 'sent': 0, 'failed': 0}
+    assert session.queries == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_warning_is_retried(fake_session):
+    session = fake_session(lambda statement, params: ROWS[:1])
+
+    await notifications._send_expiry_warnings(session, FakeBot(fail_chats={101}), NOW)
+    bot = FakeBot()
+    result = await notifications._send_expiry_warnings(session, bot, NOW + timedelta(hours=1))
+
+    assert bot.sent == [101]
+    assert result['sent'] == 1
+
+
+@pytest.mark.asyncio
+async def test_blocked_user_is_not_retried(fake_session):
+    session = fake_session(lambda statement, params: ROWS[:1])
+
+    first = await notifications._send_expiry_warnings(session, FakeBot(blocked_chats={101}), NOW)
+    bot = FakeBot()
+    second = await notifications._send_expiry_warnings(session, bot, NOW + timedelta(hours=1))
+
+    assert first == {'due': 1, 'sent': 0, 'failed': 1}
+    assert bot.attempts == []
+    assert second['due'] == 0
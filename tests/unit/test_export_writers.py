@@ -0,0 +1,122 @@
+import asyncio
+import csv
+import gzip
+import io
+import threading
+from datetime import datetime
+
+import pytest
+
+from services.export.users import UserDataExporter
+from services.export.writers import (
+    INT, STR, BOOL, DATETIME, PARQUET_AVAILABLE, CSVEncoder, ExportError, open_writer
+)
+from tasks import backup as backup_tasks
+
+COLUMNS = [("telegram_id", INT), ("username", STR), ("has_vpn_config", BOOL), ("last_used", DATETIME)]
+ROWS = [
+    (1001, "alice", True, datetime(2026, 10, 17, 12, 0)),
+    (1002, None, False, None),
+]
+
+
+def read_csv(data: bytes):
+    return list(csv.reader(io.StringIO(data.decode("utf-8"))))
+
+
+class TestCSVEncoder:
+    def test_chunks_concatenate_to_one_csv(self):
+        encoder = CSVEncoder()
+        data = encoder.header(COLUMNS) + encoder.encode(ROWS[:1]) + encoder.encode(ROWS[1:]) + encoder.finish()
+
+        assert read_csv(data) == [
+            ["telegram_id", "username", "has_vpn_config", "last_used"],
+            ["1001", "alice", "Yes", "2026-10-17 12:00:00"],
+            ["1002", "", "No", ""],
+        ]
+
+    def test_compressed_chunks_form_one_gzip_stream(self):
+        encoder = CSVEncoder(compress=True)
+        data = encoder.header(COLUMNS) + encoder.encode(ROWS) + encoder.finish()
+
+        assert len(read_csv(gzip.decompress(data))) == 3
+
+
+class TestFileWriters:
+    def test_gzip_csv_file(self, tmp_path):
+        path = tmp_path / "users.csv.gz"
+        writer = open_writer("csv.gz", str(path), COLUMNS)
+        writer.write(ROWS)
+        writer.close()
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            assert list(csv.reader(f))[1][1] == "alice"
+
+    @pytest.mark.skipif(not PARQUET_AVAILABLE, reason="pyarrow is not installed")
+    def test_parquet_file_keeps_types(self, tmp_path):
+        import pyarrow.parquet as pq
+
+        path = tmp_path / "users.parquet"
+        writer = open_writer("parquet", str(path), COLUMNS)
+        writer.write(ROWS)
+        writer.write([])
+        writer.close()
+
+        table = pq.read_table(path)
+        assert table.num_rows == 2
+        assert table.column("username").to_pylist() == ["alice", None]
+
+    def test_unknown_format_is_rejected(self, tmp_path):
+        with pytest.raises(ExportError):
+            open_writer("xlsx", str(tmp_path / "users.xlsx"), COLUMNS)
+
+
+class TestUserExport:
+    @staticmethod
+    def exporter(tmp_path, monkeypatch, progress_interval):
+        exporter = UserDataExporter(export_dir=str(tmp_path), progress_interval=progress_interval)
+
+        async def chunks():
+            for row in ROWS:
+                yield [(row[0], row[1], None, None, None, "active", None, None, row[2], row[3])]
+
+        monkeypatch.setattr(exporter, "_chunks", chunks)
+        return exporter
+
+    @pytest.mark.asyncio
+    async def test_progress_is_reported_off_the_event_loop(self, tmp_path, monkeypatch):
+        loop_thread = threading.current_thread()
+        reports = []
+
+        def progress(records):
+            reports.append((records, threading.current_thread() is loop_thread))
+
+        result = await self.exporter(tmp_path, monkeypatch, 0).export_to_file("csv", progress=progress)
+
+        assert result["records"] == 2
+        assert reports == [(1, False), (2, False)]
+
+    @pytest.mark.asyncio
+    async def test_progress_is_throttled(self, tmp_path, monkeypatch):
+        reports = []
+
+        await self.exporter(tmp_path, monkeypatch, 3600).export_to_file("csv", progress=reports.append)
+
+        assert reports == []
+
+    def test_task_progress_is_stored_under_its_own_id(self, tmp_path, monkeypatch):
+        states = []
+        monkeypatch.setattr(backup_tasks, "user_data_exporter", self.exporter(tmp_path, monkeypatch, 0))
+        monkeypatch.setattr(backup_tasks, "run_async", asyncio.run)
+        monkeypatch.setattr(
+            backup_tasks.export_user_data, "update_state",
+            lambda task_id=None, state=None, meta=None: states.append((task_id, state, meta))
+        )
+
+        backup_tasks.export_user_data.push_request(id="export-1")
+        try:
+            assert backup_tasks.export_user_data.run("csv")["status"] == "success"
+        finally:
+            backup_tasks.export_user_data.pop_request()
+
+        assert states == [("export-1", "PROGRESS", {"records": 1}), ("export-1", "PROGRESS", {"records": 2})]
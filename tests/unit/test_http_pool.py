@@ -0,0 +1,40 @@
+import asyncio
+import httpx
+import pytest
+
+from services.http import HTTPClientPool, PoolConfig
+
+
+def test_clients_are_scoped_to_event_loop():
+    pool = HTTPClientPool()
+    pool.configure("marzban", PoolConfig(max_connections=3, connect_timeout=1.0, http2=False))
+
+    async def get_twice():
+        first = pool.get("marzban")
+        assert pool.get("marzban") is first
+        assert pool.get("wata") is not first
+        return first
+
+    async def get_and_close():
+        client = pool.get("marzban")
+        await pool.close()
+        return client
+
+    first = asyncio.run(get_twice())
+    second = asyncio.run(get_and_close())
+
+    assert second is not first
+    assert second.is_closed
+    assert second.timeout == httpx.Timeout(connect=1.0, read=30.0, write=30.0, pool=10.0)
+    assert second._transport.transport._pool._max_connections == 3
+
+
+@pytest.mark.asyncio
+async def test_closed_client_is_recreated():
+    pool = HTTPClientPool()
+    client = pool.get("yookassa")
+    await pool.close("yookassa")
+
+    assert client.is_closed
+    assert pool.get("yookassa") is not client
+    await pool.close()
@@ -0,0 +1,154 @@
+import pytest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from database.models import SubscriptionStatus
+from services.marzban.models import MarzbanUser, UserStatus
+from services.marzban.reconciler import (
+    MarzbanReconciler, MarzbanUsersMap, diff_subscriptions, diff_user_status, changed_user_ids
+)
+
+
+def make_marzban_user(username, status=UserStatus.ACTIVE, expire=None, used_traffic=0):
+    return MarzbanUser(
+        username=username,
+        proxies={"vless": {}},
+        status=status,
+        expire=expire,
+        used_traffic=used_traffic,
+        created_at=datetime(2024, 1, 1)
+    )
+
+
+def make_row(vpn_config_id, username, **kwargs):
+    row = {
+        'vpn_config_id': vpn_config_id,
+        'user_id': vpn_config_id * 100,
+        'marzban_user_id': username,
+        'vpn_is_active': True,
+        'traffic_used': 0,
+        'subscription_id': vpn_config_id * 10,
+        'subscription_status': SubscriptionStatus.ACTIVE,
+        'end_date': None
+    }
+    row.update(kwargs)
+    return SimpleNamespace(**row)
+
+
+class TestDiffSubscriptions:
+    def test_expired_marzban_user_expires_subscription(self):
+        users_map = {"tg_1": make_marzban_user("tg_1", status=UserStatus.EXPIRED)}
+        snapshot = [make_row(1, "tg_1")]
+
+        sub_updates, vpn_updates, synced, missing = diff_subscriptions(snapshot, users_map)
+
+        assert sub_updates == [{'id': 10, 'status': SubscriptionStatus.EXPIRED}]
+        assert vpn_updates == [{'id': 1, 'is_active': False}]
+        assert synced == [1]
+        assert missing == 0
+
+    def test_end_date_and_traffic_synced(self):
+        expire = int(datetime(2030, 1, 1, tzinfo=timezone.utc).timestamp())
+        users_map = {"tg_1": make_marzban_user("tg_1", expire=expire, used_traffic=1024)}
+        snapshot = [make_row(1, "tg_1", end_date=datetime(2029, 1, 1))]
+
+        sub_updates, vpn_updates, _, _ = diff_subscriptions(snapshot, users_map)
+
+        assert sub_updates == [{'id': 10, 'end_date': datetime(2030, 1, 1)}]
+        assert vpn_updates == [{'id': 1, 'traffic_used': 1024}]
+
+    def test_unchanged_rows_produce_no_updates(self):
+        expire = int(datetime(2030, 1, 1, tzinfo=timezone.utc).timestamp())
+        users_map = {"tg_1": make_marzban_user("tg_1", expire=expire, used_traffic=5)}
+        snapshot = [make_row(1, "tg_1", end_date=datetime(2030, 1, 1), traffic_used=5)]
+
+        sub_updates, vpn_updates, synced, _ = diff_subscriptions(snapshot, users_map)
+
+        assert sub_updates == []
+        assert vpn_updates == []
+        assert synced == [1]
+
+    def test_missing_users_are_counted(self):
+        sub_updates, vpn_updates, synced, missing = diff_subscriptions([make_row(1, "tg_1")], {})
+
+        assert (sub_updates, vpn_updates, synced, missing) == ([], [], [], 1)
+
+
+class TestDiffUserStatus:
+    def test_missing_user_deactivated(self):
+        assert diff_user_status([make_row(1, "tg_1")], {}) == [{'id': 1, 'is_active': False}]
+
+    def test_status_follows_marzban(self):
+        users_map = {
+            "tg_1": make_marzban_user("tg_1", status=UserStatus.DISABLED),
+            "tg_2": make_marzban_user("tg_2", status=UserStatus.ACTIVE)
+        }
+        snapshot = [make_row(1, "tg_1"), make_row(2, "tg_2", vpn_is_active=False)]
+
+        assert diff_user_status(snapshot, users_map) == [
+            {'id': 1, 'is_active': False},
+            {'id': 2, 'is_active': True}
+        ]
+
+    def test_unconfirmed_missing_user_left_alone(self):
+        assert diff_user_status([make_row(1, "tg_1")], {}, unconfirmed={"tg_1"}) == []
+
+    def test_traffic_only_updates_keep_cached_context(self):
+        snapshot = [make_row(1, "tg_1"), make_row(2, "tg_2")]
+        updates = [{'id': 1, 'traffic_used': 100}, {'id': 2, 'is_active': False, 'traffic_used': 5}]
+
+        assert changed_user_ids(snapshot, updates, "vpn_config_id") == [200]
+
+
+class FakeMarzbanClient:
+    """Serves /api/users from a list, capping pages at `max_page` like a panel limit"""
+
+    def __init__(self, users, max_page=2, total=None, lookups=None):
+        self.users = users
+        self.max_page = max_page
+        self.total = len(users) if total is None else total
+        self.lookups = lookups or {}
+        self.calls = []
+
+    async def get_users_page(self, offset=0, limit=50, sort=None):
+        self.calls.append((offset, sort))
+        return self.users[offset:offset + min(limit, self.max_page)], self.total
+
+    async def get_user(self, username):
+        return self.lookups.get(username)
+
+
+class TestReconciler:
+    @pytest.mark.asyncio
+    async def test_scan_pages_until_reported_total(self):
+        client = FakeMarzbanClient([make_marzban_user(f"tg_{i}") for i in range(5)])
+
+        users_map = await MarzbanReconciler(client, page_size=1000).fetch_users_map()
+
+        assert sorted(users_map) == [f"tg_{i}" for i in range(5)]
+        assert users_map.complete
+        assert client.calls == [(0, "created_at"), (2, "created_at"), (4, "created_at")]
+
+    @pytest.mark.asyncio
+    async def test_incomplete_scan_deactivates_nothing(self, fake_session):
+        snapshot = [make_row(1, "tg_1"), make_row(2, "tg_2")]
+        session = fake_session(lambda statement, params: snapshot)
+        users_map = MarzbanUsersMap({"tg_1": make_marzban_user("tg_1")}, total=2)
+
+        result = await MarzbanReconciler(FakeMarzbanClient([])).sync_user_status(session, users_map)
+
+        assert result['updated'] == 0
+        assert session.queries == 1
+
+    @pytest.mark.asyncio
+    async def test_missing_users_are_confirmed_before_deactivation(self, fake_session):
+        snapshot = [make_row(1, "tg_1"), make_row(2, "tg_2"), make_row(3, "tg_3")]
+        session = fake_session(lambda statement, params: snapshot if params is None else ())
+        users_map = MarzbanUsersMap({"tg_1": make_marzban_user("tg_1")}, total=1)
+        client = FakeMarzbanClient([], lookups={"tg_2": make_marzban_user("tg_2")})
+
+        result = await MarzbanReconciler(client).sync_user_status(session, users_map)
+
+        # tg_2 was created while the scan ran, only tg_3 is really gone
+        assert session.params[-1] == [{'id': 3, 'is_active': False}]
+        assert result['updated'] == 1
@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+
+from services.marzban.client import MarzbanClient, TokenBucket
+
+
+@pytest.mark.asyncio
+async def test_map_users_respects_max_concurrency():
+    client = MarzbanClient(max_concurrency=3, rate_limit=0)
+    in_flight = 0
+    peak = 0
+
+    async def op(username):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return username.upper()
+
+    results = {u: r async for u, r in client.map_users([f"u{i}" for i in range(10)], op)}
+
+    assert peak == 3
+    assert results == {f"u{i}": f"U{i}" for i in range(10)}
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_map_users_yields_exceptions():
+    client = MarzbanClient(max_concurrency=2, rate_limit=0)
+
+    async def op(username):
+        if username == "bad":
+            raise ValueError("boom")
+        return True
+
+    results = {u: r async for u, r in client.map_users(["ok", "bad"], op)}
+
+    assert results["ok"] is True
+    assert isinstance(results["bad"], ValueError)
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=100, capacity=1)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+
+    for _ in range(5):
+        await bucket.acquire()
+
+    assert loop.time() - started >= 0.035
@@ -0,0 +1,81 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+import pytest
+
+from services.marzban.token_manager import TokenManager, get_token_expiry
+
+
+def make_jwt(exp):
+    payload = base64.urlsafe_b64encode(json.dumps({"sub": "admin", "exp": exp}).encode()).rstrip(b"=")
+    return f"header.{payload.decode()}.signature"
+
+
+def test_get_token_expiry_reads_exp_claim():
+    assert get_token_expiry(make_jwt(1700000000)) == 1700000000
+    assert get_token_expiry("not-a-jwt") is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_refresh():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return make_jwt(int(time.time()) + 3600)
+
+    manager = TokenManager(fetch)
+    tokens = await asyncio.gather(*(manager.get_token() for _ in range(20)))
+
+    assert calls == 1
+    assert len(set(tokens)) == 1
+    assert manager.expires_at == get_token_expiry(tokens[0])
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_invalidate_refreshes_once_per_rejected_token():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        return make_jwt(int(time.time()) + 3600 + calls)
+
+    manager = TokenManager(fetch)
+    rejected = await manager.get_token()
+    fresh = await asyncio.gather(*(manager.invalidate(rejected) for _ in range(5)))
+
+    assert calls == 2
+    assert set(fresh) == {manager.token}
+    assert manager.token != rejected
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_renewal_task_of_previous_loop_is_cancelled():
+    async def fetch():
+        return make_jwt(int(time.time()) + 3600)
+
+    manager = TokenManager(fetch)
+    old_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=old_loop.run_forever)
+    thread.start()
+    try:
+        token = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(manager.get_token(), old_loop))
+        old_task = manager._refresh_task
+
+        await manager.invalidate(token)
+        await asyncio.sleep(0.05)
+
+        assert old_task.cancelled()
+        assert manager._refresh_task.get_loop() is asyncio.get_running_loop()
+    finally:
+        old_loop.call_soon_threadsafe(old_loop.stop)
+        thread.join()
+        old_loop.close()
+        await manager.close()
@@ -0,0 +1,55 @@
+import httpx
+import pytest
+
+from services.monitoring import (
+    EXTERNAL_REQUEST_DURATION, InstrumentedTransport, endpoint_label, render_metrics, statement_label
+)
+
+
+@pytest.mark.parametrize("statement,label", [
+    ("SELECT users.id FROM users WHERE users.telegram_id = $1", "select:users"),
+    ('INSERT INTO "payments" (user_id) VALUES ($1)', "insert:payments"),
+    ("UPDATE subscriptions SET status=$1 FROM users", "update:subscriptions"),
+    ("DELETE FROM usage_stats WHERE id = $1", "delete:usage_stats"),
+    ("WITH a AS (SELECT 1) SELECT * FROM a", "with"),
+    ("select pg_catalog.version()", "select"),
+    ("", "other"),
+])
+def test_statement_label(statement, label):
+    assert statement_label(statement) == label
+
+
+@pytest.mark.parametrize("path,label", [
+    ("/api/user/tg_123456", "/api/user/{id}"),
+    ("/api/user/tg_123456/usage", "/api/user/{id}/usage"),
+    ("/v3/payments/2ad6e8c4-000f-5000-9000-1b68e7b15f3f/cancel", "/v3/payments/{id}/cancel"),
+    ("/api/admin/token", "/api/admin/token"),
+])
+def test_endpoint_label(path, label):
+    assert endpoint_label(path) == label
+
+
+def sample(service, method, endpoint, status):
+    return EXTERNAL_REQUEST_DURATION.labels(service, method, endpoint, status)._sum.get()
+
+
+@pytest.mark.asyncio
+async def test_transport_records_status_and_errors():
+    def handler(request):
+        if request.url.path.endswith("broken"):
+            raise httpx.ConnectError("down", request=request)
+        return httpx.Response(404)
+
+    transport = InstrumentedTransport("test", httpx.MockTransport(handler))
+    async with httpx.AsyncClient(transport=transport, base_url="http://marzban") as client:
+        response = await client.get("/api/user/tg_1")
+        assert response.status_code == 404
+        with pytest.raises(httpx.ConnectError):
+            await client.get("/api/broken")
+
+    assert sample("test", "GET", "/api/user/{id}", "404") > 0
+    assert sample("test", "GET", "/api/broken", "error") > 0
+
+    content, _ = render_metrics()
+    assert b'external_request_duration_seconds_count' in content
+    assert b'service="test"' in content
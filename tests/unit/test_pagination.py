@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from api.pagination import decode_cursor, encode_cursor, keyset_paginate, page_rows
+from database.models import Payment
+
+
+class TestCursor:
+    def test_cursor_round_trips(self):
+        created_at = datetime(2026, 10, 17, 12, 30, tzinfo=timezone.utc)
+
+        assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+
+    def test_invalid_cursor_is_bad_request(self):
+        with pytest.raises(HTTPException) as exc_info:
+            decode_cursor("not-a-cursor")
+
+        assert exc_info.value.status_code == 400
+
+
+class TestPageRows:
+    def test_look_ahead_row_yields_next_cursor(self):
+        rows = [SimpleNamespace(id=i, created_at=datetime(2026, 10, 17 - i)) for i in range(1, 4)]
+
+        page, next_cursor = page_rows(rows, 2)
+
+        assert page == rows[:2]
+        assert decode_cursor(next_cursor) == (rows[1].created_at, rows[1].id)
+
+    def test_last_page_has_no_cursor(self):
+        rows = [SimpleNamespace(id=1, created_at=datetime(2026, 10, 17))]
+
+        assert page_rows(rows, 2) == (rows, None)
+
+
+def test_keyset_query_seeks_past_cursor():
+    cursor = encode_cursor(datetime(2026, 10, 17, tzinfo=timezone.utc), 42)
+    sql = str(keyset_paginate(select(Payment), Payment, cursor, 50).compile(dialect=postgresql.dialect()))
+
+    assert "(payments.created_at, payments.id) < (" in sql
+    assert "ORDER BY payments.created_at DESC, payments.id DESC" in sql
+    assert "OFFSET" not in sql
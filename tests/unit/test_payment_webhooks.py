@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from api.routers import payments as payments_router
+from database.models import Payment, PaymentStatus, Subscription, SubscriptionStatus, User, VPNConfig
+from services.payment import webhooks
+from services.payment.wata import WataProvider
+from services.payment.webhooks import PaymentWebhookConsumer, WebhookIngestor, WebhookRejected
+from tasks import payments as payment_tasks
+
+
+class FakeManager:
+    def __init__(self, valid=True):
+        self.valid = valid
+
+    def verify_webhook(self, provider, headers, body):
+        return self.valid
+
+    def parse_webhook(self, provider, data):
+        from services.payment.base import PaymentCallback, PaymentStatus
+        return PaymentCallback(
+            payment_id=data["payment_id"], order_id="", status=PaymentStatus(data["status"]),
+            amount=100, currency="RUB", raw_data=data
+        )
+
+    def get_webhook_event_id(self, provider, data):
+        return f"{data['payment_id']}:{data['status']}"
+
+
+@pytest.fixture
+def redis(monkeypatch, fake_redis):
+    async def ingest(keys, args):
+        if await fake_redis.set(keys[0], "1", nx=True, ex=args[0]):
+            fields = args[2:]
+            return await fake_redis.xadd(keys[1], dict(zip(fields[::2], fields[1::2])))
+
+    fake_redis.scripts[webhooks.INGEST_SCRIPT] = ingest
+    monkeypatch.setattr(webhooks, "redis_client", fake_redis)
+    # The shared ingestor keeps the script registered on the first client
+    monkeypatch.setattr(webhooks.webhook_ingestor, "_script", None)
+    return fake_redis
+
+
+def body(payment_id, status):
+    return json.dumps({"payment_id": payment_id, "status": status}).encode()
+
+
+@pytest.mark.asyncio
+async def test_ingest_queues_each_event_once(redis, monkeypatch):
+    monkeypatch.setattr(webhooks, "payment_manager", FakeManager())
+    ingestor = WebhookIngestor()
+
+    assert await ingestor.ingest("wata", {}, body("p1", "success")) == (True, "p1:success")
+    assert await ingestor.ingest("wata", {}, body("p1", "success")) == (False, "p1:success")
+    assert await ingestor.ingest("wata", {}, body("p1", "refunded")) == (True, "p1:refunded")
+
+    stream = redis.streams[webhooks.WEBHOOK_STREAM]
+    assert [fields["event_id"] for _, fields in stream] == ["p1:success", "p1:refunded"]
+    assert stream[0][1]["payment_id"] == "p1"
+
+
+@pytest.mark.asyncio
+async def test_ingest_rejects_bad_signature(redis, monkeypatch):
+    monkeypatch.setattr(webhooks, "payment_manager", FakeManager(valid=False))
+
+    with pytest.raises(WebhookRejected):
+        await WebhookIngestor().ingest("wata", {}, body("p1", "success"))
+    assert webhooks.WEBHOOK_STREAM not in redis.streams
+
+
+@pytest.mark.asyncio
+async def test_consumer_keeps_per_payment_order(redis):
+    handled = []
+
+    async def handler(provider, data):
+        # Later events must not overtake a slow earlier one of the same payment
+        await asyncio.sleep(0.01 if data["status"] == "success" else 0)
+        if data["payment_id"] == "bad":
+            raise RuntimeError("marzban down")
+        handled.append((data["payment_id"], data["status"]))
+
+    def entry(message_id, payment_id, status):
+        return message_id, {"provider": "wata", "payment_id": payment_id, "event_id": message_id,
+                            "body": body(payment_id, status).decode()}
+
+    consumer = PaymentWebhookConsumer(handler)
+    stats = {"processed": 0, "failed": 0, "dead_lettered": 0}
+    await consumer._process([
+        entry("1-0", "p1", "success"),
+        entry("2-0", "p2", "pending"),
+        entry("3-0", "p1", "refunded"),
+        entry("4-0", "bad", "success"),
+        entry("5-0", "bad", "refunded"),
+    ], stats)
+
+    assert handled.index(("p1", "success")) < handled.index(("p1", "refunded"))
+    assert ("p2", "pending") in handled
+    # The failed event and everything after it for that payment stay pending
+    assert sorted(redis.acked) == ["1-0", "2-0", "3-0"]
+    assert stats == {"processed": 3, "failed": 1, "dead_lettered": 0}
+
+
+def wata_request(body, signature):
+    """ASGI request as uvicorn builds it, header names lower-cased"""
+    scope = {"type": "http", "method": "POST", "path": "/", "headers": [(b"x-signature", signature.encode())]}
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request(scope, receive)
+
+
+class RefundingWata(WataProvider):
+    async def refund_payment(self, payment_id, amount, reason):
+        return {"success": True, "refund_id": f"refund-{payment_id}"}
+
+
+@pytest.fixture
+def wata(monkeypatch):
+    provider = RefundingWata(api_key="key", secret_key="secret")
+    monkeypatch.setitem(webhooks.payment_manager.providers, "wata", provider)
+    return provider
+
+
+def wata_body(status):
+    return json.dumps({"payment_id": "w-1", "status": status, "amount": "200"}).encode()
+
+
+def test_wata_status_changes_are_separate_events(wata):
+    pending = {"id": "w-1", "payment_id": "w-1", "status": "pending"}
+    paid = {"id": "w-1", "payment_id": "w-1", "status": "paid"}
+
+    assert wata.get_webhook_event_id(pending) != wata.get_webhook_event_id(paid)
+    assert wata.get_webhook_event_id(paid) == wata.get_webhook_event_id(dict(paid))
+
+
+@pytest.mark.asyncio
+async def test_wata_signature_is_verified_on_request_headers(redis, wata):
+    payload = wata_body("paid")
+    signature = hmac.new(b"secret", payload, hashlib.sha256).hexdigest()
+
+    assert (await payments_router._ingest_webhook("wata", wata_request(payload, signature)))["status"] == "queued"
+
+    with pytest.raises(HTTPException) as error:
+        await payments_router._ingest_webhook("wata", wata_request(wata_body("failed"), signature))
+    assert error.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_payment_paid_by_webhook_can_be_refunded(redis, wata, monkeypatch, fake_session):
+    payment = Payment(id=5, user_id=1, amount=Decimal("200"), system="wata", external_id="w-1", status="pending")
+
+    async def activate(payment, session):
+        pass
+
+    async def invalidate(user_ids):
+        pass
+
+    monkeypatch.setattr(payment_tasks, "async_session_maker", fake_session(lambda statement, params: [payment]))
+    monkeypatch.setattr(payment_tasks, "_activate_subscription_for_payment", activate)
+    monkeypatch.setattr(payment_tasks.user_context_cache, "invalidate_users", invalidate)
+    monkeypatch.setattr(payment_tasks, "WEBHOOK_CONSUMER_RUN_SECONDS", 0.05)
+
+    payload = wata_body("paid")
+    signature = hmac.new(b"secret", payload, hashlib.sha256).hexdigest()
+    await payments_router._ingest_webhook("wata", wata_request(payload, signature))
+    stats = await payment_tasks._consume_payment_webhooks()
+
+    assert stats["processed"] == 1
+    assert payment.status == PaymentStatus.SUCCESS.value
+
+    result = await payments_router.refund_payment(
+        5, payments_router.RefundRequest(reason="duplicate"),
+        current_admin=None, session=fake_session(lambda statement, params: [payment])
+    )
+
+    assert result["refund_id"] == "refund-w-1"
+    assert payment.status == PaymentStatus.REFUNDED.value
+    assert json.loads(payment.meta) == {"refund_reason": "duplicate"}
+
+
+class FakeMarzban:
+    def __init__(self):
+        self.updated = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def update_user(self, username, **kwargs):
+        self.updated.append((username, kwargs))
+
+
+@pytest.mark.asyncio
+async def test_paid_webhook_activates_subscription(redis, wata, monkeypatch, fake_session):
+    from tasks import notifications
+
+    payment = Payment(
+        id=6, user_id=1, plan_id=3, amount=Decimal("299"), system="wata", external_id="w-1",
+        status="pending", meta=json.dumps({"plan_type": "Месячная подписка", "days": "30"})
+    )
+    user = User(id=1, telegram_id=1001, auto_renew=False)
+    vpn_config = VPNConfig(id=9, user_id=1, marzban_user_id="tg_1001", is_active=False)
+    rows = {Payment: [payment], User: [user], Subscription: [], VPNConfig: [vpn_config]}
+    session = fake_session(lambda statement, params: rows[statement.column_descriptions[0]["entity"]])
+    marzban = FakeMarzban()
+    notified = []
+
+    async def invalidate(user_ids):
+        pass
+
+    monkeypatch.setattr(payment_tasks, "async_session_maker", session)
+    monkeypatch.setattr(payment_tasks, "marzban_client", marzban)
+    monkeypatch.setattr(payment_tasks.user_context_cache, "invalidate_users", invalidate)
+    monkeypatch.setattr(notifications.send_payment_success_notification, "delay", lambda **kwargs: notified.append(kwargs))
+    monkeypatch.setattr(payment_tasks, "WEBHOOK_CONSUMER_RUN_SECONDS", 0.05)
+
+    payload = wata_body("paid")
+    signature = hmac.new(b"secret", payload, hashlib.sha256).hexdigest()
+    await payments_router._ingest_webhook("wata", wata_request(payload, signature))
+    stats = await payment_tasks._consume_payment_webhooks()
+
+    assert stats["processed"] == 1
+    assert payment.status == PaymentStatus.SUCCESS.value
+    subscription = next(added for added in session.added if isinstance(added, Subscription))
+    assert (subscription.plan_id, subscription.status) == (3, SubscriptionStatus.ACTIVE)
+    assert subscription.end_date - subscription.start_date == timedelta(days=30)
+    assert vpn_config.is_active
+    assert marzban.updated[0][0] == "tg_1001"
+    assert notified[0]["subscription_data"]["plan_type"] == "Месячная подписка"
@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from services.payment import PaymentStatus
+from tasks import payments
+
+
+class PaymentStore:
+    """Payments in memory behind the task's batch read and status update"""
+
+    def __init__(self, rows):
+        self.rows = {row.id: row for row in rows}
+        self.batches = 0
+        self.updates = 0
+
+    async def stale_pending(self, cutoff_time, after_id, limit):
+        self.batches += 1
+        pending = sorted(
+            (row for row in self.rows.values()
+             if row.status == "pending" and row.created_at < cutoff_time and row.id > after_id),
+            key=lambda row: row.id
+        )
+        return pending[:limit]
+
+    async def update_pending(self, statuses):
+        self.updates += 1
+        updated = 0
+        for payment_id, status in statuses.items():
+            row = self.rows[payment_id]
+            if row.status == "pending":
+                row.status = status
+                updated += 1
+        return updated
+
+    def statuses(self):
+        return {row.id: row.status for row in self.rows.values()}
+
+
+class FakeManager:
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.in_flight = {}
+        self.max_in_flight = {}
+
+    async def get_payment_status(self, external_id, system):
+        self.in_flight[system] = self.in_flight.get(system, 0) + 1
+        self.max_in_flight[system] = max(self.max_in_flight.get(system, 0), self.in_flight[system])
+        await asyncio.sleep(0.01)
+        self.in_flight[system] -= 1
+        status = self.statuses[external_id]
+        if isinstance(status, Exception):
+            raise status
+        return status
+
+
+def payment(id, system="yookassa", external_id=None, age=timedelta(hours=2)):
+    return SimpleNamespace(
+        id=id, system=system, external_id=external_id if external_id is not None else f"ext{id}",
+        created_at=datetime.now() - age, status="pending"
+    )
+
+
+@pytest.mark.asyncio
+async def test_pending_payments_are_reconciled_in_batches(monkeypatch):
+    rows = [
+        payment(1), payment(2), payment(3, system="wata"), payment(4, external_id=""),
+        payment(5), payment(6, age=timedelta(days=2)), payment(7, age=timedelta(minutes=5)),
+    ]
+    store = PaymentStore(rows)
+    manager = FakeManager({
+        "ext1": PaymentStatus.SUCCESS,
+        "ext2": PaymentStatus.CANCELLED,
+        "ext3": PaymentStatus.PENDING,
+        "ext5": RuntimeError("provider down"),
+        "ext6": RuntimeError("provider down"),
+    })
+    activated = []
+
+    monkeypatch.setattr(payments, "_stale_pending_payments", store.stale_pending)
+    monkeypatch.setattr(payments, "_update_pending_statuses", store.update_pending)
+    monkeypatch.setattr(payments, "payment_manager", manager)
+    monkeypatch.setattr(payments, "PENDING_RECONCILE_BATCH_SIZE", 3)
+    monkeypatch.setattr(payments.settings, "payment_reconcile_concurrency", 1)
+    monkeypatch.setattr(payments.apply_payment_status, "delay", lambda *args: activated.append(args))
+
+    stats = await payments._cleanup_pending_payments()
+
+    assert activated == [("ext1", PaymentStatus.SUCCESS.value)]
+    # Paid payments are left to apply_payment_status, unknown ones stay pending until they expire
+    assert store.statuses() == {
+        1: "pending", 2: "cancelled", 3: "pending", 4: "failed", 5: "pending", 6: "failed", 7: "pending"
+    }
+    assert store.batches == 3
+    assert store.updates == 2
+    assert manager.max_in_flight == {"yookassa": 1, "wata": 1}
+    assert stats == {"checked": 6, "activated": 1, "updated": 3, "errors": 2}
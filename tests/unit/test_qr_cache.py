@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendPhoto
+from aiogram.types import BufferedInputFile
+
+from services.cache import qr
+from services.cache.qr import QRCodeCache, config_digest
+
+
+@pytest.fixture
+def redis(monkeypatch, fake_redis):
+    monkeypatch.setattr(qr, "redis_client", fake_redis)
+    return fake_redis
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    calls = []
+
+    def render(config_data):
+        calls.append(config_data)
+        return f"png:{config_data}".encode()
+
+    monkeypatch.setattr(qr, "render_qr_png", render)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_png_is_rendered_once_per_config(redis, renders):
+    cache = QRCodeCache()
+
+    pngs = await asyncio.gather(*(cache.get_png("vless://a") for _ in range(5)))
+    assert pngs == [b"png:vless://a"] * 5
+    assert await cache.get_png("vless://a") == b"png:vless://a"
+    assert renders == ["vless://a"]
+
+    await cache.get_png("vless://b")
+    assert renders == ["vless://a", "vless://b"]
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_photo_reuses_telegram_file_id(redis, renders):
+    cache = QRCodeCache()
+
+    photo = await cache.get_photo("vless://a")
+    assert isinstance(photo, BufferedInputFile)
+
+    sent = SimpleNamespace(photo=[SimpleNamespace(file_id="small"), SimpleNamespace(file_id="large")])
+    await cache.remember_file_id("vless://a", sent)
+    assert await cache.get_photo("vless://a") == "large"
+
+    # A reset config gets a new address
+    assert isinstance(await cache.get_photo("vless://b"), BufferedInputFile)
+    assert config_digest("vless://a") != config_digest("vless://b")
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_rejected_file_id_is_replaced_by_upload(redis, renders):
+    cache = QRCodeCache()
+    sent = []
+
+    async def send(photo):
+        if photo == "stale":
+            raise TelegramBadRequest(method=SendPhoto(chat_id=1, photo=photo), message="wrong file identifier")
+        sent.append(photo)
+        return SimpleNamespace(photo=[SimpleNamespace(file_id="fresh")])
+
+    await cache.remember_file_id("vless://a", SimpleNamespace(photo=[SimpleNamespace(file_id="stale")]))
+    await cache.send_photo("vless://a", send)
+
+    assert isinstance(sent[0], BufferedInputFile)
+    assert await cache.get_photo("vless://a") == "fresh"
+    assert redis.ttls[f"qr:file_id:{config_digest('vless://a')}"] == qr.QR_FILE_ID_TTL
+    cache.close()
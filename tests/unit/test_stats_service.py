@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from services.stats.stats_service import StatsService
+
+
+class ZeroRow(tuple):
+    """Aggregate row whose every column is 0"""
+
+    def __new__(cls):
+        return super().__new__(cls, (0,))
+
+    def __getattr__(self, name):
+        return 0
+
+
+@pytest.mark.asyncio
+async def test_dashboard_stats_uses_one_query_per_table(fake_session):
+    session = fake_session(lambda statement, params: [ZeroRow()])
+    service = StatsService(session_factory=session)
+
+    stats = await service.get_dashboard_stats()
+
+    statements = [str(statement.compile(dialect=postgresql.dialect())) for statement in session.statements]
+    assert len(statements) == 6
+    user_query = next(s for s in statements if "FROM users" in s)
+    assert user_query.count("FILTER (WHERE") == 4
+    assert stats['users']['active_users'] == 0
+    assert 'active_users' not in stats['subscriptions']
+    assert set(stats['vpn_usage']) == {'active_vpn_configs', 'active_users_today', 'total_data_usage_gb'}
+
+
+@pytest.mark.asyncio
+async def test_payment_stats_count_webhook_paid_payments(fake_session):
+    session = fake_session(lambda statement, params: [ZeroRow()])
+    service = StatsService(session_factory=session)
+
+    await service.get_dashboard_stats()
+
+    payment_query = next(s for s in session.statements if "FROM payments" in str(s))
+    sql = payment_query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    assert "'success'" in str(sql)
+
+
+@pytest.mark.asyncio
+async def test_dashboard_stats_run_in_the_given_session(fake_session):
+    pooled = fake_session()
+    session = fake_session(lambda statement, params: [ZeroRow()])
+
+    await StatsService(session_factory=pooled).get_dashboard_stats(session)
+
+    assert session.queries == 6
+    assert pooled.queries == 0
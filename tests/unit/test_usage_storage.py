@@ -0,0 +1,63 @@
+import json
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+from services.stats.usage_storage import (
+    WATERMARK_KEY, UsageStorage, add_months, month_start, partition_ddl, partition_month, partition_name
+)
+
+
+@pytest.fixture
+def session_at(fake_session):
+    """Session whose usage watermark is `watermark`"""
+    def make(watermark):
+        setting = SimpleNamespace(value=json.dumps(watermark.isoformat()))
+        return fake_session(objects={WATERMARK_KEY: setting})
+    return make
+
+
+class TestPartitionHelpers:
+    def test_add_months_wraps_years(self):
+        assert add_months(date(2026, 11, 1), 2) == date(2027, 1, 1)
+        assert add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+
+    def test_partition_name_round_trips(self):
+        month = date(2026, 3, 1)
+
+        assert partition_name(month) == "usage_stats_2026_03"
+        assert partition_month(partition_name(month)) == month
+        assert partition_month("usage_stats_default") is None
+
+    def test_partition_bounds_cover_one_month(self):
+        ddl = partition_ddl(date(2026, 12, 1))
+
+        assert "PARTITION OF usage_stats" in ddl
+        assert "FROM ('2026-12-01') TO ('2027-01-01')" in ddl
+
+
+class TestUsageStorage:
+    @pytest.mark.asyncio
+    async def test_recent_range_reads_daily_rows(self, session_at):
+        storage = UsageStorage()
+        resolution, _ = await storage.usage_rows(session_at(date(2026, 7, 1)), date(2026, 9, 17))
+
+        assert resolution == 'day'
+
+    @pytest.mark.asyncio
+    async def test_range_before_watermark_reads_monthly_rows(self, session_at):
+        storage = UsageStorage()
+        resolution, _ = await storage.usage_rows(session_at(date(2026, 7, 1)), date(2026, 4, 17))
+
+        assert resolution == 'month'
+
+    @pytest.mark.asyncio
+    async def test_downsample_skips_months_already_rolled_up(self, session_at):
+        storage = UsageStorage(downsample_after_days=90)
+        session = session_at(date(2026, 7, 1))
+
+        watermark = await storage.downsample(session, today=date(2026, 10, 17))
+
+        assert watermark == month_start(date(2026, 7, 19))
+        assert session.statements == []
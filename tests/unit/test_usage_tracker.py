@@ -0,0 +1,69 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from services.marzban.models import MarzbanUser
+from services.stats.usage_tracker import compute_usage_deltas
+
+
+def make_marzban_user(username, used_traffic=0, lifetime_used_traffic=0):
+    return MarzbanUser(
+        username=username,
+        proxies={"vless": {}},
+        used_traffic=used_traffic,
+        lifetime_used_traffic=lifetime_used_traffic,
+        created_at=datetime(2024, 1, 1)
+    )
+
+
+def make_row(user_id, username, used_traffic=None, lifetime_used_traffic=None):
+    return SimpleNamespace(
+        user_id=user_id,
+        marzban_user_id=username,
+        used_traffic=used_traffic,
+        lifetime_used_traffic=lifetime_used_traffic
+    )
+
+
+class TestComputeUsageDeltas:
+    def test_delta_is_growth_of_cumulative_counter(self):
+        users_map = {"tg_1": make_marzban_user("tg_1", used_traffic=1500)}
+        snapshots, deltas = compute_usage_deltas([make_row(1, "tg_1", used_traffic=1000)], users_map)
+
+        assert deltas == {1: 500}
+        assert snapshots == [{'user_id': 1, 'used_traffic': 1500, 'lifetime_used_traffic': 0}]
+
+    def test_first_snapshot_only_sets_baseline(self):
+        users_map = {"tg_1": make_marzban_user("tg_1", used_traffic=10 ** 9)}
+        snapshots, deltas = compute_usage_deltas([make_row(1, "tg_1")], users_map)
+
+        assert deltas == {}
+        assert snapshots[0]['used_traffic'] == 10 ** 9
+
+    def test_counter_reset_counts_traffic_since_reset(self):
+        users_map = {"tg_1": make_marzban_user("tg_1", used_traffic=200)}
+        _, deltas = compute_usage_deltas([make_row(1, "tg_1", used_traffic=5000)], users_map)
+
+        assert deltas == {1: 200}
+
+    def test_lifetime_counter_survives_reset(self):
+        users_map = {"tg_1": make_marzban_user("tg_1", used_traffic=200, lifetime_used_traffic=5300)}
+        row = make_row(1, "tg_1", used_traffic=5000, lifetime_used_traffic=5000)
+        _, deltas = compute_usage_deltas([row], users_map)
+
+        assert deltas == {1: 300}
+
+    def test_users_missing_from_marzban_keep_their_snapshot(self):
+        snapshots, deltas = compute_usage_deltas([make_row(1, "tg_1", used_traffic=100)], {})
+
+        assert snapshots == [] and deltas == {}
+
+    def test_first_config_of_user_wins(self):
+        users_map = {
+            "tg_1": make_marzban_user("tg_1", used_traffic=300),
+            "tg_1_old": make_marzban_user("tg_1_old", used_traffic=9000),
+        }
+        snapshot = [make_row(1, "tg_1", used_traffic=100), make_row(1, "tg_1_old", used_traffic=100)]
+        snapshots, deltas = compute_usage_deltas(snapshot, users_map)
+
+        assert deltas == {1: 200}
+        assert len(snapshots) == 1
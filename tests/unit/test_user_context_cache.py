@@ -0,0 +1,115 @@
+import pytest
+from collections import namedtuple
+from datetime import datetime
+
+from services.cache import user_context
+from services.cache.models import UserContext, SubscriptionContext
+from services.cache.user_context import UserContextCache
+
+
+class CountingCache(UserContextCache):
+    """Cache with the database loader replaced by an in-memory one"""
+
+    def __init__(self, contexts, **kwargs):
+        super().__init__(ttl=60, local_ttl=5, local_size=2, **kwargs)
+        self.contexts = contexts
+        self.loads = 0
+
+    async def load(self, telegram_id):
+        self.loads += 1
+        return self.contexts.get(telegram_id)
+
+
+def make_context(user_id, telegram_id):
+    return UserContext(
+        user_id=user_id,
+        telegram_id=telegram_id,
+        subscription=SubscriptionContext(id=1, status="active", end_date=datetime(2030, 1, 1))
+    )
+
+
+@pytest.fixture(autouse=True)
+def redis(monkeypatch, fake_redis):
+    monkeypatch.setattr(user_context, "redis_client", fake_redis)
+    return fake_redis
+
+
+@pytest.mark.asyncio
+async def test_database_is_hit_once(redis):
+    cache = CountingCache({100: make_context(1, 100)})
+
+    first = await cache.get(100)
+    second = await cache.get(100)
+
+    assert first == second
+    assert cache.loads == 1
+    assert "user_ctx:100" in redis.data
+
+
+@pytest.mark.asyncio
+async def test_redis_serves_other_processes(redis):
+    await CountingCache({100: make_context(1, 100)}).get(100)
+
+    other = CountingCache({})
+    context = await other.get(100)
+
+    assert other.loads == 0
+    assert context.subscription.end_date == datetime(2030, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_invalidate_by_user_id(redis):
+    cache = CountingCache({100: make_context(1, 100)})
+    await cache.get(100)
+
+    await cache.invalidate_users([1])
+    await cache.get(100)
+
+    assert cache.loads == 2
+
+
+@pytest.mark.asyncio
+async def test_unknown_users_are_not_cached(redis):
+    cache = CountingCache({})
+
+    assert await cache.get(100) is None
+    assert await cache.get(100) is None
+    assert cache.loads == 2
+
+
+def test_local_lru_evicts_oldest():
+    lru = user_context.LocalLRU(maxsize=2, ttl=60)
+    for telegram_id in (1, 2, 3):
+        lru.set(telegram_id, make_context(telegram_id, telegram_id))
+
+    assert lru.get(1) is None
+    assert lru.get(3) is not None
+
+
+class FakeMessage:
+    def __init__(self, telegram_id):
+        self.from_user = type("FromUser", (), {"id": telegram_id})()
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+
+TotalsRow = namedtuple("TotalsRow", "total_payments total_spent total_days referral_count bonus_days")
+
+
+@pytest.mark.asyncio
+async def test_stats_screen_reads_user_from_context(monkeypatch, fake_session):
+    from bot.handlers import stats_handler
+
+    session = fake_session(respond=lambda statement, params: [TotalsRow(2, 598, None, 1, 3)])
+    monkeypatch.setattr(stats_handler, "async_session_maker", session)
+    monkeypatch.setattr(stats_handler, "Message", FakeMessage)
+
+    message = FakeMessage(100)
+    await stats_handler.show_user_stats(message, user_ctx=make_context(1, 100))
+
+    assert session.queries == 1
+    assert "users.telegram_id" not in str(session.statements[0])
+    assert "Всего платежей: 2" in message.answers[0]
+    assert "Бонусные дни: 3" in message.answers[0]
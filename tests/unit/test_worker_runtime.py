@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+
+from tasks import runtime
+
+
+@pytest.fixture
+def worker_runtime():
+    runtime.start_runtime()
+    yield runtime
+    with runtime._lock:
+        loop, thread = runtime._loop, runtime._thread
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
+        runtime._loop = runtime._thread = runtime._pid = runtime._bot = None
+
+
+def test_run_async_reuses_one_loop(worker_runtime):
+    async def current_loop():
+        return asyncio.get_running_loop()
+
+    first = worker_runtime.run_async(current_loop())
+    second = worker_runtime.run_async(current_loop())
+
+    assert first is second is worker_runtime._loop
+    assert first.is_running()
+
+
+def test_run_async_propagates_exceptions(worker_runtime):
+    async def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        worker_runtime.run_async(fail())
+
+
+def test_get_bot_is_shared(worker_runtime):
+    assert worker_runtime.get_bot() is worker_runtime.get_bot()